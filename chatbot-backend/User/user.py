@@ -4,6 +4,7 @@ from fastapi import APIRouter, HTTPException, status
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 from database.database_utils import supabase  # Database connection via database_utils.py
+from utils.executors import run_in_pool
 
 load_dotenv()
 
@@ -51,7 +52,8 @@ async def register(user: dict):
             detail="A user with this email is already registered."
         )
     
-    hashed_password = hash_password(password)
+    # bcrypt is deliberately slow, keep it off the event loop
+    hashed_password = await run_in_pool("auth", hash_password, password)
     
     user_data = {
         "first_name": user.get("first_name"),
@@ -97,7 +99,7 @@ async def login(user: dict):
         )
     
     db_user = result.data[0]
-    if not verify_password(password, db_user.get("password_hash", "")):
+    if not await run_in_pool("auth", verify_password, password, db_user.get("password_hash", "")):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect password."
@@ -5,90 +5,180 @@ import soundfile as sf
 from io import BytesIO
 from pydub import AudioSegment
 import json
+import re
+import queue
+import threading
 import numpy as np
+import tts_protocol
+
+
+
+def load_model():
+    """
+    Load the model, limited to KOKORO_THREADS ONNX Runtime threads when set (several workers share the CPU).
+    """
+    threads = int(os.environ.get("KOKORO_THREADS", 0))
+    if not threads:
+        return Kokoro("kokoro-v1.0.onnx", "voices-v1.0.bin")
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    session = ort.InferenceSession("kokoro-v1.0.onnx", sess_options=options, providers=ort.get_available_providers())
+    return Kokoro.from_session(session, "voices-v1.0.bin")
+
+
+class FrameWriter:
+    """Writes protocol frames to stdout, from the reader thread (pongs) and the synthesis loop"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def send(self, msg_type, request_id, payload=b""):
+        with self.lock:
+            self.stream.write(tts_protocol.pack_header(msg_type, request_id, len(payload)))
+            if payload:
+                self.stream.write(payload)
+            self.stream.flush()
+
+    def send_audio(self, request_id, samples, sample_rate, msg_type=tts_protocol.AUDIO):
+        """Send int16 samples in slices, the last one with `msg_type`"""
+        pcm = memoryview(np.ascontiguousarray(samples, dtype="<i2")).cast("B")
+        rate = tts_protocol.SAMPLE_RATE.pack(sample_rate)
+        step = tts_protocol.MAX_AUDIO_PAYLOAD
+        for i in range(0, max(len(pcm), 1), step):
+            last = i + step >= len(pcm)
+            self.send(msg_type if last else tts_protocol.AUDIO, request_id, rate + bytes(pcm[i:i + step]))
+
+
+## Streamed sentences shorter than this are synthesized in one piece
+STREAM_SPLIT_CHARS = int(os.environ.get("KOKORO_STREAM_SPLIT_CHARS", 80))
+## Pieces are at least this long (shorter phrases are joined) and at most max chars (cut at a space)
+STREAM_MIN_CHARS = int(os.environ.get("KOKORO_STREAM_MIN_CHARS", 30))
+STREAM_MAX_CHARS = int(os.environ.get("KOKORO_STREAM_MAX_CHARS", 200))
+PHRASE_BOUNDARY = re.compile(r"(?<=[,;:])\s+")
+
+
+def split_phrases(text):
+    """Split a long sentence at phrase boundaries (, ; :) into pieces that can be synthesized separately"""
+    if len(text) < STREAM_SPLIT_CHARS:
+        return [text]
+    pieces = []
+    current = ""
+    for phrase in PHRASE_BOUNDARY.split(text):
+        current = f"{current} {phrase}" if current else phrase
+        while len(current) > STREAM_MAX_CHARS:
+            cut = current.rfind(" ", STREAM_MIN_CHARS, STREAM_MAX_CHARS)
+            if cut < 0:
+                break
+            pieces.append(current[:cut])
+            current = current[cut + 1:]
+        if len(current) >= STREAM_MIN_CHARS:
+            pieces.append(current)
+            current = ""
+    if current:
+        # A short tail is joined with the previous piece
+        if pieces and len(current) < STREAM_MIN_CHARS:
+            pieces[-1] = f"{pieces[-1]} {current}"
+        else:
+            pieces.append(current)
+    return pieces
+
+
+def read_exactly(stream, size):
+    """Read `size` bytes, None if the stream closed"""
+    data = bytearray()
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def read_requests(stdin, writer, requests, cancelled):
+    """Reader thread: answer pings right away, queue generate requests and record cancellations"""
+    try:
+        while True:
+            header = read_exactly(stdin, tts_protocol.HEADER.size)
+            if header is None:
+                print("Input stream closed", file=sys.stderr)
+                break
+            msg_type, request_id, length = tts_protocol.unpack_header(header)
+            payload = read_exactly(stdin, length) if length else b""
+            if payload is None:
+                break
+            if msg_type == tts_protocol.PING:
+                writer.send(tts_protocol.PONG, request_id)
+            elif msg_type == tts_protocol.GENERATE:
+                requests.put((request_id, json.loads(payload.decode("utf-8"))))
+            elif msg_type == tts_protocol.CANCEL:
+                cancelled.add(request_id)
+    except Exception as e:
+        print(f"Server reader error: {e}", file=sys.stderr)
+    finally:
+        requests.put(None)
+
+
+def to_int16(samples):
+    if isinstance(samples, bytes):
+        # Assume samples is already a WAV file.
+        samples, _ = sf.read(BytesIO(samples), dtype="int16")
+    if samples.dtype != np.int16:
+        samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+    return samples
 
 
-
-model = Kokoro("kokoro-v1.0.onnx", "voices-v1.0.bin")
-
 def run_server():
-    """Run as a persistent TTS server process"""
+    """Run as a persistent TTS server process, see tts_protocol for the framing"""
     print("Initializing Kokoro TTS server...", file=sys.stderr)
-    model = Kokoro("kokoro-v1.0.onnx", "voices-v1.0.bin")
+    model = load_model()
     print("Model loaded successfully", file=sys.stderr)
 
     stdin = os.fdopen(sys.stdin.fileno(), 'rb', buffering=0)
     stdout = os.fdopen(sys.stdout.fileno(), 'wb', buffering=0)
+    writer = FrameWriter(stdout)
+    requests = queue.Queue()
+    cancelled = set()
+    threading.Thread(target=read_requests, args=(stdin, writer, requests, cancelled), daemon=True).start()
 
     while True:
+        item = requests.get()
+        if item is None:
+            break
+        request_id, request = item
+        if request_id in cancelled:
+            cancelled.discard(request_id)
+            writer.send(tts_protocol.DONE, request_id)
+            continue
         try:
-            length_bytes = stdin.read(4)
-            if not length_bytes:
-                print("Input stream closed", file=sys.stderr)
-                break
-
-            msg_length = int.from_bytes(length_bytes, 'big')
-            message = stdin.read(msg_length).decode('utf-8')
-            request = json.loads(message)
-
-            if request["type"] == "ping":
-                stdout.write((0).to_bytes(4, 'big'))
-                stdout.flush()
-                continue
-
-            if request["type"] == "generate":
-                text = request["text"]
-                #print(f"Generating audio for: {text}", file=sys.stderr)
-                
+            #print(f"Generating audio for: {request['text']}", file=sys.stderr)
+            if request.get("stream"):
+                # Send every piece as soon as it is synthesized, each ends with a PARTIAL frame
+                for piece in split_phrases(request["text"]):
+                    if request_id in cancelled:
+                        break
+                    samples, sample_rate = model.create(
+                        piece,
+                        voice=request.get("voice", "af_sky"),
+                        speed=request.get("speed", 1.0),
+                        lang="en-us"
+                    )
+                    writer.send_audio(request_id, to_int16(samples), sample_rate, msg_type=tts_protocol.PARTIAL)
+            else:
                 samples, sample_rate = model.create(
-                    text,
-                    voice="af_sky",
-                    speed=1.0,
+                    request["text"],
+                    voice=request.get("voice", "af_sky"),
+                    speed=request.get("speed", 1.0),
                     lang="en-us"
                 )
-
-                if isinstance(samples, bytes):
-                    # Assume samples is already a WAV file.
-                    audio_data = samples
-                else:
-                    # Convert raw samples to WAV.
-                    if samples.dtype != np.int16:
-                        samples = (samples * 32767).astype(np.int16)
-                    audio_buffer = BytesIO()
-                    sf.write(audio_buffer, samples, sample_rate, format='WAV', subtype='PCM_16')
-                    audio_data = audio_buffer.getvalue()
-
-                """
-                # Normalize and convert to int16
-                if samples.dtype != np.int16:
-                    samples = (samples * 32767).astype(np.int16)
-
-                # Generate WAV in memory
-                audio_buffer = BytesIO()
-                sf.write(audio_buffer, samples, sample_rate, format='WAV', subtype='PCM_16')
-                audio_data = audio_buffer.getvalue()
-                """
-
-                #print(f"Generated audio size: {len(audio_data)} bytes", file=sys.stderr)
-
-                # Send full size first
-                stdout.write(len(audio_data).to_bytes(4, 'big'))
-                
-                # Send data in chunks to avoid buffer issues
-                chunk_size = 32768
-                for i in range(0, len(audio_data), chunk_size):
-                    chunk = audio_data[i:i + chunk_size]
-                    stdout.write(chunk)
-                    stdout.flush()
-                
-                #print(f"Audio data sent successfully", file=sys.stderr)
-
+                writer.send_audio(request_id, to_int16(samples), sample_rate)
+            writer.send(tts_protocol.DONE, request_id)
         except Exception as e:
             print(f"Server error: {e}", file=sys.stderr)
-            error_msg = json.dumps({"error": str(e)}).encode('utf-8')
-            stdout.write(len(error_msg).to_bytes(4, 'big'))
-            stdout.write(error_msg)
-            stdout.flush()
+            writer.send(tts_protocol.ERROR, request_id, str(e).encode("utf-8"))
+        cancelled.discard(request_id)
 
 if __name__ == "__main__":
     if "--server" in sys.argv:
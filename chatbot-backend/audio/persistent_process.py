@@ -9,12 +9,89 @@ import json
 from asyncio import Queue
 import sys
 import os
+import time
+from audio import tts_protocol
+from utils.metrics import STAGE_SECONDS
+
+## Preallocated audio buffer per character of text (Kokoro speaks ~15 characters/s at 24 kHz, 16-bit mono)
+BYTES_PER_CHAR = 4096
+
+
+class TTSRequestError(RuntimeError):
+    """
+    Raised when the bridge reports that a request failed, the process itself is still usable.
+    """
+
+
+class _PendingRequest:
+    """
+    Audio of a request in flight, read into a buffer preallocated from the text length.
+    The first 44 bytes are left for the WAV header, written once the request (or the piece, when streaming) is done.
+    """
+    __slots__ = ("buffer", "size", "sample_rate", "done", "pieces")
+
+    def __init__(self, capacity: int, stream: bool = False):
+        self.buffer = bytearray(tts_protocol.WAV_HEADER_SIZE + capacity)
+        self.size = tts_protocol.WAV_HEADER_SIZE
+        self.sample_rate = None
+        self.done = asyncio.get_running_loop().create_future()
+        # Completed pieces of a streamed request, None once the request ended
+        self.pieces = asyncio.Queue() if stream else None
+
+    def write(self, pcm: bytes) -> None:
+        end = self.size + len(pcm)
+        if end > len(self.buffer):
+            self.buffer.extend(bytes(max(end, 2 * len(self.buffer)) - len(self.buffer)))
+        self.buffer[self.size:end] = pcm
+        self.size = end
+
+    def wav(self) -> memoryview:
+        self.buffer[:tts_protocol.WAV_HEADER_SIZE] = tts_protocol.wav_header(
+            self.sample_rate or 24000, self.size - tts_protocol.WAV_HEADER_SIZE)
+        return memoryview(self.buffer)[:self.size]
+
+    def end_piece(self) -> None:
+        """
+        Hands the audio received so far to the stream as one WAV file and continues in a new buffer.
+        """
+        self.pieces.put_nowait(self.wav())
+        self.buffer = bytearray(len(self.buffer))
+        self.size = tts_protocol.WAV_HEADER_SIZE
+
+    def end_stream(self) -> None:
+        if self.pieces is not None:
+            self.pieces.put_nowait(None)
+
 
 class KokoroTTSWorker:
-    def __init__(self):
+    """
+    Client of one `kokoro_bridge.py --server` process, speaking the framed protocol of `tts_protocol`.
+
+    Requests are pipelined: each is written with its own id as soon as it is made, and a reader task
+    routes the response frames to the request they belong to.
+    """
+
+    def __init__(self, worker_id: int = 0, threads: int = None, start_timeout_s: float = 120):
+        """
+        Args:
+            worker_id (int): Index of the worker in its pool, used in logs and metrics.
+            threads (int, optional): ONNX Runtime threads of the process (KOKORO_THREADS), all cores if None.
+            start_timeout_s (float): Time a new process has to load the model and answer its first ping,
+                it is killed after that.
+        """
+        self.worker_id = worker_id
+        self.threads = threads
+        self.start_timeout_s = start_timeout_s
         self.process = None
         self.ready = asyncio.Event()
         self._start_task = None
+        # Requests sent to this worker and not answered yet (waiting for the process to start included)
+        self.in_flight = 0
+        # Requests and pings waiting for a response from the current process, by request id
+        self._requests = {}
+        self._pings = {}
+        self._next_id = 0
+        self._last_progress = time.monotonic()
         self.kokoro_venv_path = os.getenv("KOKORO_VENV_PATH")
         if not self.kokoro_venv_path:
             raise ValueError("KOKORO_VENV_PATH environment variable not set")
@@ -23,20 +100,38 @@ class KokoroTTSWorker:
         if not os.path.exists(self.python_executable):
             raise ValueError(f"Python executable not found at {self.python_executable}")
         
-        # Lock for synchronized access to process streams
+        # Serializes the writes to the process stdin
         self._stdin_lock = asyncio.Lock()
-        self._stdout_lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None and self.ready.is_set()
+
+    @property
+    def starting(self) -> bool:
+        return self._start_task is not None and not self._start_task.done()
+
+    def busy_for(self) -> float:
+        """
+        Seconds since the process last sent a frame while requests are waiting for it, 0 when idle.
+        """
+        return time.monotonic() - self._last_progress if self._requests else 0.0
 
     async def ensure_worker_ready(self):
-        if self.process is None:
-            if self._start_task is None:
+        if not self.alive:
+            # A failed or crashed start is retried by the next caller
+            if self._start_task is None or self._start_task.done():
+                self._discard_process()
                 self._start_task = asyncio.create_task(self._start_worker())
             await self._start_task
             await self.ready.wait()
 
     async def _start_worker(self):
         try:
-            print("Starting TTS worker process...")
+            print(f"Starting TTS worker process {self.worker_id}...")
+            env = dict(os.environ)
+            if self.threads:
+                env["KOKORO_THREADS"] = str(self.threads)
             self.process = await asyncio.create_subprocess_exec(
                 self.python_executable,
                 'kokoro_bridge.py',
@@ -44,98 +139,312 @@ class KokoroTTSWorker:
                 stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
-                cwd=os.path.dirname(os.path.abspath(__file__))
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                env=env,
             )
-            print("TTS worker process started")
+            print(f"TTS worker process {self.worker_id} started")
+            self._requests, self._pings = {}, {}
             
-            # Start the error logger
-            asyncio.create_task(self._log_stderr())
+            # Start the error logger and the response reader
+            asyncio.create_task(self._log_stderr(self.process))
+            asyncio.create_task(self._read_frames(self.process, self._requests, self._pings))
             
-            # Send ping message
-            async with self._stdin_lock, self._stdout_lock:
-                message = json.dumps({"type": "ping"})
-                length_bytes = len(message).to_bytes(4, 'big')
-                self.process.stdin.write(length_bytes)
-                self.process.stdin.write(message.encode('utf-8'))
-                await self.process.stdin.drain()
-                
-                # Wait for pong
-                size_bytes = await self.process.stdout.read(4)
-                if size_bytes:
-                    self.ready.set()
-                    print("TTS worker ready")
-                else:
-                    raise RuntimeError("Worker failed to respond to ping")
+            # Wait for pong (sent once the model is loaded)
+            try:
+                await asyncio.wait_for(self._ping(self.process), self.start_timeout_s)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"no answer within {self.start_timeout_s:g}s of starting")
+            self.ready.set()
+            print(f"TTS worker {self.worker_id} ready")
                 
         except Exception as e:
-            print(f"Failed to start TTS worker: {e}")
-            if self.process:
-                try:
-                    self.process.terminate()
-                    await self.process.wait()
-                except:
-                    pass
-            self.process = None
-            self.ready.clear()
+            print(f"Failed to start TTS worker {self.worker_id}: {e}")
+            self._discard_process()
             raise
 
-    async def _log_stderr(self):
+    ############################################################################################################
+
+    def _new_request_id(self) -> int:
+        self._next_id = (self._next_id + 1) % 2 ** 32
+        return self._next_id
+
+    async def _send(self, process, msg_type: int, request_id: int, payload: bytes = b"") -> None:
+        async with self._stdin_lock:
+            process.stdin.write(tts_protocol.pack_header(msg_type, request_id, len(payload)) + payload)
+            await process.stdin.drain()
+
+    def _cancel_nowait(self, process, request_id: int) -> None:
+        """
+        Asks the process to drop a request nobody waits for anymore (callable from a cancelled task).
+        """
+        if process is None or process.returncode is not None or process.stdin.is_closing():
+            return
+        try:
+            process.stdin.write(tts_protocol.pack_header(tts_protocol.CANCEL, request_id, 0))
+        except Exception:
+            pass
+
+    async def _read_frames(self, process, requests: dict, pings: dict):
+        """
+        Routes every response frame of `process` to its request, until the process exits.
+        """
+        reader = process.stdout
+        error = None
+        try:
+            while True:
+                header = await reader.readexactly(tts_protocol.HEADER.size)
+                msg_type, request_id, length = tts_protocol.unpack_header(header)
+                self._last_progress = time.monotonic()
+                if msg_type in (tts_protocol.AUDIO, tts_protocol.PARTIAL):
+                    sample_rate, = tts_protocol.SAMPLE_RATE.unpack(await reader.readexactly(tts_protocol.SAMPLE_RATE.size))
+                    pcm = await reader.readexactly(length - tts_protocol.SAMPLE_RATE.size)
+                    request = requests.get(request_id)
+                    if request is not None:
+                        request.sample_rate = sample_rate
+                        request.write(pcm)
+                        if msg_type == tts_protocol.PARTIAL and request.pieces is not None:
+                            request.end_piece()
+                    continue
+                payload = await reader.readexactly(length) if length else b""
+                if msg_type == tts_protocol.PONG:
+                    future = pings.pop(request_id, None)
+                    if future is not None and not future.done():
+                        future.set_result(True)
+                elif msg_type in (tts_protocol.DONE, tts_protocol.ERROR):
+                    # Responses of dropped (cancelled) requests are ignored
+                    request = requests.get(request_id)
+                    if request is None or request.done.done():
+                        continue
+                    if msg_type == tts_protocol.DONE:
+                        request.done.set_result(None)
+                    else:
+                        request.done.set_exception(TTSRequestError(payload.decode("utf-8", "replace")))
+                    request.end_stream()
+                else:
+                    raise tts_protocol.ProtocolError(f"Unexpected message type {msg_type}")
+        except asyncio.IncompleteReadError:
+            error = RuntimeError("Worker closed connection")
+        except Exception as e:
+            print(f"TTS worker {self.worker_id} sent an invalid frame: {e}")
+            error = e
+        finally:
+            for future in [request.done for request in requests.values()] + list(pings.values()):
+                if not future.done():
+                    future.set_exception(error or RuntimeError("Worker closed connection"))
+            for request in requests.values():
+                request.end_stream()
+            pings.clear()
+            self._discard_process(expected=process)
+
+    async def _ping(self, process) -> None:
+        request_id = self._new_request_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pings[request_id] = future
+        try:
+            await self._send(process, tts_protocol.PING, request_id)
+            await future
+        finally:
+            self._pings.pop(request_id, None)
+
+    async def ping(self, timeout: float = 5.0) -> bool:
+        """
+        Health check: whether the process answers a ping within `timeout`.
+        The bridge answers pings while it synthesizes, a stuck synthesis shows in `busy_for`.
+        """
+        if not self.alive:
+            return False
+        process = self.process
+        try:
+            await asyncio.wait_for(self._ping(process), timeout)
+            return True
+        except Exception as e:
+            print(f"TTS worker {self.worker_id} failed its health check: {e!r}")
+            self._discard_process(expected=process)
+            return False
+
+    def _discard_process(self, expected=None):
+        """
+        Forgets the current process, killing it if it still runs.
+        With `expected`, only if it is still that process (it may have been replaced by a restart).
+        """
+        if expected is not None and self.process is not expected:
+            return
+        process, self.process = self.process, None
+        self.ready.clear()
+        if process is not None and process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+
+    async def restart(self):
+        """
+        Replaces the process with a new one.
+        """
+        await self.shutdown()
+        await self.ensure_worker_ready()
+
+    async def _log_stderr(self, process):
         """Log stderr output from the worker process"""
-        while self.process and not self.process.stderr.at_eof():
+        while not process.stderr.at_eof():
             try:
-                line = await self.process.stderr.readline()
+                line = await process.stderr.readline()
                 if line:
-                    print(f"Worker stderr: {line.decode().strip()}")
+                    print(f"Worker {self.worker_id} stderr: {line.decode().strip()}")
                 else:
                     break
             except Exception as e:
                 print(f"Error reading stderr: {e}")
                 break
 
-    async def generate_audio(self, text):
-        """Thread-safe audio generation with optimized chunk reading."""
+    ############################################################################################################
+
+    async def _wait(self, future, cancel_token) -> bool:
+        """
+        Waits for `future`, returns False if `cancel_token` is cancelled first.
+        """
+        if cancel_token is None:
+            await future
+            return True
+        cancelled = asyncio.ensure_future(cancel_token.wait())
         try:
-            await self.ensure_worker_ready()
-            if self.process is None or self.process.stdin is None:
-                raise RuntimeError("TTS worker is not running")
-                
-            async with self._stdin_lock, self._stdout_lock:
-                # Send request
-                message = json.dumps({"type": "generate", "text": text})
-                length_bytes = len(message).to_bytes(4, 'big')
-                self.process.stdin.write(length_bytes)
-                self.process.stdin.write(message.encode('utf-8'))
-                await self.process.stdin.drain()
-                
-                # Read full response size
-                size_bytes = await self.process.stdout.read(4)
-                if not size_bytes:
-                    raise RuntimeError("Worker closed connection")
-                total_size = int.from_bytes(size_bytes, 'big')
-                #print(f"Expecting {total_size} bytes of audio data")
-                
-                # Use readexactly if supported
-                try:
-                    audio_data = await self.process.stdout.readexactly(total_size)
-                except asyncio.IncompleteReadError as e:
-                    audio_data = e.partial
-                
-                return bytes(audio_data)
+            await asyncio.wait({future, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            cancelled.cancel()
+        if future.done():
+            future.result()
+            return True
+        return False
+
+    async def _register(self, text, cancel_token, stream: bool = False):
+        """
+        Registers a new request on the current process, None if `cancel_token` is already cancelled.
+        """
+        await self.ensure_worker_ready()
+        if cancel_token is not None and cancel_token.is_set():
+            return None
+        process, requests = self.process, self._requests
+        if process is None:
+            raise RuntimeError("TTS worker is not running")
+        request_id = self._new_request_id()
+        request = _PendingRequest(len(text) * BYTES_PER_CHAR, stream=stream)
+        if not requests:
+            self._last_progress = time.monotonic()
+        requests[request_id] = request
+        return process, requests, request_id, request
+
+    def _release(self, submitted) -> None:
+        """
+        Forgets a request, asking the process to drop it if it is not complete.
+        """
+        if submitted is None:
+            return
+        process, requests, request_id, request = submitted
+        requests.pop(request_id, None)
+        if not request.done.done():
+            request.done.cancel()
+            self._cancel_nowait(process, request_id)
+
+    @staticmethod
+    def _generate_payload(text, stream: bool, voice: str, speed: float) -> bytes:
+        request = {"text": text}
+        if stream:
+            request["stream"] = True
+        if voice is not None:
+            request["voice"] = voice
+        if speed is not None:
+            request["speed"] = speed
+        return json.dumps(request).encode("utf-8")
+
+    async def generate_audio(self, text, cancel_token=None, voice: str = None, speed: float = None):
+        """
+        Synthesizes a sentence and returns it as a WAV file (a memoryview of the request's buffer).
+        Several calls run concurrently on the process. Returns None when `cancel_token` is cancelled before the
+        audio is complete, the process then drops the request if it has not started it.
+        `voice` and `speed` default to the bridge's (af_sky, 1.0).
+
+        Raises:
+            TTSRequestError: The bridge could not synthesize the text.
+            RuntimeError: The process died or broke the protocol (it is discarded).
+        """
+        self.in_flight += 1
+        submitted = None
+        try:
+            submitted = await self._register(text, cancel_token)
+            if submitted is None:
+                return None
+            process, _, request_id, request = submitted
+            with STAGE_SECONDS.time(stage="tts_sentence"):
+                await self._send(process, tts_protocol.GENERATE, request_id, self._generate_payload(text, False, voice, speed))
+                if not await self._wait(request.done, cancel_token):
+                    return None
+            return request.wav()
+        except TTSRequestError:
+            raise
         except Exception as e:  
-            self.process = None
-            self.ready.clear()
+            self._discard_process(expected=submitted[0] if submitted else None)
             raise
+        finally:
+            self.in_flight -= 1
+            self._release(submitted)
 
+    async def stream_audio(self, text, cancel_token=None, voice: str = None, speed: float = None):
+        """
+        Synthesizes a sentence piece by piece and yields every piece as a WAV file as soon as it is synthesized.
+        The bridge splits long sentences at phrase boundaries, short ones come as a single piece.
+        Stops when `cancel_token` is cancelled, the process then stops after its current piece.
 
+        Raises:
+            TTSRequestError: The bridge could not synthesize the text.
+            RuntimeError: The process died or broke the protocol (it is discarded).
+        """
+        self.in_flight += 1
+        submitted = None
+        try:
+            submitted = await self._register(text, cancel_token, stream=True)
+            if submitted is None:
+                return
+            process, _, request_id, request = submitted
+            start_time = time.perf_counter()
+            await self._send(process, tts_protocol.GENERATE, request_id, self._generate_payload(text, True, voice, speed))
+            first = True
+            while True:
+                next_piece = asyncio.ensure_future(request.pieces.get())
+                try:
+                    if not await self._wait(next_piece, cancel_token):
+                        return
+                finally:
+                    next_piece.cancel()
+                piece = next_piece.result()
+                if piece is None:
+                    break
+                if first:
+                    STAGE_SECONDS.observe(time.perf_counter() - start_time, stage="tts_first_piece")
+                    first = False
+                yield piece
+            # Raises the error that ended the stream, if any
+            request.done.result()
+        except TTSRequestError:
+            raise
+        except Exception as e:
+            self._discard_process(expected=submitted[0] if submitted else None)
+            raise
+        finally:
+            self.in_flight -= 1
+            self._release(submitted)
 
     async def shutdown(self):
         """Cleanly shut down the worker process"""
+        if self._start_task is not None and not self._start_task.done():
+            self._start_task.cancel()
         if self.process:
+            process = self.process
             try:
-                self.process.terminate()
-                await self.process.wait()
+                process.terminate()
+                await process.wait()
             except Exception as e:
-                print(f"Error shutting down worker: {e}")
+                print(f"Error shutting down worker {self.worker_id}: {e}")
             finally:
-                self.process = None
+                if self.process is process:
+                    self.process = None
                 self.ready.clear()
\ No newline at end of file
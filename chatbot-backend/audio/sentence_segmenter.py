@@ -0,0 +1,125 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, List
+from nltk.tokenize import sent_tokenize
+
+
+class SentenceSegmenter:
+    """
+    Splits a token stream into sentences as soon as they are complete.
+
+    The buffered text is split with the same tokenizer as the full reply used to be (NLTK punkt, which
+    knows abbreviations like "Dr." or "e.g."). Every sentence but the last is complete, since the tokenizer
+    only splits when the next sentence has started. The last one is kept until more text arrives or the
+    stream ends (`flush`).
+
+    - Sentences shorter than `min_chars` are joined with the next one, so the TTS is not called for "Oh.".
+      The first sentence is exempt, it is what the user hears first.
+    - A sentence longer than `max_chars` without a boundary is cut at its last comma or space, so a
+      run-on reply does not hold back the audio.
+    """
+
+    def __init__(self, min_chars: int = 12, max_chars: int = 300, tokenize: Callable[[str], List[str]] = sent_tokenize):
+        """
+        Args:
+            min_chars (int): Minimum length of a sentence sent on its own (except the first).
+            max_chars (int): Length at which an unfinished sentence is cut.
+            tokenize (callable): Splits a text into sentences.
+        """
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.tokenize = tokenize
+        self._buffer = ""
+        self._pending = ""
+        self._emitted = 0
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Adds streamed text and returns the sentences it completed.
+        """
+        self._buffer += text
+        sentences = self.tokenize(self._buffer)
+        if len(sentences) < 2:
+            if len(self._buffer) > self.max_chars:
+                return self._cut_long_sentence()
+            return []
+        # Keep the unfinished last sentence, from where it starts in the buffer
+        start = self._buffer.rfind(sentences[-1])
+        self._buffer = self._buffer[start:] if start >= 0 else sentences[-1]
+        return self._emit(sentences[:-1])
+
+    def flush(self) -> List[str]:
+        """
+        Returns the remaining text at the end of the stream.
+        """
+        sentences = self.tokenize(self._buffer) if self._buffer.strip() else []
+        self._buffer = ""
+        result = self._emit(sentences)
+        if self._pending:
+            result.append(self._pending)
+            self._pending = ""
+        return result
+
+    def _cut_long_sentence(self) -> List[str]:
+        head = self._buffer[:self.max_chars]
+        cut = max(head.rfind(","), head.rfind(";"), head.rfind(":"))
+        if cut < self.max_chars // 2:
+            cut = head.rfind(" ")
+        if cut <= 0:
+            cut = self.max_chars - 1
+        sentence, self._buffer = self._buffer[:cut + 1], self._buffer[cut + 1:]
+        return self._emit([sentence])
+
+    def _emit(self, sentences: List[str]) -> List[str]:
+        result = []
+        for sentence in sentences:
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            sentence = f"{self._pending} {sentence}" if self._pending else sentence
+            if self._emitted > 0 and len(sentence) < self.min_chars:
+                self._pending = sentence
+                continue
+            self._pending = ""
+            self._emitted += 1
+            result.append(sentence)
+        return result
+
+
+async def iterate_sentences(token_stream: AsyncIterator[str], segmenter: SentenceSegmenter = None) -> AsyncIterator[str]:
+    """
+    Yields the sentences of a token stream as they complete.
+
+    The stream is consumed by its own task, so generation goes on while the caller is busy with the
+    previous sentence (e.g. synthesizing it).
+
+    Args:
+        token_stream (AsyncIterator[str]): The generated tokens.
+        segmenter (SentenceSegmenter, optional): The segmenter, a default one if None.
+    """
+    segmenter = segmenter or SentenceSegmenter()
+    queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for token in token_stream:
+                for sentence in segmenter.feed(token):
+                    queue.put_nowait(sentence)
+            for sentence in segmenter.flush():
+                queue.put_nowait(sentence)
+        except Exception as e:
+            logging.error(f"Token stream failed, ending the sentences early: {e}")
+        finally:
+            queue.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            sentence = await queue.get()
+            if sentence is None:
+                break
+            yield sentence
+    finally:
+        if not producer.done():
+            producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
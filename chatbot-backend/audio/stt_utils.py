@@ -4,7 +4,9 @@ from pydub import AudioSegment
 import librosa
 import numpy as np
 import torch
+import threading
 from faster_whisper import WhisperModel
+from utils.metrics import STAGE_SECONDS
 
 # Determine device
 device = (
@@ -20,12 +22,34 @@ if device in ["cuda", "mps"]:
 else:
     compute_type = "int8"
 
-# Load the Faster-Whisper model (model size: tiny, base, small, large)
-model = WhisperModel("base", device=device, compute_type=compute_type)
+# The Faster-Whisper model (model size: tiny, base, small, large) is loaded on first use
+model = None
+_model_lock = threading.Lock()
 
 #print("whisper device is:", device)
 
 
+def get_model() -> WhisperModel:
+    """
+    Lazily load and return the shared Faster-Whisper model.
+    """
+    global model
+    if model is None:
+        with _model_lock:
+            if model is None:
+                model = WhisperModel("base", device=device, compute_type=compute_type)
+    return model
+
+
+def warm_up() -> None:
+    """
+    Load the model and transcribe one second of silence so the first request does not pay for it.
+    """
+    dummy_audio = np.zeros(16000, dtype=np.float32)
+    segments, _ = get_model().transcribe(dummy_audio, beam_size=1)
+    list(segments)
+
+
 def downsample_audio(audio_data: BytesIO) -> BytesIO:
     """
     Downsample audio to 16kHz mono for faster processing.
@@ -46,17 +70,19 @@ def voice_to_text(audio_data: BytesIO):
     Convert audio to text using Faster Whisper model
     """
     try:
-        # Downsample the audio to 16kHz mono
-        audio_data = downsample_audio(audio_data)
+        with STAGE_SECONDS.time(stage="stt_decode"):
+            # Downsample the audio to 16kHz mono
+            audio_data = downsample_audio(audio_data)
 
-        # Load the audio as a waveform
-        y, sr = librosa.load(audio_data, sr=16000, mono=True)
+            # Load the audio as a waveform
+            y, sr = librosa.load(audio_data, sr=16000, mono=True)
 
-        # Transcribe using Faster Whisper
-        segments, _ = model.transcribe(y, beam_size=3)
-        
-        # Combine all segments
-        text = " ".join([segment.text for segment in segments])
+        with STAGE_SECONDS.time(stage="stt_transcribe"):
+            # Transcribe using Faster Whisper
+            segments, _ = get_model().transcribe(y, beam_size=3)
+            
+            # Combine all segments (decoding happens while iterating)
+            text = " ".join([segment.text for segment in segments])
 
         if text:
             return {"success": True, "text": text}
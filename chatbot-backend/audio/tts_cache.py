@@ -0,0 +1,285 @@
+import os
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+from utils.executors import run_in_pool
+from utils.metrics import Counter, Gauge
+
+TTS_CACHE = Counter(
+    "sage_tts_cache_total",
+    "TTS audio cache lookups by result (memory_hit, disk_hit, miss).",
+    labelnames=("result",),
+)
+TTS_CACHE_BYTES = Gauge(
+    "sage_tts_cache_bytes",
+    "Audio bytes held by the TTS cache per tier (memory, disk).",
+    labelnames=("tier",),
+)
+
+## Bump when the stored audio changes for the same key (e.g. a new Kokoro model)
+CACHE_FORMAT_VERSION = 1
+_FILE_SUFFIX = ".wavs"
+
+
+def normalize_text(text: str) -> str:
+    text = text.replace("’", "'").replace("…", "...")
+    return " ".join(text.split())
+
+
+def split_wavs(blob) -> List[memoryview]:
+    """
+    Splits concatenated WAV files by the size in their RIFF headers.
+    """
+    view = memoryview(blob)
+    pieces = []
+    offset = 0
+    while offset + 8 <= len(view):
+        size = int.from_bytes(view[offset + 4:offset + 8], "little") + 8
+        pieces.append(view[offset:offset + size])
+        offset += size
+    return pieces
+
+
+def load_phrases(path: str) -> List[str]:
+    """
+    Reads a phrase list, one phrase per line, blank lines and # comments skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def _write_file(path: str, blob: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        blob = f.read()
+    # Keeps the LRU order across restarts
+    os.utime(path)
+    return blob
+
+
+class TTSAudioCache:
+    """
+    Content-addressed cache of synthesized sentences, in front of the TTS workers.
+
+    Entries are keyed by the SHA-256 of the normalized text, the voice, the speed and the sample format, so
+    changing any of them never serves audio made with other settings. An entry is the list of WAV chunks the
+    sentence was streamed as, stored concatenated.
+
+    - Memory tier: the most recently used entries, bounded to `memory_bytes`.
+    - Disk tier: one file per entry under `directory`, bounded to `disk_bytes` (least recently used files are
+      deleted, file times keep the order across restarts). Files are read on the audio-codec pool and
+      promoted to memory.
+      Only sentences looked up `disk_after` times, or seeded, are written, one-off sentences stay in memory.
+    """
+
+    def __init__(self, directory: str, voice: str, speed: float, sample_format: str,
+                 memory_bytes: int = 64 * 2 ** 20, disk_bytes: int = 512 * 2 ** 20, disk_after: int = 2,
+                 max_text_chars: int = 300):
+        """
+        Args:
+            directory (str): Where the disk tier is stored, None for a memory-only cache.
+            voice (str): The Kokoro voice, part of the key.
+            speed (float): The speech speed, part of the key.
+            sample_format (str): Describes the stored audio (encoding, chunking), part of the key.
+            memory_bytes (int): Size of the memory tier.
+            disk_bytes (int): Size of the disk tier.
+            disk_after (int): Lookups of a sentence before it is written to disk.
+            max_text_chars (int): Longer sentences are not cached.
+        """
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.disk_after = disk_after
+        self.max_text_chars = max_text_chars
+        self._key_suffix = f"\0{voice}\0{speed:g}\0{sample_format}\0{CACHE_FORMAT_VERSION}"
+        self.stats = {"memory_hit": 0, "disk_hit": 0, "miss": 0, "seeded": 0}
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        # Lookup counts of the sentences not on disk yet (the most recent ones)
+        self._seen = OrderedDict()
+        self._writes = {}
+        if directory:
+            self._load_disk_index()
+
+    @classmethod
+    def from_env(cls, voice: str, speed: float, sample_format: str):
+        """
+        Creates a cache configured from TTS_CACHE_* environment variables.
+        """
+        directory = os.environ.get("TTS_CACHE_DIR", os.path.join("data", "tts_cache"))
+        return cls(directory=directory or None, voice=voice, speed=speed, sample_format=sample_format,
+                   memory_bytes=int(float(os.environ.get("TTS_CACHE_MEMORY_MB", 64)) * 2 ** 20),
+                   disk_bytes=int(float(os.environ.get("TTS_CACHE_DISK_MB", 512)) * 2 ** 20),
+                   disk_after=int(os.environ.get("TTS_CACHE_DISK_AFTER", 2)))
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256((normalize_text(text) + self._key_suffix).encode("utf-8")).hexdigest()
+
+    def cacheable(self, text: str) -> bool:
+        return 0 < len(text) <= self.max_text_chars
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + _FILE_SUFFIX)
+
+    ############################################################################################################
+
+    async def get(self, text: str) -> Optional[List[memoryview]]:
+        """
+        Returns the cached WAV chunks of a sentence, None on a miss. Memory hits do not leave the event loop.
+        """
+        if not self.cacheable(text):
+            return None
+        key = self.key(text)
+        blob = self._memory.get(key)
+        if blob is not None:
+            self._memory.move_to_end(key)
+            self._record("memory_hit")
+            if self._count_lookup(key):
+                self._schedule_write(key, blob)
+            return split_wavs(blob)
+        if key in self._disk:
+            blob = await self._read(key)
+            if blob is not None:
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self._record("disk_hit")
+                self._memory_put(key, blob)
+                return split_wavs(blob)
+        self._record("miss")
+        self._count_lookup(key)
+        return None
+
+    def put(self, text: str, chunks: Iterable, persist: bool = False) -> None:
+        """
+        Caches the WAV chunks of a sentence, on disk too when it was looked up `disk_after` times or `persist`.
+        """
+        if not self.cacheable(text):
+            return
+        key = self.key(text)
+        blob = b"".join(chunks)
+        if not blob:
+            return
+        self._memory_put(key, blob)
+        if persist or self._seen.get(key, 0) >= self.disk_after:
+            self._schedule_write(key, blob)
+
+    def contains(self, text: str) -> bool:
+        key = self.key(text)
+        return key in self._memory or key in self._disk
+
+    def _record(self, result: str) -> None:
+        self.stats[result] += 1
+        TTS_CACHE.inc(result=result)
+
+    def _count_lookup(self, key: str) -> bool:
+        """
+        Counts a lookup of a sentence not on disk, returns whether it should now be written.
+        """
+        if key in self._disk:
+            return False
+        count = self._seen.pop(key, 0) + 1
+        self._seen[key] = count
+        while len(self._seen) > 10_000:
+            self._seen.popitem(last=False)
+        return count >= self.disk_after
+
+    def _memory_put(self, key: str, blob: bytes) -> None:
+        if len(blob) > self.memory_bytes // 4:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = blob
+        self._memory_size += len(blob)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+        TTS_CACHE_BYTES.set(self._memory_size, tier="memory")
+
+    ############################################################################################################
+
+    def _load_disk_index(self) -> None:
+        """
+        Indexes the files of the disk tier, least recently used first.
+        """
+        entries = []
+        if os.path.isdir(self.directory):
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(_FILE_SUFFIX):
+                        stat = os.stat(os.path.join(root, name))
+                        entries.append((stat.st_mtime, name[:-len(_FILE_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+        TTS_CACHE_BYTES.set(self._disk_size, tier="disk")
+        if entries:
+            logging.info(f"TTS cache: {len(self._disk)} sentences ({self._disk_size / 2 ** 20:.1f} MB) on disk")
+
+    async def _read(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            return await run_in_pool("audio-codec", _read_file, path)
+        except OSError as e:
+            logging.warning(f"TTS cache file {path} unreadable, dropping it: {e}")
+            # Unless it was evicted or rewritten during the read
+            if key in self._disk:
+                self._disk_size -= self._disk.pop(key)
+                TTS_CACHE_BYTES.set(self._disk_size, tier="disk")
+            return None
+
+    def _schedule_write(self, key: str, blob: bytes) -> None:
+        if not self.directory or key in self._disk or key in self._writes:
+            return
+        task = asyncio.create_task(self._write(key, blob))
+        self._writes[key] = task
+        task.add_done_callback(lambda _: self._writes.pop(key, None))
+
+    async def _write(self, key: str, blob: bytes) -> None:
+        try:
+            await run_in_pool("audio-codec", _write_file, self._path(key), blob)
+        except OSError as e:
+            logging.warning(f"Could not write TTS cache file: {e}")
+            return
+        self._seen.pop(key, None)
+        self._disk[key] = len(blob)
+        self._disk_size += len(blob)
+        self._evict_disk()
+        TTS_CACHE_BYTES.set(self._disk_size, tier="disk")
+
+    def _evict_disk(self) -> None:
+        while self._disk_size > self.disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            try:
+                os.remove(self._path(key))
+            except OSError as e:
+                # E.g. still open on Windows, it is indexed again at the next start
+                logging.debug(f"Could not delete TTS cache file {key}: {e}")
+
+    async def flush(self) -> None:
+        """
+        Waits for the pending disk writes.
+        """
+        if self._writes:
+            await asyncio.gather(*list(self._writes.values()), return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["memory_hit"] + self.stats["disk_hit"] + self.stats["miss"]
+        hits = lookups - self.stats["miss"]
+        return {**self.stats,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory), "memory_bytes": self._memory_size,
+                "disk_entries": len(self._disk), "disk_bytes": self._disk_size}
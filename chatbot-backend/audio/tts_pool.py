@@ -0,0 +1,316 @@
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional
+from audio.persistent_process import KokoroTTSWorker, TTSRequestError
+from utils.metrics import Counter, Gauge
+
+TTS_WORKER_QUEUE_DEPTH = Gauge(
+    "sage_tts_worker_queue_depth",
+    "Sentences sent to a Kokoro TTS worker and not synthesized yet.",
+    labelnames=("worker",),
+)
+TTS_WORKER_UP = Gauge(
+    "sage_tts_worker_up",
+    "1 while a Kokoro TTS worker process is running and answers health checks.",
+    labelnames=("worker",),
+)
+TTS_WORKER_REQUESTS = Counter(
+    "sage_tts_worker_requests_total",
+    "Sentences handled per Kokoro TTS worker (ok, error, retried).",
+    labelnames=("worker", "outcome"),
+)
+TTS_WORKER_RESTARTS = Counter(
+    "sage_tts_worker_restarts_total",
+    "Kokoro TTS worker processes restarted after a crash, a failed health check or a stall.",
+    labelnames=("worker",),
+)
+
+## ONNX Runtime threads per worker process when the pool size is derived from the CPU count
+THREADS_PER_WORKER = 4
+
+
+def default_pool_size() -> int:
+    """
+    One worker per THREADS_PER_WORKER cores, at least one.
+    """
+    return max(1, (os.cpu_count() or 1) // THREADS_PER_WORKER)
+
+
+class KokoroTTSPool:
+    """
+    A pool of `kokoro_bridge.py --server` processes, so sentences of different users are synthesized in parallel.
+
+    - Every sentence goes to the running worker with the fewest queued sentences.
+    - A supervisor task pings the workers every `health_interval_s`, and restarts the ones that crashed, do
+      not answer or have sent nothing for `stall_timeout_s` while sentences wait for them. Restarts back off exponentially
+      (from `backoff_initial_s` to `backoff_max_s`) while a worker keeps failing.
+    - A sentence whose worker fails is retried once on another worker, the other workers stay warm meanwhile.
+    - The workers start in the background, sentences are sent to the first ones ready. A worker that has not
+      loaded its model after `start_timeout_s` is killed and restarted like a crashed one.
+
+    Exposes the interface of `KokoroTTSWorker` (ensure_worker_ready, generate_audio, stream_audio, shutdown).
+    """
+
+    def __init__(self, size: int = None, health_interval_s: float = 10, ping_timeout_s: float = 5,
+                 stall_timeout_s: float = 60, backoff_initial_s: float = 1, backoff_max_s: float = 60,
+                 acquire_timeout_s: float = 30, start_timeout_s: float = 120):
+        """
+        Args:
+            size (int, optional): Number of worker processes, derived from the CPU count if None.
+            health_interval_s (float): Seconds between two health checks of the workers.
+            ping_timeout_s (float): Time a worker has to answer a ping.
+            stall_timeout_s (float): Time without progress after which a worker with queued sentences is restarted.
+            backoff_initial_s (float): Delay before the first restart attempt of a failed worker.
+            backoff_max_s (float): Upper bound of the restart delay.
+            acquire_timeout_s (float): How long a sentence waits for a worker while none is running.
+            start_timeout_s (float): Time a worker process has to load the model before it is restarted.
+        """
+        self.size = size or default_pool_size()
+        threads = max(1, (os.cpu_count() or 1) // self.size)
+        self.workers = [KokoroTTSWorker(worker_id=i, threads=threads, start_timeout_s=start_timeout_s)
+                        for i in range(self.size)]
+        self.health_interval_s = health_interval_s
+        self.ping_timeout_s = ping_timeout_s
+        self.stall_timeout_s = stall_timeout_s
+        self.backoff_initial_s = backoff_initial_s
+        self.backoff_max_s = backoff_max_s
+        self.acquire_timeout_s = acquire_timeout_s
+        self.stats = {worker.worker_id: {"ok": 0, "error": 0, "retried": 0, "restarts": 0} for worker in self.workers}
+        self._failures = {worker.worker_id: 0 for worker in self.workers}
+        self._restarts: Dict[int, asyncio.Task] = {}
+        self._worker_available = None
+        self._supervisor = None
+        self._start_task = None
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates a pool configured from KOKORO_* environment variables (KOKORO_WORKERS=auto sizes it from the CPU count).
+        """
+        size = os.environ.get("KOKORO_WORKERS", "auto")
+        return cls(size=None if size == "auto" else int(size),
+                   health_interval_s=float(os.environ.get("KOKORO_HEALTH_INTERVAL_S", 10)),
+                   ping_timeout_s=float(os.environ.get("KOKORO_PING_TIMEOUT_S", 5)),
+                   stall_timeout_s=float(os.environ.get("KOKORO_STALL_TIMEOUT_S", 60)),
+                   backoff_initial_s=float(os.environ.get("KOKORO_RESTART_BACKOFF_S", 1)),
+                   backoff_max_s=float(os.environ.get("KOKORO_RESTART_BACKOFF_MAX_S", 60)),
+                   start_timeout_s=float(os.environ.get("KOKORO_START_TIMEOUT_S", 120)))
+
+    ############################################################################################################
+
+    async def ensure_worker_ready(self):
+        """
+        Starts every worker (once) and the supervisor in the background. Returns when at least one worker is running.
+
+        Raises:
+            RuntimeError: When no worker is running after `acquire_timeout_s`.
+        """
+        if self._start_task is None:
+            self._worker_available = asyncio.Event()
+            self._supervisor = asyncio.create_task(self._supervise())
+            self._start_task = asyncio.create_task(self._start())
+        if not self._worker_available.is_set():
+            try:
+                await asyncio.wait_for(self._worker_available.wait(), self.acquire_timeout_s)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"No TTS worker available after {self.acquire_timeout_s}s")
+
+    async def _start(self):
+        await asyncio.gather(*(self._start_worker(worker) for worker in self.workers))
+
+    async def _start_worker(self, worker: KokoroTTSWorker) -> None:
+        try:
+            await worker.ensure_worker_ready()
+        except Exception as e:
+            logging.error(f"TTS worker {worker.worker_id} failed to start: {e}")
+            self._schedule_restart(worker)
+        finally:
+            self._update_state(worker)
+
+    def _available(self, worker: KokoroTTSWorker) -> bool:
+        return worker.alive and worker.worker_id not in self._restarts
+
+    def _update_state(self, worker: KokoroTTSWorker) -> None:
+        TTS_WORKER_UP.set(1 if worker.alive else 0, worker=worker.worker_id)
+        if self._worker_available is None:
+            return
+        if any(self._available(w) for w in self.workers):
+            self._worker_available.set()
+        else:
+            self._worker_available.clear()
+
+    ############################################################################################################
+
+    async def _acquire(self, exclude: Optional[KokoroTTSWorker] = None) -> KokoroTTSWorker:
+        """
+        Returns the running worker with the fewest queued sentences, waiting for a restart if none runs.
+        """
+        while True:
+            await self.ensure_worker_ready()
+            candidates = [w for w in self.workers if self._available(w) and w is not exclude]
+            if candidates:
+                return min(candidates, key=lambda w: (w.in_flight, w.worker_id))
+            if exclude is not None:
+                raise RuntimeError("No other TTS worker is running")
+            # A process died without being noticed yet
+            for worker in self.workers:
+                if not self._available(worker) and not worker.starting:
+                    self._schedule_restart(worker)
+                self._update_state(worker)
+
+    async def generate_audio(self, text, cancel_token=None, **options):
+        """
+        Synthesizes a sentence on the least loaded worker, retried once on another worker if it fails.
+        `options` (voice, speed) are passed to `KokoroTTSWorker.generate_audio`.
+        Returns None when `cancel_token` is cancelled before the sentence is sent to a worker.
+        """
+        worker = await self._acquire()
+        try:
+            return await self._generate_on(worker, text, cancel_token, options)
+        except TTSRequestError:
+            # The text itself failed, another worker would fail too
+            raise
+        except Exception as e:
+            if cancel_token is not None and cancel_token.is_set():
+                raise
+            try:
+                other = await self._acquire(exclude=worker)
+            except RuntimeError:
+                raise e
+            self.stats[other.worker_id]["retried"] += 1
+            TTS_WORKER_REQUESTS.inc(worker=other.worker_id, outcome="retried")
+            return await self._generate_on(other, text, cancel_token, options)
+
+    async def _generate_on(self, worker: KokoroTTSWorker, text, cancel_token, options: dict):
+        TTS_WORKER_QUEUE_DEPTH.inc(worker=worker.worker_id)
+        try:
+            result = await worker.generate_audio(text, cancel_token=cancel_token, **options)
+            self._on_success(worker)
+            return result
+        except Exception as e:
+            self._on_failure(worker, e)
+            raise
+        finally:
+            TTS_WORKER_QUEUE_DEPTH.dec(worker=worker.worker_id)
+
+    async def stream_audio(self, text, cancel_token=None, **options):
+        """
+        Streams the pieces of a sentence (see `KokoroTTSWorker.stream_audio`) from the least loaded worker.
+        Retried once on another worker if it fails before its first piece.
+        """
+        worker = await self._acquire()
+        streamed = False
+        pieces = self._stream_on(worker, text, cancel_token, options)
+        try:
+            async for piece in pieces:
+                streamed = True
+                yield piece
+            return
+        except TTSRequestError:
+            raise
+        except Exception as e:
+            if streamed or (cancel_token is not None and cancel_token.is_set()):
+                raise
+            try:
+                other = await self._acquire(exclude=worker)
+            except RuntimeError:
+                raise e
+        finally:
+            await pieces.aclose()
+        self.stats[other.worker_id]["retried"] += 1
+        TTS_WORKER_REQUESTS.inc(worker=other.worker_id, outcome="retried")
+        pieces = self._stream_on(other, text, cancel_token, options)
+        try:
+            async for piece in pieces:
+                yield piece
+        finally:
+            await pieces.aclose()
+
+    async def _stream_on(self, worker: KokoroTTSWorker, text, cancel_token, options: dict):
+        TTS_WORKER_QUEUE_DEPTH.inc(worker=worker.worker_id)
+        pieces = worker.stream_audio(text, cancel_token=cancel_token, **options)
+        try:
+            async for piece in pieces:
+                yield piece
+            self._on_success(worker)
+        except Exception as e:
+            self._on_failure(worker, e)
+            raise
+        finally:
+            # Releases the request right away when the consumer stops early
+            await pieces.aclose()
+            TTS_WORKER_QUEUE_DEPTH.dec(worker=worker.worker_id)
+
+    def _on_success(self, worker: KokoroTTSWorker) -> None:
+        self.stats[worker.worker_id]["ok"] += 1
+        TTS_WORKER_REQUESTS.inc(worker=worker.worker_id, outcome="ok")
+
+    def _on_failure(self, worker: KokoroTTSWorker, error: Exception) -> None:
+        self.stats[worker.worker_id]["error"] += 1
+        TTS_WORKER_REQUESTS.inc(worker=worker.worker_id, outcome="error")
+        logging.error(f"TTS worker {worker.worker_id} failed: {error}")
+        # A request error says nothing about the process
+        if not isinstance(error, TTSRequestError):
+            self._schedule_restart(worker)
+
+    ############################################################################################################
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(self.health_interval_s)
+            for worker in self.workers:
+                # A starting worker is bounded by its start timeout
+                if worker.worker_id in self._restarts or worker.starting:
+                    continue
+                if worker.busy_for() > self.stall_timeout_s:
+                    logging.warning(f"TTS worker {worker.worker_id} made no progress for {worker.busy_for():.0f}s, restarting it")
+                    self._schedule_restart(worker)
+                elif not await worker.ping(self.ping_timeout_s):
+                    self._schedule_restart(worker)
+                self._update_state(worker)
+
+    def _schedule_restart(self, worker: KokoroTTSWorker) -> None:
+        if worker.worker_id in self._restarts:
+            return
+        self._restarts[worker.worker_id] = asyncio.create_task(self._restart(worker))
+        self._update_state(worker)
+
+    async def _restart(self, worker: KokoroTTSWorker) -> None:
+        try:
+            while True:
+                self._failures[worker.worker_id] += 1
+                delay = min(self.backoff_initial_s * 2 ** (self._failures[worker.worker_id] - 1), self.backoff_max_s)
+                await asyncio.sleep(delay)
+                self.stats[worker.worker_id]["restarts"] += 1
+                TTS_WORKER_RESTARTS.inc(worker=worker.worker_id)
+                try:
+                    await worker.restart()
+                except Exception as e:
+                    logging.error(f"Restart of TTS worker {worker.worker_id} failed, next attempt in "
+                                  f"{min(delay * 2, self.backoff_max_s):.0f}s: {e}")
+                    continue
+                self._failures[worker.worker_id] = 0
+                return
+        finally:
+            self._restarts.pop(worker.worker_id, None)
+            self._update_state(worker)
+
+    ############################################################################################################
+
+    def get_stats(self) -> List[dict]:
+        return [{"worker": worker.worker_id, "alive": worker.alive, "queued": worker.in_flight,
+                 "restarting": worker.worker_id in self._restarts, "consecutive_failures": self._failures[worker.worker_id],
+                 **self.stats[worker.worker_id]} for worker in self.workers]
+
+    async def shutdown(self):
+        """Cleanly shut down the supervisor and every worker process"""
+        tasks = [task for task in (self._supervisor, self._start_task) if task is not None] + list(self._restarts.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._supervisor = self._start_task = None
+        self._restarts.clear()
+        await asyncio.gather(*(worker.shutdown() for worker in self.workers))
+        for worker in self.workers:
+            self._update_state(worker)
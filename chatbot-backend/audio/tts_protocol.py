@@ -0,0 +1,74 @@
+"""
+Framing of the stdin/stdout protocol between KokoroTTSWorker and `kokoro_bridge.py --server`.
+
+Every message is a 12-byte header followed by its payload:
+    magic (2 bytes, b"KB") | version (1 byte) | type (1 byte) | request id (4 bytes) | payload length (4 bytes)
+big-endian. Several requests may be in flight on one process, responses carry the id of their request.
+
+Client -> bridge:
+    PING      empty payload, answered by PONG with the same id even while a request is being synthesized.
+    GENERATE  JSON {"text": ..., "voice": ..., "speed": ...}.
+    CANCEL    drops the request if it is still queued (or stops it between two pieces when streaming).
+Bridge -> client:
+    PONG      empty payload.
+    AUDIO     sample rate (4 bytes) + mono int16 little-endian PCM, one slice of a request's audio.
+    PARTIAL   same payload as AUDIO, the last slice of a piece of the sentence that can be played on its own.
+    DONE      empty payload, the request is complete.
+    ERROR     UTF-8 message, the request failed (the process is still usable).
+
+Kept free of dependencies, the bridge imports it from the Kokoro virtual environment.
+"""
+import struct
+
+MAGIC = b"KB"
+VERSION = 1
+
+PING = 1
+PONG = 2
+GENERATE = 3
+CANCEL = 4
+AUDIO = 5
+PARTIAL = 6
+DONE = 7
+ERROR = 8
+
+HEADER = struct.Struct(">2sBBII")
+SAMPLE_RATE = struct.Struct(">I")
+## Largest audio payload of a frame, longer audio is sent in several slices
+MAX_AUDIO_PAYLOAD = 32768
+SAMPLE_WIDTH = 2
+WAV_HEADER_SIZE = 44
+
+
+class ProtocolError(RuntimeError):
+    """
+    Raised on a malformed frame or a frame of another protocol version.
+    """
+
+
+def pack_header(msg_type: int, request_id: int, payload_length: int) -> bytes:
+    return HEADER.pack(MAGIC, VERSION, msg_type, request_id, payload_length)
+
+
+def unpack_header(header: bytes):
+    """
+    Returns the (type, request id, payload length) of a frame header.
+
+    Raises:
+        ProtocolError: On a wrong magic or version.
+    """
+    magic, version, msg_type, request_id, length = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError(f"Bad frame magic {magic!r}")
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version} (expected {VERSION})")
+    return msg_type, request_id, length
+
+
+def wav_header(sample_rate: int, data_size: int, channels: int = 1) -> bytes:
+    """
+    The 44-byte header of a PCM 16-bit WAV file holding `data_size` bytes of samples.
+    """
+    byte_rate = sample_rate * channels * SAMPLE_WIDTH
+    return struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, 1, channels,
+                       sample_rate, byte_rate, channels * SAMPLE_WIDTH, SAMPLE_WIDTH * 8, b"data", data_size)
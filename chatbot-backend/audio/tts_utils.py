@@ -17,9 +17,16 @@ import logging
 import asyncio
 from fastapi import UploadFile, BackgroundTasks
 import soundfile as sf
+import time
+from contextlib import nullcontext
 
 
-from audio.persistent_process import KokoroTTSWorker
+from audio.tts_pool import KokoroTTSPool
+from audio.tts_cache import TTSAudioCache, load_phrases
+from audio.sentence_segmenter import SentenceSegmenter, iterate_sentences
+from utils.executors import run_in_pool
+from utils.metrics import STAGE_SECONDS, TIME_TO_FIRST_AUDIO
+from utils.cancellation import CancellationToken, cancellations
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -27,7 +34,29 @@ logger = logging.getLogger(__name__)
 
 load_dotenv() 
 
-nltk.download('punkt')
+## "sentence" synthesizes every sentence as soon as it is generated, "full" waits for the whole reply
+TTS_PIPELINE = os.environ.get("TTS_PIPELINE", "sentence").lower()
+## Stream long sentences piece by piece (split at phrase boundaries by the bridge) instead of as one WAV
+TTS_STREAM_PHRASES = os.environ.get("TTS_STREAM_PHRASES", "true").lower() == "true"
+TTS_VOICE = os.environ.get("TTS_VOICE", "af_sky")
+TTS_SPEED = float(os.environ.get("TTS_SPEED", 1.0))
+## Phrases synthesized into the TTS cache at startup
+TTS_CACHE_SEED_PATH = os.environ.get("TTS_CACHE_SEED_PATH",
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache_phrases.txt"))
+
+NLTK_RESOURCES = {"punkt": "tokenizers/punkt", "punkt_tab": "tokenizers/punkt_tab"}
+
+
+def ensure_nltk_data():
+    """
+    Download the sentence tokenizer data only when it is not installed yet.
+    """
+    for package, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            if not nltk.download(package, quiet=True):
+                raise RuntimeError(f"Could not download NLTK resource '{package}'")
 
 device= ("cuda" if torch.cuda.is_available() 
             else "mps" if torch.backends.mps.is_available() 
@@ -35,8 +64,19 @@ device= ("cuda" if torch.cuda.is_available()
 
 
 
-# Global event to manage stream cancellation
-cancel_event = asyncio.Event()
+def ffmpeg_to_wav(audio_bytes: bytes):
+    """
+    Pipe the audio bytes through ffmpeg and return its (stdout, stderr).
+    Blocking, run it in the audio-codec pool.
+    """
+    process = (
+        ffmpeg
+        .input('pipe:0')
+        .output('pipe:1', format='wav')
+        .run_async(pipe_stdin=True, pipe_stdout=True, pipe_stderr=True)
+    )
+    return process.communicate(input=audio_bytes)
+
 
 async def convert_to_wav(audio: UploadFile):
     """
@@ -52,13 +92,7 @@ async def convert_to_wav(audio: UploadFile):
             return input_audio
 
         output_audio = BytesIO()
-        process = (
-            ffmpeg
-            .input('pipe:0')
-            .output('pipe:1', format='wav')
-            .run_async(pipe_stdin=True, pipe_stdout=True, pipe_stderr=True)
-        )
-        stdout, stderr = process.communicate(input=input_audio.read())
+        stdout, stderr = await run_in_pool("audio-codec", ffmpeg_to_wav, input_audio.read())
 
         if stderr:
             logger.debug(f"ffmpeg error: {stderr.decode()}")
@@ -93,24 +127,51 @@ def preprocess_text(text):
     return text
 
 
-async def cancel_stream():
+async def cancel_stream(user_id: str):
     """
-    Trigger cancellation of ongoing audio processing.
+    Trigger cancellation of the ongoing requests of one user.
     
     Returns:
         JSONResponse confirming cancellation
     """
-    # Set global cancellation event
-    cancel_event.set()
+    cancelled = cancellations.cancel(user_id)
     #print("Cancel event triggered")
-    return JSONResponse(content={"message": "Processing cancelled."}, status_code=200)
+    return JSONResponse(content={"message": "Processing cancelled.", "cancelled_requests": cancelled}, status_code=200)
 
   
-# Create a single global instance
-tts_worker = KokoroTTSWorker()
+# The global pool of TTS worker processes (KOKORO_WORKERS), created on first use so importing this
+# module does not require KOKORO_VENV_PATH
+_tts_worker = None
+
+
+def get_tts_worker() -> KokoroTTSPool:
+    """
+    Lazily create and return the pool of TTS worker processes.
 
-async def generate_audio_async(text):
+    Raises:
+        ValueError: When KOKORO_VENV_PATH is not set or does not contain a Python executable.
+    """
+    global _tts_worker
+    if _tts_worker is None:
+        _tts_worker = KokoroTTSPool.from_env()
+    return _tts_worker
+
+
+async def shutdown_tts_worker():
+    """
+    Stops the TTS worker processes, if they were ever created.
+    """
+    if _tts_worker is not None:
+        await _tts_worker.shutdown()
+
+# Synthesized sentences, served without the workers when they are said again (TTS_CACHE=false disables it)
+tts_cache = (TTSAudioCache.from_env(voice=TTS_VOICE, speed=TTS_SPEED,
+                                    sample_format="wav-pcm16-" + ("phrases" if TTS_STREAM_PHRASES else "sentence"))
+             if os.environ.get("TTS_CACHE", "true").lower() == "true" else None)
+
+async def generate_audio_async(text, cancel_event=None):
     """Generate audio for a single chunk of text"""
+    cancel_event = cancel_event or CancellationToken()
     try:
         kokoro_venv_path = os.getenv("KOKORO_VENV_PATH")
         python_executable = os.path.join(kokoro_venv_path, "Scripts", "python.exe")
@@ -163,49 +224,179 @@ async def generate_audio_async(text):
         print(f"Error generating audio: {e}")
         return None
 
+async def _iterate(sentences):
+    if hasattr(sentences, "__aiter__"):
+        async for sentence in sentences:
+            yield sentence
+    else:
+        for sentence in sentences:
+            yield sentence
+
+
+async def reply_sentences(chatbot, user_input: str, cancel_token, lease=nullcontext):
+    """
+    Yields the sentences of the reply, preprocessed for TTS, while the reply is still being generated.
+    `lease` returns the context manager pinning the session (SessionRegistry.lease), held while the reply
+    is generated: this runs in the response body, after the request handler has returned.
+    """
+    with lease():
+        token_stream = chatbot.stream_workflow_response(user_input, cancel_token=cancel_token)
+        async for sentence in iterate_sentences(token_stream, SentenceSegmenter()):
+            sentence = preprocess_text(sentence)
+            if sentence:
+                yield sentence
+
+
+async def synthesize_sentence(sentence: str, cancel_event):
+    """
+    Yields the WAV chunks of one sentence: from the TTS cache, or synthesized (one chunk per phrase with
+    TTS_STREAM_PHRASES) and then cached if it completed.
+    """
+    cached = await tts_cache.get(sentence) if tts_cache is not None else None
+    if cached is not None:
+        for audio_data in cached:
+            yield audio_data
+        return
+
+    chunks = []
+    if TTS_STREAM_PHRASES:
+        pieces = get_tts_worker().stream_audio(sentence, cancel_token=cancel_event, voice=TTS_VOICE, speed=TTS_SPEED)
+        try:
+            async for audio_data in pieces:
+                if cancel_event.is_set():
+                    return
+                chunks.append(audio_data)
+                yield audio_data
+        finally:
+            await pieces.aclose()
+    else:
+        audio_data = await get_tts_worker().generate_audio(sentence, cancel_token=cancel_event, voice=TTS_VOICE, speed=TTS_SPEED)
+        if cancel_event.is_set() or not audio_data:
+            return
+        chunks.append(audio_data)
+        # Instead of re-reading and re-writing the audio,
+        # yield the received WAV bytes directly.
+        yield audio_data
+    if chunks and not cancel_event.is_set() and tts_cache is not None:
+        tts_cache.put(sentence, chunks)
+
+
 async def stream_audio_chunks(sentences, cancel_event):
-    """Stream audio chunks with proper WAV headers"""
+    """
+    Stream audio chunks with proper WAV headers, stops as soon as `cancel_event` (a CancellationToken) is set.
+    `sentences` is a list or an async iterator of sentences still being generated. With TTS_STREAM_PHRASES,
+    long sentences are sent as several chunks, one per phrase, as soon as each is synthesized.
+    """
     if cancel_event.is_set():
         return
     try:
-        await tts_worker.ensure_worker_ready()
+        await get_tts_worker().ensure_worker_ready()
         #print(f"Starting to process {len(sentences)} sentences")
         if cancel_event.is_set():
             return
 
-        for i, sentence in enumerate(sentences):
+        i = 0
+        async for sentence in _iterate(sentences):
+            i += 1
             if cancel_event.is_set():
                 return
             try:
                 #print(f"Processing sentence {i+1}/{len(sentences)}: {sentence}")
-                audio_data = await tts_worker.generate_audio(sentence)
-                if cancel_event.is_set():
-                    return
-
-                if audio_data:
-                    # Instead of re-reading and re-writing the audio,
-                    # yield the received WAV bytes directly.
-                    #print(f"Processed audio chunk: {len(audio_data)} bytes")
-                    yield audio_data
-                    #print(f"Chunk {i+1} sent to frontend")
-                else:
-                    print(f"No audio data generated for sentence {i+1}")
+                generated = False
+                chunks = synthesize_sentence(sentence, cancel_event)
+                try:
+                    async for audio_data in chunks:
+                        if cancel_event.is_set():
+                            return
+                        generated = True
+                        #print(f"Processed audio chunk: {len(audio_data)} bytes")
+                        yield audio_data
+                        #print(f"Chunk {i+1} sent to frontend")
+                finally:
+                    await chunks.aclose()
+                if not generated and not cancel_event.is_set():
+                    print(f"No audio data generated for sentence {i}")
             except Exception as e:
-                print(f"Error processing chunk {i+1}: {e}")
+                print(f"Error processing chunk {i}: {e}")
                 continue
 
     except Exception as e:
         print(f"Error in stream_audio_chunks: {e}")
         raise
 
-async def conversation_audio_stream_kokoro(audio: UploadFile, background_tasks: BackgroundTasks, chatbot):
-    cancel_event.clear()
+
+async def seed_tts_cache(path: str = TTS_CACHE_SEED_PATH) -> int:
+    """
+    Synthesizes the phrases of a phrase list into the TTS cache (memory and disk), skipping the cached ones.
+    Phrases are prepared like replies (preprocess_text, sentence split) so they match the sentences said later.
+
+    Returns:
+        int: The number of sentences synthesized.
+    """
+    if tts_cache is None or not os.path.exists(path):
+        return 0
+    sentences = {sentence for phrase in load_phrases(path) for sentence in sent_tokenize(preprocess_text(phrase))}
+    missing = [sentence for sentence in sentences if tts_cache.cacheable(sentence) and not tts_cache.contains(sentence)]
+
+    async def seed(sentence):
+        cancel_token = CancellationToken("tts-cache-seed")
+        if TTS_STREAM_PHRASES:
+            chunks = [chunk async for chunk in get_tts_worker().stream_audio(sentence, cancel_token=cancel_token,
+                                                                               voice=TTS_VOICE, speed=TTS_SPEED)]
+        else:
+            chunk = await get_tts_worker().generate_audio(sentence, cancel_token=cancel_token, voice=TTS_VOICE, speed=TTS_SPEED)
+            chunks = [chunk] if chunk else []
+        if chunks:
+            tts_cache.put(sentence, chunks, persist=True)
+            tts_cache.stats["seeded"] += 1
+
+    seeded = tts_cache.stats["seeded"]
+    await get_tts_worker().ensure_worker_ready()
+    results = await asyncio.gather(*(seed(sentence) for sentence in missing), return_exceptions=True)
+    for sentence, result in zip(missing, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not seed the TTS cache with '{sentence}': {result}")
+    await tts_cache.flush()
+    return tts_cache.stats["seeded"] - seeded
+
+async def stream_reply_audio(sentences, cancel_token, start_time: float = None):
+    """
+    Stream the reply audio of a request and release its cancellation token afterwards.
+    If the stream is abandoned (client disconnect), the token is cancelled so pending TTS jobs are dropped.
+    """
+    completed = False
+    first = True
     try:
-        wav_audio = await convert_to_wav(audio)
-        if cancel_event.is_set():
+        async for chunk in stream_audio_chunks(sentences, cancel_token):
+            if first and start_time is not None:
+                TIME_TO_FIRST_AUDIO.observe(time.perf_counter() - start_time, pipeline=TTS_PIPELINE)
+            first = False
+            yield chunk
+        completed = True
+    finally:
+        if not completed:
+            cancel_token.cancel("audio stream closed")
+        cancellations.release(cancel_token)
+
+
+async def conversation_audio_stream_kokoro(audio: UploadFile, background_tasks: BackgroundTasks, chatbot, cancel_token,
+                                           lease=nullcontext):
+    """
+    Transcribe the user's audio, generate the reply and stream it back as speech.
+    Every stage stops as soon as `cancel_token` is cancelled (by /cancel or a client disconnect).
+
+    With the "sentence" TTS_PIPELINE, the response starts right after the transcription and every sentence
+    is synthesized as soon as it is generated, while the rest of the reply is still being generated. The
+    reply is then generated by the response body, under the session `lease` (see reply_sentences).
+    """
+    start_time = time.perf_counter()
+    try:
+        with STAGE_SECONDS.time(stage="audio_convert"):
+            wav_audio = await convert_to_wav(audio)
+        if cancel_token.cancelled:
                 return
-        stt_result = voice_to_text(wav_audio)
-        if cancel_event.is_set():
+        stt_result = await run_in_pool("stt", voice_to_text, wav_audio)
+        if cancel_token.cancelled:
                 return
         if not stt_result["success"]:
             return JSONResponse(content={"error": stt_result["error"]}, status_code=400)
@@ -213,25 +404,35 @@ async def conversation_audio_stream_kokoro(audio: UploadFile, background_tasks:
         user_input = stt_result["text"]
         print(f"Processing user input: {user_input}")
 
-        if cancel_event.is_set():
+        if cancel_token.cancelled:
                 return
+        if TTS_PIPELINE == "sentence":
+            return StreamingResponse(
+                stream_reply_audio(reply_sentences(chatbot, user_input, cancel_token, lease), cancel_token, start_time),
+                media_type="audio/wav",
+                headers={
+                    "X-Content-Type-Options": "nosniff",
+                    "Content-Disposition": "inline"
+                }
+            )
+
         # Collect the entire response first
         response_text = ""
-        async for chunk in chatbot.stream_workflow_response(user_input):
-            if cancel_event.is_set():
+        async for chunk in chatbot.stream_workflow_response(user_input, cancel_token=cancel_token):
+            if cancel_token.cancelled:
                 return
             response_text += chunk
             
-        if cancel_event.is_set():
+        if cancel_token.cancelled:
                 return    
         response_text = preprocess_text(response_text)
         sentences = sent_tokenize(response_text)
 
-        if cancel_event.is_set():
+        if cancel_token.cancelled:
                 return
         
         return StreamingResponse(
-            stream_audio_chunks(sentences, cancel_event),
+            stream_reply_audio(sentences, cancel_token, start_time),
             media_type="audio/wav",
             headers={
                 "X-Content-Type-Options": "nosniff",
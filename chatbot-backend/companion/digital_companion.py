@@ -1,28 +1,79 @@
 from emotion.emotion_handler import EmotionHandler
 from model.model_utils import init_model, load_json_config
 from langgraph.graph import START, MessagesState, StateGraph
-from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.runnables import RunnableConfig
 from utils.supabase_utils import fetch_prompt_data
-from model.prompt_manager import PromptManager
+from utils.metrics import STAGE_SECONDS, TIME_TO_FIRST_TOKEN, TOKENS_PER_SECOND, PROMPT_TOKENS
+from utils.cancellation import CancellationToken, current_cancel_token, iterate_until_cancelled
+from model.prompt_manager import PromptManager, DEFAULT_PROMPT_LAYOUT
+from model.token_counter import TokenCounter
+from model.context_packer import ContextPacker
 from memory.memory_manager import MemoryManager
+from memory.checkpointer import create_checkpointer
 from langchain_core.messages import trim_messages
 from langchain_core.messages import AIMessageChunk, HumanMessage
 from langchain_core.messages.modifier import RemoveMessage
 import torch
+import asyncio
 import logging
+import threading
+import time
 import os
 
 
 class DigitalCompanion:
     
     MAX_CONTEXT_TOKENS = 128_000
+    SYSTEM_PROMPT_ID = 17
+    EMOTION_GROUP_ID = 6
     _model = None
+    _checkpointer = None
+    _prompt_managers = {}
+    _token_counters = {}
+    _emotion_handler = None
+    _prompt_data = None
+    # One lock per shared resource so they can be initialized in parallel
+    _prompt_lock = threading.Lock()
+    _emotion_lock = threading.Lock()
+    _model_lock = threading.Lock()
+    _checkpointer_lock = threading.Lock()
+    _token_counter_lock = threading.Lock()
     config_path = os.path.join(os.path.dirname(__file__), "default_model_config.json")
-
-    system_prompt, emotion_prompts = fetch_prompt_data(system_id=17, emotion_group_id=6)
-    prompt_manager = PromptManager(system_prompt= system_prompt)
-    emotion_handler = EmotionHandler(emotion_prompts)
+    
+    @classmethod
+    def get_prompt_data(cls):
+        """
+        Lazily fetch the system prompt and the emotion prompts (falls back to the on-disk copy when offline).
+        """
+        if cls._prompt_data is None:
+            with cls._prompt_lock:
+                if cls._prompt_data is None:
+                    cls._prompt_data = fetch_prompt_data(system_id=cls.SYSTEM_PROMPT_ID, emotion_group_id=cls.EMOTION_GROUP_ID)
+        return cls._prompt_data
+    
+    @classmethod
+    def get_prompt_manager(cls, layout: str = DEFAULT_PROMPT_LAYOUT) -> PromptManager:
+        """
+        Lazily create and return the shared prompt manager of the given prompt layout.
+        """
+        if layout not in cls._prompt_managers:
+            system_prompt, _ = cls.get_prompt_data()
+            with cls._prompt_lock:
+                if layout not in cls._prompt_managers:
+                    cls._prompt_managers[layout] = PromptManager(system_prompt= system_prompt, layout=layout)
+        return cls._prompt_managers[layout]
+    
+    @classmethod
+    def get_emotion_handler(cls) -> EmotionHandler:
+        """
+        Lazily create and return the shared emotion handler (loads the emotion model).
+        """
+        if cls._emotion_handler is None:
+            _, emotion_prompts = cls.get_prompt_data()
+            with cls._emotion_lock:
+                if cls._emotion_handler is None:
+                    cls._emotion_handler = EmotionHandler(emotion_prompts)
+        return cls._emotion_handler
     
     @classmethod
     def get_model(cls, config):
@@ -32,17 +83,45 @@ class DigitalCompanion:
             config (dict): Configuration dictionary for the model.
         """
         if cls._model is None:
-            
-            config['device'] = ("cuda" if torch.cuda.is_available() 
-                                else "mps" if torch.backends.mps.is_available() 
-                                else "cpu")
-            
-            #cls._model = ChatOllama(**config)
-            cls._model = init_model(**config)
-            logging.info(f"Initialized model: {cls._model}")
+            with cls._model_lock:
+                if cls._model is None:
+                    config['device'] = ("cuda" if torch.cuda.is_available() 
+                                        else "mps" if torch.backends.mps.is_available() 
+                                        else "cpu")
+                    
+                    #cls._model = ChatOllama(**config)
+                    cls._model = init_model(**config)
+                    logging.info(f"Initialized model: {cls._model}")
             
         return cls._model
     
+    @classmethod
+    def get_token_counter(cls, model_name: str, model=None) -> TokenCounter:
+        """
+        Lazily create and return the token counter shared by the sessions of a model.
+        Args:
+            model_name (str): The configured model name.
+            model: The model instance, used when the matching tokenizer cannot be loaded.
+        """
+        if model_name not in cls._token_counters:
+            with cls._token_counter_lock:
+                if model_name not in cls._token_counters:
+                    cls._token_counters[model_name] = TokenCounter(model_name, fallback_model=model)
+        return cls._token_counters[model_name]
+    
+    @classmethod
+    def get_checkpointer(cls):
+        """
+        Lazily create and return the conversation checkpointer shared by all sessions.
+        """
+        if cls._checkpointer is None:
+            with cls._checkpointer_lock:
+                if cls._checkpointer is None:
+                    cls._checkpointer = create_checkpointer()
+                    logging.info(f"Initialized checkpointer: {type(cls._checkpointer).__name__}")
+            
+        return cls._checkpointer
+    
     
     def __init__(self, 
                  custom_config=None,
@@ -53,14 +132,19 @@ class DigitalCompanion:
                  max_db_results = 7,
                  embedding_dim = 1024,
                  user_id = "test_3_with_demo_script",
-                 thread_id = "test_session"):
+                 thread_id = "test_session",
+                 concurrent_stages = True,
+                 prompt_layout = DEFAULT_PROMPT_LAYOUT,
+                 prefetch_memories = os.environ.get("PREFETCH_MEMORIES", "false").lower() == "true"):
         
         config = load_json_config(self.config_path)
         if custom_config:
             config.update(custom_config)
             
         self.model = self.get_model(config)
+        self.model_name = config["model"]
         self.max_tokens = config["max_tokens"]
+        self.token_counter = self.get_token_counter(self.model_name, self.model)
             
         self.memory_manager = MemoryManager(model=self.model,
                                            user_id=user_id,
@@ -75,8 +159,18 @@ class DigitalCompanion:
         self.thread_id = thread_id    
         self.config = self.setup_config()
         self.app = self.setup_workflow()
-        self.bound = DigitalCompanion.prompt_manager.prompt_template | self.model 
+        # Whether short-term memory survives this instance (and the process)
+        self.has_durable_memory = getattr(self.get_checkpointer(), "durable", False)
+        self.prompt_manager = self.get_prompt_manager(prompt_layout)
+        self.emotion_handler = self.get_emotion_handler()
+        self.bound = self.prompt_manager.prompt_template | self.model 
+        # Upper bound on the messages kept in the prompt, older ones are moved to LTM
         self.trimmer = trim_messages(strategy = "last", max_tokens = stm_limit, token_counter= len)
+        self.context_packer = ContextPacker(self.prompt_manager, self.token_counter, self.max_tokens)
+        self.concurrent_stages = concurrent_stages
+        # Retrieve the memories of the next turn while waiting for the user (see MemoryManager.prefetch_next_context)
+        self.prefetch_memories = prefetch_memories
+        self._background_tasks = set()
     ############################################################################################################  
     def setup_config(self) -> RunnableConfig:
         
@@ -94,16 +188,15 @@ class DigitalCompanion:
 
         Notes:
             - The `self.call_model` method is expected to be defined in the class and used as the node's processing function.
-            - The `MemorySaver` checkpointer keeps the state in memory, making this suitable for short-term or in-memory workflows.
+            - The checkpointer is shared by all sessions and selected with CHECKPOINT_BACKEND. The default SQLite
+              backend keeps the state on disk, so it survives restarts and can be served by any worker.
         """
         workflow = StateGraph(state_schema=MessagesState)
         # Define the node and edge
         workflow.add_node("model", self.call_model)
         workflow.add_edge(START, "model")
         
-        # Add simple in-memory checkpointer
-        memory = MemorySaver()
-        app = workflow.compile(checkpointer=memory)
+        app = workflow.compile(checkpointer=self.get_checkpointer())
         return app
     
     ############################################################################################################   
@@ -120,11 +213,14 @@ class DigitalCompanion:
             dict: A dictionary containing the AI's response as a list of messages.
 
         Workflow:
-            1. Manage memory by saving excess messages to long-term memory.
+            1. Manage memory by saving excess messages to long-term memory (in the background).
             2. Trim short-term memory (STM) messages to fit within the token limit.
             3. Retrieve relevant long-term memories based on the user's input.
             4. Generate an emotion-guided system prompt based on the user's input.
-            5. Call the model with STM messages and retrieved memories to generate a response.
+            5. Pack the STM messages and retrieved memories into the token budget and call the model.
+
+            With `concurrent_stages` enabled, steps 3 and 4 run concurrently and step 1 is a
+            write-behind task that does not delay the first token.
 
         Error Handling:
             - Logs any errors that occur during processing.
@@ -138,35 +234,44 @@ class DigitalCompanion:
             
             user_input = state["messages"][-1].content
             
-            await self.memory_manager.transfer_excess_to_ltm(state)
+            if self.concurrent_stages:
+                # The LTM write has no effect on the current reply, keep it off the time-to-first-token path.
+                # It is dropped if the request is cancelled; the next turn catches up on the skipped messages.
+                task = self.run_in_background(self.memory_manager.transfer_excess_to_ltm(state))
+                cancel_token = current_cancel_token.get()
+                if cancel_token is not None:
+                    cancel_token.link_task(task)
+            else:
+                await self.memory_manager.transfer_excess_to_ltm(state)
             
             stm_messages = self.trimmer.invoke(state["messages"])
             #logging.info(f"Trimmed short-term memory: {stm_messages}")
             
-            # Step 3: Retrieve relevant long-term memories
-            relevant_memories = await self.memory_manager.retrieve_relevant_context(query=user_input)
-            #logging.info(f"Retrieved relevant memories: {relevant_memories}")
-            
-            # Step 4: Generate emotion guidance
-            detected_emotion, emotion_guidance = DigitalCompanion.emotion_handler.generate_emotion_prompt(user_input)
-            #logging.info(f"Generated emotion guidance: {emotion_guidance}")
+            if self.concurrent_stages:
+                # Steps 3 and 4 are independent: retrieve memories while the emotion model runs (micro-batched) in its pool
+                scored_memories, (detected_emotion, emotion_guidance) = await asyncio.gather(
+                    self.memory_manager.retrieve_scored_context(query=user_input),
+                    STAGE_SECONDS.timed(self.emotion_handler.agenerate_emotion_prompt(user_input), stage="emotion_detection"),
+                )
+            else:
+                # Step 3: Retrieve relevant long-term memories
+                scored_memories = await self.memory_manager.retrieve_scored_context(query=user_input)
+                #logging.info(f"Retrieved relevant memories: {scored_memories}")
+                
+                # Step 4: Generate emotion guidance
+                with STAGE_SECONDS.time(stage="emotion_detection"):
+                    detected_emotion, emotion_guidance = await self.emotion_handler.agenerate_emotion_prompt(user_input)
+                #logging.info(f"Generated emotion guidance: {emotion_guidance}")
             
-            valid_input_size = DigitalCompanion.prompt_manager.validate_prompt_size(self.model, detected_emotion, emotion_guidance, relevant_memories, stm_messages, self.max_tokens)
+            # Step 5: Fit the prompt into the token budget, dropping the least valuable context first
+            with STAGE_SECONDS.time(stage="context_packing"):
+                prompt_inputs, prompt_tokens = self.context_packer.pack(detected_emotion, emotion_guidance, scored_memories, stm_messages)
+            PROMPT_TOKENS.observe(prompt_tokens)
             
-            if valid_input_size:
+            response = await self.bound.ainvoke(prompt_inputs, config)
                 
-                response = await self.bound.ainvoke(
-                        {
-                            "messages": stm_messages,
-                            "detected_emotion": detected_emotion,
-                            "emotion_prompt": emotion_guidance,
-                            "recall_memories": relevant_memories,
-                        },
-                        config
-                    )
-                    
-                #print(f"metadata: response.usage_metadata: {response.usage_metadata}")    ## response.usage_metadata[output_tokens]
-                return {"messages": response}
+            #print(f"metadata: response.usage_metadata: {response.usage_metadata}")    ## response.usage_metadata[output_tokens]
+            return {"messages": response}
         
         except Exception as e:
             logging.error(f"Error in call_model: {e}")
@@ -175,21 +280,72 @@ class DigitalCompanion:
     
     
     
-    async def stream_workflow_response(self, user_input:str):
+    def run_in_background(self, coro) -> asyncio.Task:
+        """
+        Schedules a write-behind coroutine and keeps a reference to it until it completes.
+
+        Args:
+            coro: The coroutine to run.
+
+        Returns:
+            asyncio.Task: The scheduled task.
+        """
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._on_background_task_done)
+        return task
+    
+    
+    def _on_background_task_done(self, task: asyncio.Task) -> None:
+        self._background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Background task failed for user {self.user_id}: {task.exception()}")
+    
+    
+    async def wait_for_background_tasks(self) -> None:
+        """
+        Waits until every pending write-behind task of this session has finished.
+        """
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+    
+    
+    async def stream_workflow_response(self, user_input:str, cancel_token: CancellationToken = None):
+        """
+        Streams the response tokens for the given user input.
+
+        Args:
+            user_input (str): The user's input message.
+            cancel_token (CancellationToken, optional): Stops the generation (and the turn's
+                background work) as soon as it is cancelled.
+
+        Yields:
+            str: Each token streamed during the response.
+        """
         # Replace the input with your user's query
         inputs = [HumanMessage(content=user_input)]
         first = True
         gathered = None
+        start_time = time.perf_counter()
+        first_token_time = None
+        token_chunks = 0
         
         try:
             #logging.info("Starting to stream the response...")
             #print("Streaming response:\n"
             #      )
+            # Expose the token to the graph nodes, which run in tasks created from this context
+            current_cancel_token.set(cancel_token)
             # Here we specify stream_mode="messages" to get token-level updates.
-            async for msg, metadata in self.app.astream({"messages": inputs}, config=self.config, stream_mode="messages"):
+            stream = self.app.astream({"messages": inputs}, config=self.config, stream_mode="messages")
+            async for msg, metadata in iterate_until_cancelled(stream, cancel_token):
                 # Only print AI message content (chunks), exclude Human messages
                 if msg.content and not isinstance(msg, HumanMessage):
                     token = msg.content
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                        TIME_TO_FIRST_TOKEN.observe(first_token_time - start_time)
+                    token_chunks += 1
                     #print(token, end="", flush=True)
                     yield token
 
@@ -201,6 +357,17 @@ class DigitalCompanion:
                     else:
                         gathered = gathered + msg
 
+            if first_token_time is not None:
+                # Prefer the model's own token count, fall back to the number of streamed chunks
+                usage = getattr(gathered, "usage_metadata", None) or {}
+                output_tokens = usage.get("output_tokens") or token_chunks
+                generation_time = time.perf_counter() - first_token_time
+                if generation_time > 0 and output_tokens > 1:
+                    TOKENS_PER_SECOND.observe((output_tokens - 1) / generation_time)
+
+            if self.prefetch_memories and gathered is not None and not (cancel_token and cancel_token.cancelled):
+                self.run_in_background(self.memory_manager.prefetch_next_context(user_input, gathered.content))
+
             #logging.info("Streaming completed successfully.")
             #output_tokens_count = self.app.get_state(self.config).values['messages'][-1].usage_metadata['output_tokens']
             #print(f"state: {output_tokens_count}")    
@@ -212,6 +379,25 @@ class DigitalCompanion:
     
     
     
+    def get_short_term_messages(self) -> list:
+        """
+        Returns the messages currently held in the short-term memory of this session.
+        """
+        state = self.app.get_state(self.config)
+        return list(state.values.get("messages", [])) if state and state.values else []
+    
+    
+    def load_short_term_messages(self, messages: list) -> None:
+        """
+        Seeds the short-term memory of this session with previously saved messages.
+
+        Args:
+            messages (list): Messages restored from a spilled session.
+        """
+        if messages:
+            self.app.update_state(self.config, {"messages": messages}, as_node="model")
+    
+    
     async def clear_short_term_memory(self) -> None:
             
         try:
@@ -222,6 +408,7 @@ class DigitalCompanion:
             for message in messages:
                 self.app.update_state(self.config, {"messages": RemoveMessage(id=message.id)})
                 logging.info(f"Deleted message with ID: {message.id}")
+            self.memory_manager.reset_ltm_progress()
 
             logging.info("Successfully cleared short-term memory.")
         except Exception as e:
@@ -233,6 +420,7 @@ class DigitalCompanion:
         """
         Clear both short-term and long-term memory for the user.
         """
+        await self.wait_for_background_tasks()
         await self.clear_short_term_memory()
         await self.memory_manager.clear_long_term_memory()
         logging.info("Successfully cleared all memories.")
@@ -4,6 +4,7 @@ from langgraph.graph import START, MessagesState, StateGraph
 from langgraph.checkpoint.memory import MemorySaver
 from langchain_core.runnables import RunnableConfig
 from model.prompt_manager import PromptManager
+from model.token_counter import TokenCounter
 from memory.memory_manager import MemoryManager
 from langchain_core.messages import trim_messages
 from langchain_core.messages import HumanMessage
@@ -24,6 +25,7 @@ class DigitalCompanion:
             
         self.model = init_model(model=params['model_name'], temperature=params['temperature'], max_tokens=params['max_tokens'], top_p=params['top_p'], device=params['hardware'], stream=params['streaming'])
         self.max_tokens = params['max_tokens']
+        self.token_counter = TokenCounter(params['model_name'], fallback_model=self.model)
             
         self.memory_manager = MemoryManager(model=self.model,
                                            user_id=user_id,
@@ -106,6 +108,8 @@ class DigitalCompanion:
             user_input = state["messages"][-1].content
             
             await self.memory_manager.transfer_excess_to_ltm(state)
+            # Evaluation runs read their own writes, as before the writes were queued
+            await MemoryManager.flush_pending_writes()
             
             stm_messages = self.trimmer.invoke(state["messages"])
             logging.info(f"Trimmed short-term memory: {stm_messages}")
@@ -118,7 +122,7 @@ class DigitalCompanion:
             detected_emotion, emotion_guidance = self.emotion_handler.generate_emotion_prompt(user_input)
             logging.info(f"Generated emotion guidance: {emotion_guidance}")
             
-            valid_input_size = self.prompt_manager.validate_prompt_size(self.model, detected_emotion, emotion_guidance, relevant_memories, stm_messages, self.max_tokens)
+            valid_input_size = self.prompt_manager.validate_prompt_size(self.token_counter, detected_emotion, emotion_guidance, relevant_memories, stm_messages, self.max_tokens)
             
             if valid_input_size:
                 
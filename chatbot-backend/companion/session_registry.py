@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import hashlib
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+
+def _current_rss_mb():
+    """
+    Returns the resident set size of the current process in MB, or None when it cannot be read.
+    Uses psutil when installed (required on Windows), /proc/self/statm otherwise.
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class SessionRegistry:
+    """
+    Bounded registry of per-user DigitalCompanion instances.
+
+    Sessions are kept in least-recently-used order. A session is evicted when:
+        - the registry holds more than `max_sessions` entries (LRU),
+        - it has been idle for longer than `idle_ttl` seconds,
+        - the process RSS exceeds `max_rss_mb` (LRU, only when configured). At most one session is evicted
+          per check: CPython rarely returns freed memory to the OS, so RSS does not drop after an eviction
+          and evicting until it does would empty the registry. Needs psutil on Windows, the cap is
+          disabled (with a warning) when RSS cannot be read.
+
+    Before eviction the session's short-term messages are spilled to `spill_dir`
+    and restored on the user's next request, unless the companion's checkpointer
+    is already durable.
+    """
+
+    def __init__(self,
+                 factory,
+                 max_sessions: int = 100,
+                 idle_ttl: float = 1800.0,
+                 max_rss_mb: float = None,
+                 spill_dir: str = None):
+        """
+        Args:
+            factory (callable): Called with a user_id to create a new DigitalCompanion.
+            max_sessions (int): Maximum number of live sessions.
+            idle_ttl (float): Seconds of inactivity after which a session is evicted.
+            max_rss_mb (float, optional): Process memory cap in MB that triggers LRU eviction.
+            spill_dir (str, optional): Directory for spilled short-term memory. Disabled when None.
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_rss_mb = max_rss_mb
+        if self.max_rss_mb and _current_rss_mb() is None:
+            logging.warning("SESSION_MAX_RSS_MB is set but the process RSS cannot be read (install psutil), "
+                            "the memory cap is disabled.")
+            self.max_rss_mb = None
+        self.spill_dir = spill_dir
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+        self._sessions = OrderedDict()  # user_id -> (companion, last_access)
+        self._leases = {}
+        self._creating = {}  # user_id -> task building its companion (see aget)
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions_lru": 0,
+            "evictions_ttl": 0,
+            "evictions_memory": 0,
+            "spills": 0,
+            "restores": 0,
+        }
+
+    @classmethod
+    def from_env(cls, factory):
+        """
+        Creates a registry configured from SESSION_* environment variables.
+        """
+        max_rss_mb = os.environ.get("SESSION_MAX_RSS_MB")
+        return cls(factory=factory,
+                   max_sessions=int(os.environ.get("SESSION_MAX_SESSIONS", 100)),
+                   idle_ttl=float(os.environ.get("SESSION_IDLE_TTL", 1800)),
+                   max_rss_mb=float(max_rss_mb) if max_rss_mb else None,
+                   spill_dir=os.environ.get("SESSION_SPILL_DIR", os.path.join("data", "sessions")))
+
+    ############################################################################################################
+    def get(self, user_id: str):
+        """
+        Returns the companion for `user_id`, creating (and restoring) it if needed.
+        """
+        now = time.monotonic()
+        entry = self._sessions.get(user_id)
+        if entry is not None:
+            self.stats["hits"] += 1
+            companion = entry[0]
+            self._sessions[user_id] = (companion, now)
+            self._sessions.move_to_end(user_id)
+        else:
+            self.stats["misses"] += 1
+            companion = self.factory(user_id)
+            self._restore(user_id, companion)
+            self._sessions[user_id] = (companion, now)
+
+        self.evict_expired()
+        self._enforce_limits()
+        return companion
+
+    async def aget(self, user_id: str):
+        """
+        Like `get`, but a new companion is built in a thread: creating the first one loads the models
+        (vector store, embeddings, emotion detector), which must not block the event loop. Concurrent
+        requests of the same user wait for the same build.
+        """
+        if user_id in self._sessions:
+            return self.get(user_id)
+        task = self._creating.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self.factory, user_id))
+            self._creating[user_id] = task
+            task.add_done_callback(lambda _: self._creating.pop(user_id, None))
+        companion = await asyncio.shield(task)
+        if user_id in self._sessions:
+            return self.get(user_id)
+        self.stats["misses"] += 1
+        self._restore(user_id, companion)
+        self._sessions[user_id] = (companion, time.monotonic())
+        self.evict_expired()
+        self._enforce_limits()
+        return companion
+
+    @contextmanager
+    def lease(self, user_id: str):
+        """
+        Pins a session for the duration of a request so it is never evicted mid-turn.
+        """
+        self._leases[user_id] = self._leases.get(user_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._leases[user_id] -= 1
+            if self._leases[user_id] <= 0:
+                del self._leases[user_id]
+            if user_id in self._sessions:
+                companion, _ = self._sessions[user_id]
+                self._sessions[user_id] = (companion, time.monotonic())
+
+    def evict_expired(self) -> int:
+        """
+        Evicts every session that has been idle for longer than `idle_ttl`.
+
+        Returns:
+            int: Number of evicted sessions.
+        """
+        if not self.idle_ttl:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl
+        expired = [user_id for user_id, (_, last_access) in self._sessions.items()
+                   if last_access < deadline and user_id not in self._leases]
+        for user_id in expired:
+            self._evict(user_id, reason="ttl")
+        return len(expired)
+
+    def _enforce_limits(self):
+        for user_id in self._eviction_candidates():
+            if len(self._sessions) <= self.max_sessions:
+                break
+            self._evict(user_id, reason="lru")
+
+        if self.max_rss_mb and len(self._sessions) > 1:
+            rss = _current_rss_mb()
+            candidates = self._eviction_candidates()
+            # One session per check, the RSS does not tell whether an eviction freed anything
+            if rss is not None and rss > self.max_rss_mb and candidates:
+                self._evict(candidates[0], reason="memory")
+
+    def _eviction_candidates(self):
+        # Oldest first, never the sessions that are serving a request
+        return [user_id for user_id in list(self._sessions) if user_id not in self._leases]
+
+    def _evict(self, user_id: str, reason: str):
+        companion, _ = self._sessions.pop(user_id)
+        self.stats[f"evictions_{reason}"] += 1
+        try:
+            self._spill(user_id, companion)
+        except Exception as e:
+            logging.error(f"Error spilling session for user {user_id}: {e}")
+        logging.info(f"Evicted session for user {user_id} ({reason}).")
+
+    ############################################################################################################
+    def _spill_path(self, user_id: str) -> str:
+        # User ids may contain path separators or characters not allowed in file names
+        name = hashlib.sha1(str(user_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.spill_dir, f"{name}.json")
+
+    def _spill(self, user_id: str, companion):
+        if not self.spill_dir or getattr(companion, "has_durable_memory", False):
+            return
+        messages = companion.get_short_term_messages()
+        if not messages:
+            return
+        tmp_path = self._spill_path(user_id) + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(messages_to_dict(messages), file)
+        os.replace(tmp_path, self._spill_path(user_id))
+        self.stats["spills"] += 1
+
+    def _restore(self, user_id: str, companion):
+        if not self.spill_dir:
+            return
+        path = self._spill_path(user_id)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r") as file:
+                messages = messages_from_dict(json.load(file))
+            companion.load_short_term_messages(messages)
+        except Exception as e:
+            # Keep the spilled history, it is the only copy
+            logging.error(f"Error restoring session for user {user_id}, keeping {path}: {e}")
+            return
+        self.stats["restores"] += 1
+        os.remove(path)
+
+    ############################################################################################################
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get_stats(self) -> dict:
+        """
+        Returns the hit/miss/eviction counters together with the current size and limits.
+        """
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            "active_sessions": len(self._sessions),
+            "leased_sessions": len(self._leases),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "max_rss_mb": self.max_rss_mb,
+            "rss_mb": _current_rss_mb(),
+        }
@@ -1,29 +1,66 @@
 from transformers import AutoModelForSequenceClassification, AutoTokenizer
 import torch
 import numpy as np
+import os
+
+MODEL_NAME = "SamLowe/roberta-base-go_emotions"
+
+# Map emotion indices to labels
+GO_EMOTIONS = [
+    'admiration', 'amusement', 'anger', 'annoyance', 'approval', 'caring',
+    'confusion', 'curiosity', 'desire', 'disappointment', 'disapproval',
+    'disgust', 'embarrassment', 'excitement', 'fear', 'gratitude', 'grief',
+    'joy', 'love', 'nervousness', 'optimism', 'pride', 'realization',
+    'relief', 'remorse', 'sadness', 'surprise', 'neutral'
+]
+
+
+def create_emotion_detector(backend: str = None, tiered: bool = None):
+    """
+    Create the emotion detector of the configured backend.
+
+    Args:
+        backend (str, optional): "torch" (PyTorch fp32) or "onnx" (ONNX Runtime int8).
+            Defaults to the EMOTION_BACKEND env var, then "torch".
+        tiered (bool, optional): Put the cache and lexical tiers in front of the model.
+            Defaults to the EMOTION_TIERED env var, then False.
+    """
+    backend = (backend or os.environ.get("EMOTION_BACKEND", "torch")).lower()
+    if tiered is None:
+        tiered = os.environ.get("EMOTION_TIERED", "false").lower() in ("1", "true", "yes")
+    if backend == "torch":
+        detector = EmotionDetector()
+    elif backend == "onnx":
+        from emotion.emotion_detection.onnx_backend import OnnxEmotionDetector
+        detector = OnnxEmotionDetector()
+    else:
+        raise ValueError(f"Unknown emotion backend '{backend}', expected 'torch' or 'onnx'")
+    if tiered:
+        from emotion.emotion_detection.tiered_detector import TieredEmotionDetector
+        detector = TieredEmotionDetector(detector)
+    return detector
+
 
 class EmotionDetector:
     def __init__(self):
-        self.model_name = "SamLowe/roberta-base-go_emotions"
+        self.model_name = MODEL_NAME
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
         self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
-        
-        # Map emotion indices to labels
-        self.emotions = [
-            'admiration', 'amusement', 'anger', 'annoyance', 'approval', 'caring',
-            'confusion', 'curiosity', 'desire', 'disappointment', 'disapproval',
-            'disgust', 'embarrassment', 'excitement', 'fear', 'gratitude', 'grief',
-            'joy', 'love', 'nervousness', 'optimism', 'pride', 'realization',
-            'relief', 'remorse', 'sadness', 'surprise', 'neutral'
-        ]
+        self.emotions = GO_EMOTIONS
 
     def detect_emotion(self, text):
         """
         Detect emotions in the given text using the RoBERTa model.
         Returns both the primary emotion and the full emotion distribution.
         """
-        # Tokenize the text
-        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
+        return self.detect_emotion_batch([text])[0]
+
+    def predict_scores(self, texts):
+        """
+        Run the model on a batch of texts and return the emotion probabilities, shape (len(texts), 28).
+        """
+        # Tokenize the texts, padded to the longest one
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=512)
         
         # Get model predictions
         with torch.no_grad():
@@ -31,18 +68,28 @@ class EmotionDetector:
             predictions = torch.nn.functional.softmax(outputs.logits, dim=-1)
             
         # Convert predictions to numpy for easier handling
-        scores = predictions.numpy()[0]
-        
-        # Get the primary emotion (highest score)
-        primary_emotion = self.emotions[np.argmax(scores)]
-        
-        # Create a dictionary of all emotions and their scores
-        emotion_scores = {emotion: float(score) for emotion, score in zip(self.emotions, scores)}
+        return predictions.numpy()
+
+    def detect_emotion_batch(self, texts):
+        """
+        Detect emotions in several texts with one padded forward pass.
+        Returns one result per text, in the same format as `detect_emotion`.
+        """
+        all_scores = self.predict_scores(texts)
         
-        return {
-            'primary_emotion': primary_emotion,
-            'emotion_scores': emotion_scores
-        }
+        results = []
+        for scores in all_scores:
+            # Get the primary emotion (highest score)
+            primary_emotion = self.emotions[np.argmax(scores)]
+            
+            # Create a dictionary of all emotions and their scores
+            emotion_scores = {emotion: float(score) for emotion, score in zip(self.emotions, scores)}
+            
+            results.append({
+                'primary_emotion': primary_emotion,
+                'emotion_scores': emotion_scores
+            })
+        return results
 
     def get_emotional_response(self, text, response):
         """
@@ -0,0 +1,117 @@
+import os
+import logging
+import numpy as np
+from transformers import AutoTokenizer
+from emotion.emotion_detection.go_emotions import EmotionDetector, GO_EMOTIONS, MODEL_NAME
+
+## Exported models are cached per model name below this directory
+ONNX_CACHE_DIR = os.environ.get("ONNX_CACHE_DIR", os.path.join("data", "onnx"))
+ONNX_OPSET = 14
+
+
+def export_quantized_model(model_name: str = MODEL_NAME, cache_dir: str = ONNX_CACHE_DIR) -> str:
+    """
+    Export the classifier to ONNX with int8 dynamic quantization, unless it is already cached.
+
+    Args:
+        model_name (str): The Hugging Face model to export.
+        cache_dir (str): Directory of the exported models.
+
+    Returns:
+        str: The path of the quantized model.
+    """
+    target_dir = os.path.join(cache_dir, model_name.replace("/", "--"))
+    quantized_path = os.path.join(target_dir, "model.int8.onnx")
+    if os.path.exists(quantized_path):
+        return quantized_path
+
+    import torch
+    from transformers import AutoModelForSequenceClassification
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    logging.info(f"Exporting {model_name} to ONNX (int8), this only happens once.")
+    os.makedirs(target_dir, exist_ok=True)
+    # Unique temporary names so that concurrent workers exporting at the same time do not clash
+    fp32_path = os.path.join(target_dir, f"model.fp32.{os.getpid()}.onnx")
+    tmp_path = os.path.join(target_dir, f"model.int8.{os.getpid()}.onnx")
+
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    sample = tokenizer(["How are you feeling today?"], return_tensors="pt")
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                LogitsOnly(model),
+                (sample["input_ids"], sample["attention_mask"]),
+                fp32_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["logits"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "logits": {0: "batch"},
+                },
+                opset_version=ONNX_OPSET,
+            )
+        quantize_dynamic(fp32_path, tmp_path, weight_type=QuantType.QInt8)
+        # Publish atomically, a reader never sees a partially written model
+        os.replace(tmp_path, quantized_path)
+    finally:
+        for path in (fp32_path, tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+    logging.info(f"Exported quantized model to {quantized_path}")
+    return quantized_path
+
+
+class OnnxEmotionDetector(EmotionDetector):
+    """
+    GoEmotions classifier running an int8 quantized ONNX export of the model on ONNX Runtime.
+    Returns the same results as EmotionDetector.
+    """
+
+    def __init__(self, cache_dir: str = ONNX_CACHE_DIR, num_threads: int = None):
+        """
+        Args:
+            cache_dir (str): Directory of the exported models (ONNX_CACHE_DIR, default data/onnx).
+            num_threads (int, optional): Intra-op threads of ONNX Runtime (ONNX_NUM_THREADS, default: runtime choice).
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("EMOTION_BACKEND=onnx requires onnxruntime and onnx (pip install onnxruntime onnx)") from e
+
+        self.model_name = MODEL_NAME
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.emotions = GO_EMOTIONS
+        self.model_path = export_quantized_model(self.model_name, cache_dir)
+
+        options = ort.SessionOptions()
+        num_threads = num_threads or int(os.environ.get("ONNX_NUM_THREADS", 0))
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+
+    def predict_scores(self, texts):
+        """
+        Run the quantized model on a batch of texts and return the emotion probabilities.
+        """
+        inputs = self.tokenizer(texts, return_tensors="np", padding=True, truncation=True, max_length=512)
+        logits = self.session.run(["logits"], {
+            "input_ids": inputs["input_ids"].astype(np.int64),
+            "attention_mask": inputs["attention_mask"].astype(np.int64),
+        })[0]
+        # Softmax, as in the torch path
+        logits = logits - logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
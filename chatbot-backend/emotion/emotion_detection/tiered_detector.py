@@ -0,0 +1,277 @@
+import os
+import re
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+from emotion.emotion_detection.go_emotions import GO_EMOTIONS
+from utils.metrics import Counter
+
+EMOTION_CACHE_SIZE = int(os.environ.get("EMOTION_CACHE_SIZE", 4096))
+## Longer texts rarely repeat and are not cached
+EMOTION_CACHE_MAX_CHARS = 256
+## The lexical model answers short texts when its top probability reaches the threshold
+LEXICAL_CONFIDENCE = float(os.environ.get("EMOTION_LEXICAL_CONFIDENCE", 0.9))
+LEXICAL_MAX_WORDS = int(os.environ.get("EMOTION_LEXICAL_MAX_WORDS", 12))
+## Number of transformer-labelled texts the lexical model learns from before it may answer
+LEXICAL_MIN_SAMPLES = int(os.environ.get("EMOTION_LEXICAL_MIN_SAMPLES", 500))
+LEXICAL_MODEL_PATH = os.environ.get("EMOTION_LEXICAL_MODEL_PATH", os.path.join("data", "emotion_lexical.joblib"))
+LEXICAL_SAVE_EVERY = 200
+## Share of lexical answers also run through the transformer to measure their agreement with it
+LEXICAL_AUDIT_RATE = float(os.environ.get("EMOTION_LEXICAL_AUDIT_RATE", 0.1))
+## The lexical tier is disabled when it agrees with the transformer on less than this share of the
+## last LEXICAL_AUDIT_WINDOW audits (checked once LEXICAL_AUDIT_MIN audits were made)
+LEXICAL_MIN_AGREEMENT = float(os.environ.get("EMOTION_LEXICAL_MIN_AGREEMENT", 0.85))
+LEXICAL_AUDIT_WINDOW = 200
+LEXICAL_AUDIT_MIN = 50
+
+EMOTION_TIER_ANSWERS = Counter(
+    "sage_emotion_tier_answers_total",
+    "Emotion detections answered by each tier (cache, lexical, transformer).",
+    labelnames=("tier",),
+)
+EMOTION_SECONDS_SAVED = Counter(
+    "sage_emotion_seconds_saved_total",
+    "Estimated transformer time saved by the cache and lexical tiers.",
+)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Lower-cases the text and drops punctuation and repeated whitespace, e.g. "Thank you!!" -> "thank you".
+    """
+    text = re.sub(r"[^\w\s']", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class TieredEmotionDetector:
+    """
+    Emotion detector answering from the cheapest confident tier.
+
+    1. cache: results of previously seen (normalized) texts.
+    2. lexical: a linear model over hashed character n-grams, learned online from the transformer's
+       answers, used for short texts once it has seen enough samples and is confident. A share of its
+       answers (`audit_rate`) is checked against the transformer, the tier is disabled for the rest of
+       the process when their agreement falls below `min_agreement`.
+    3. transformer: the wrapped detector (torch or ONNX), for everything else.
+
+    Has the same interface and result format as EmotionDetector.
+    """
+
+    def __init__(self, detector, model_path: str = LEXICAL_MODEL_PATH, confidence: float = LEXICAL_CONFIDENCE,
+                 cache_size: int = EMOTION_CACHE_SIZE, min_samples: int = LEXICAL_MIN_SAMPLES,
+                 audit_rate: float = LEXICAL_AUDIT_RATE, min_agreement: float = LEXICAL_MIN_AGREEMENT):
+        """
+        Args:
+            detector: The transformer emotion detector used as the last tier.
+            model_path (str): Where the lexical model is saved and loaded from.
+            confidence (float): Minimum probability for the lexical tier to answer.
+            cache_size (int): Number of cached results.
+            min_samples (int): Number of samples the lexical model learns from before it may answer.
+            audit_rate (float): Share of lexical answers checked against the transformer.
+            min_agreement (float): Agreement with the transformer below which the lexical tier is disabled.
+        """
+        from sklearn.feature_extraction.text import HashingVectorizer
+        from sklearn.linear_model import SGDClassifier
+
+        self.detector = detector
+        self.model_name = detector.model_name
+        self.emotions = GO_EMOTIONS
+        self.model_path = model_path
+        self.confidence = confidence
+        self.cache_size = cache_size
+        self.min_samples = min_samples
+        self.audit_rate = audit_rate
+        self.min_agreement = min_agreement
+        self.lexical_enabled = True
+        # Whether the audited lexical answers had the transformer's primary emotion, most recent last
+        self._audits = deque(maxlen=LEXICAL_AUDIT_WINDOW)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.vectorizer = HashingVectorizer(analyzer="char_wb", ngram_range=(2, 4), n_features=2**18, alternate_sign=False)
+        self.lexical_model = SGDClassifier(loss="log_loss", alpha=1e-5)
+        self.lexical_samples = 0
+        self._unsaved_samples = 0
+        # Moving average of the transformer time per text, used to estimate the time saved
+        self._transformer_seconds = None
+        self.stats = {"cache": 0, "lexical": 0, "transformer": 0, "audited": 0, "seconds_saved": 0.0}
+        self._load_lexical_model()
+
+    ############################################################################################################
+
+    def _load_lexical_model(self) -> None:
+        if not os.path.exists(self.model_path):
+            return
+        try:
+            import joblib
+            saved = joblib.load(self.model_path)
+            self.lexical_model, self.lexical_samples = saved["model"], saved["samples"]
+            logging.info(f"Loaded lexical emotion model trained on {self.lexical_samples} samples")
+        except Exception as e:
+            logging.warning(f"Could not load the lexical emotion model from {self.model_path}: {e}")
+
+    def save_lexical_model(self) -> None:
+        """
+        Saves the lexical model so that it is ready after a restart.
+        """
+        import joblib
+        with self._lock:
+            if not self.lexical_samples:
+                return
+            os.makedirs(os.path.dirname(self.model_path) or ".", exist_ok=True)
+            tmp_path = f"{self.model_path}.{os.getpid()}.tmp"
+            joblib.dump({"model": self.lexical_model, "samples": self.lexical_samples}, tmp_path)
+            os.replace(tmp_path, self.model_path)
+            self._unsaved_samples = 0
+
+    ############################################################################################################
+
+    def _lexical_results(self, texts):
+        """
+        Returns the confident lexical results, None for the texts the model is not sure about.
+        """
+        if not self.lexical_enabled or self.lexical_samples < self.min_samples:
+            return [None] * len(texts)
+        probabilities = self.lexical_model.predict_proba(self.vectorizer.transform(texts))
+        # predict_proba columns follow the sorted classes, report the scores in the GoEmotions order
+        columns = {emotion: i for i, emotion in enumerate(self.lexical_model.classes_)}
+        results = []
+        for text, scores in zip(texts, probabilities):
+            if len(text.split()) > LEXICAL_MAX_WORDS or scores.max() < self.confidence:
+                results.append(None)
+                continue
+            results.append({
+                'primary_emotion': str(self.lexical_model.classes_[int(np.argmax(scores))]),
+                'emotion_scores': {emotion: float(scores[columns[emotion]]) for emotion in self.emotions},
+            })
+        return results
+
+    def _learn(self, texts, results) -> None:
+        labels = [result["primary_emotion"] for result in results]
+        self.lexical_model.partial_fit(self.vectorizer.transform(texts), labels, classes=self.emotions)
+        self.lexical_samples += len(texts)
+        self._unsaved_samples += len(texts)
+
+    def _audit(self, lexical_emotions, transformer_results) -> None:
+        """
+        Records whether audited lexical answers agree with the transformer, disables the tier when they stop to.
+        """
+        self.stats["audited"] += len(lexical_emotions)
+        for emotion, result in zip(lexical_emotions, transformer_results):
+            self._audits.append(emotion == result["primary_emotion"])
+        if len(self._audits) < LEXICAL_AUDIT_MIN or not self.lexical_enabled:
+            return
+        agreement = sum(self._audits) / len(self._audits)
+        if agreement < self.min_agreement:
+            self.lexical_enabled = False
+            logging.warning(f"Lexical emotion tier disabled: it agreed with the transformer on {agreement:.0%} "
+                            f"of the last {len(self._audits)} audited texts (minimum {self.min_agreement:.0%})")
+
+    @staticmethod
+    def _copy(result: dict) -> dict:
+        # Callers may modify their result, the cached one is shared
+        return {**result, 'emotion_scores': dict(result['emotion_scores'])}
+
+    def _cache_result(self, key: str, result: dict) -> None:
+        if len(key) > EMOTION_CACHE_MAX_CHARS:
+            return
+        self._cache[key] = result
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _record(self, answers: dict, seconds_saved: float) -> None:
+        with self._lock:
+            for tier, count in answers.items():
+                if count:
+                    self.stats[tier] += count
+                    EMOTION_TIER_ANSWERS.inc(count, tier=tier)
+            if seconds_saved > 0:
+                self.stats["seconds_saved"] += seconds_saved
+                EMOTION_SECONDS_SAVED.inc(seconds_saved)
+
+    ############################################################################################################
+
+    def detect_emotion(self, text):
+        """
+        Detect emotions in the given text from the cheapest confident tier.
+        """
+        return self.detect_emotion_batch([text])[0]
+
+    def detect_emotion_batch(self, texts):
+        """
+        Detect emotions in several texts; only the texts no cheaper tier is confident about reach the transformer.
+        """
+        start_time = time.perf_counter()
+        keys = [normalize_text(text) for text in texts]
+        results = [None] * len(texts)
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+                    results[i] = self._copy(cached)
+            from_cache = sum(result is not None for result in results)
+
+            pending = [i for i, result in enumerate(results) if result is None]
+            # Index -> lexical primary emotion of the answers sent to the transformer for an audit
+            audited = {}
+            if pending:
+                for i, result in zip(pending, self._lexical_results([keys[i] for i in pending])):
+                    if result is None:
+                        continue
+                    if random.random() < self.audit_rate:
+                        audited[i] = result['primary_emotion']
+                        continue
+                    results[i] = result
+                    self._cache_result(keys[i], self._copy(result))
+            from_lexical = len(pending) - sum(results[i] is None for i in pending)
+        cheap_seconds = time.perf_counter() - start_time
+
+        remaining = [i for i, result in enumerate(results) if result is None]
+        if remaining:
+            transformer_start = time.perf_counter()
+            transformer_results = self.detector.detect_emotion_batch([texts[i] for i in remaining])
+            per_text = (time.perf_counter() - transformer_start) / len(remaining)
+            with self._lock:
+                self._transformer_seconds = per_text if self._transformer_seconds is None \
+                    else 0.9 * self._transformer_seconds + 0.1 * per_text
+                for i, result in zip(remaining, transformer_results):
+                    results[i] = result
+                    self._cache_result(keys[i], self._copy(result))
+                if audited:
+                    self._audit([audited[i] for i in remaining if i in audited],
+                                [result for i, result in zip(remaining, transformer_results) if i in audited])
+                # The transformer teaches the lexical model
+                self._learn([keys[i] for i in remaining], transformer_results)
+            if self._unsaved_samples >= LEXICAL_SAVE_EVERY:
+                try:
+                    self.save_lexical_model()
+                except Exception as e:
+                    logging.warning(f"Could not save the lexical emotion model: {e}")
+
+        answered_cheaply = from_cache + from_lexical
+        seconds_saved = 0.0
+        if answered_cheaply and self._transformer_seconds is not None:
+            seconds_saved = max(self._transformer_seconds * answered_cheaply - cheap_seconds, 0.0)
+        self._record({"cache": from_cache, "lexical": from_lexical, "transformer": len(remaining)}, seconds_saved)
+        return results
+
+    def get_stats(self) -> dict:
+        """
+        Returns how often each tier answered and the estimated transformer time saved.
+        """
+        with self._lock:
+            total = self.stats["cache"] + self.stats["lexical"] + self.stats["transformer"]
+            return {
+                **self.stats,
+                "total": total,
+                "cheap_tier_rate": (self.stats["cache"] + self.stats["lexical"]) / total if total else 0.0,
+                "lexical_samples": self.lexical_samples,
+                "lexical_enabled": self.lexical_enabled,
+                "lexical_agreement": sum(self._audits) / len(self._audits) if self._audits else None,
+                "transformer_seconds_per_text": self._transformer_seconds,
+            }
@@ -1,5 +1,11 @@
+import os
 import logging
-from emotion.emotion_detection.go_emotions import EmotionDetector
+from emotion.emotion_detection.go_emotions import create_emotion_detector
+from utils.micro_batcher import MicroBatcher
+
+## Micro-batching of the emotion model across concurrent turns
+EMOTION_BATCH_SIZE = int(os.environ.get("EMOTION_BATCH_SIZE", 16))
+EMOTION_BATCH_WAIT_MS = float(os.environ.get("EMOTION_BATCH_WAIT_MS", 5))
 
 class EmotionHandler:
     
@@ -11,8 +17,15 @@ class EmotionHandler:
             emotion_detector: An instance of the emotion detection model.
             emotion_prompts (dict): A dictionary mapping emotions to specific prompts.
         """
-        self.emotion_detector = EmotionDetector()
+        # Torch or ONNX Runtime backend, selected with EMOTION_BACKEND
+        self.emotion_detector = create_emotion_detector()
         self.emotion_prompts = emotion_prompts
+        # Concurrent async requests share one forward pass in the emotion pool
+        self.batcher = MicroBatcher(self.emotion_detector.detect_emotion_batch,
+                                    max_batch_size=EMOTION_BATCH_SIZE,
+                                    max_wait_ms=EMOTION_BATCH_WAIT_MS,
+                                    pool="emotion",
+                                    name="emotion")
 
     def detect_emotion_tag(self, user_input: str) -> str:
         """
@@ -38,6 +51,17 @@ class EmotionHandler:
             logging.error(f"Error detecting emotion: {e}")
             return "neutral"
 
+    async def adetect_emotion_tag(self, user_input: str) -> str:
+        """
+        Async version of `detect_emotion_tag`, batched with the other concurrent requests.
+        """
+        try:
+            emotion_data = await self.batcher.submit(user_input)
+            return emotion_data["primary_emotion"]
+        except Exception as e:
+            logging.error(f"Error detecting emotion: {e}")
+            return "neutral"
+
     def generate_emotion_prompt(self, user_input: str) -> str:
         """
         Generate an additional prompt based on the detected emotion.
@@ -57,5 +81,15 @@ class EmotionHandler:
             logging.error(f"Error generating emotion prompt: {e}")
             return ""
 
+    async def agenerate_emotion_prompt(self, user_input: str) -> tuple:
+        """
+        Async version of `generate_emotion_prompt`, the emotion model runs micro-batched in the emotion pool.
 
+        Args:
+            user_input (str): The input text from the user.
 
+        Returns:
+            tuple[str, str]: The detected emotion and the corresponding emotion-specific prompt.
+        """
+        detected_emotion = await self.adetect_emotion_tag(user_input)
+        return detected_emotion, self.emotion_prompts.get(detected_emotion, "")
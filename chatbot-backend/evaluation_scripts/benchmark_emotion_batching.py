@@ -0,0 +1,82 @@
+"""
+Emotion detection throughput benchmark: one forward pass per request vs micro-batching.
+
+Concurrent callers classify the user inputs of conversation_logs_sample.csv, either each with its own
+`detect_emotion` call in the emotion pool (the previous behaviour) or through the MicroBatcher of
+EmotionHandler. Reports the throughput and the per-request latency at each concurrency level.
+
+Run from the chatbot-backend directory:
+    python -m evaluation_scripts.benchmark_emotion_batching --requests 256 --concurrency 1 8 32
+"""
+import os
+import time
+import asyncio
+import argparse
+import numpy as np
+import pandas as pd
+from emotion.emotion_detection.go_emotions import EmotionDetector
+from utils.executors import run_in_pool
+from utils.micro_batcher import MicroBatcher
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_logs_sample.csv")
+
+############################################################################################################
+
+async def run_callers(classify, texts, concurrency):
+    """
+    Runs `concurrency` callers that classify `texts` between them.
+
+    Returns:
+        tuple[float, list[float]]: The total wall-clock time and the latency of every request in seconds.
+    """
+    queue = asyncio.Queue()
+    for text in texts:
+        queue.put_nowait(text)
+    latencies = []
+
+    async def caller():
+        while not queue.empty():
+            text = queue.get_nowait()
+            start_time = time.perf_counter()
+            await classify(text)
+            latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    return time.perf_counter() - start_time, latencies
+
+
+def summarize(name, concurrency, total_time, latencies):
+    values = np.array(latencies) * 1000
+    print(f"{name:<10} callers={concurrency:>3}  throughput={len(values) / total_time:8.1f} req/s  "
+          f"p50={np.percentile(values, 50):8.1f} ms  p95={np.percentile(values, 95):8.1f} ms")
+
+
+async def main(requests: int, concurrency_levels, max_batch_size: int, max_wait_ms: float):
+    user_inputs = pd.read_csv(SAMPLE_PATH)["user_input"].tolist()
+    texts = [user_inputs[i % len(user_inputs)] for i in range(requests)]
+    detector = EmotionDetector()
+    batcher = MicroBatcher(detector.detect_emotion_batch, max_batch_size=max_batch_size,
+                           max_wait_ms=max_wait_ms, pool="emotion", name="benchmark")
+
+    async def unbatched(text):
+        return await run_in_pool("emotion", detector.detect_emotion, text)
+
+    # Warm up the model and the pool outside of the measurement
+    await run_callers(unbatched, texts[:8], 2)
+    await run_callers(batcher.submit, texts[:8], 2)
+
+    for concurrency in concurrency_levels:
+        for name, classify in (("unbatched", unbatched), ("batched", batcher.submit)):
+            total_time, latencies = await run_callers(classify, texts, concurrency)
+            summarize(name, concurrency, total_time, latencies)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare emotion detection with and without micro-batching.")
+    parser.add_argument("--requests", type=int, default=256, help="Number of texts classified per run.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Numbers of concurrent callers.")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="Maximum micro-batch size.")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="Maximum wait for a micro-batch to fill.")
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.max_batch_size, args.max_wait_ms))
@@ -0,0 +1,95 @@
+"""
+Emotion backend comparison: PyTorch fp32 vs ONNX Runtime int8.
+
+Classifies the user inputs of conversation_logs_sample.csv with both backends and reports
+- agreement: how often the primary emotion matches, the overlap of the top-3 emotions and the
+  mean absolute difference of the scores,
+- latency of single texts and of batches, on the current CPU.
+
+Run from the chatbot-backend directory (exports the ONNX model on the first run):
+    python -m evaluation_scripts.benchmark_emotion_onnx --repeats 3 --batch-size 16
+"""
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from emotion.emotion_detection.go_emotions import create_emotion_detector
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_logs_sample.csv")
+
+############################################################################################################
+
+def check_agreement(torch_detector, onnx_detector, texts, batch_size):
+    """
+    Prints how closely the ONNX results match the torch results.
+    """
+    torch_results, onnx_results = [], []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        torch_results.extend(torch_detector.detect_emotion_batch(batch))
+        onnx_results.extend(onnx_detector.detect_emotion_batch(batch))
+
+    top1 = np.mean([t["primary_emotion"] == o["primary_emotion"] for t, o in zip(torch_results, onnx_results)])
+    top3, score_diffs = [], []
+    for t, o in zip(torch_results, onnx_results):
+        top3_torch = set(sorted(t["emotion_scores"], key=t["emotion_scores"].get, reverse=True)[:3])
+        top3_onnx = set(sorted(o["emotion_scores"], key=o["emotion_scores"].get, reverse=True)[:3])
+        top3.append(len(top3_torch & top3_onnx) / 3)
+        score_diffs.extend(abs(t["emotion_scores"][e] - o["emotion_scores"][e]) for e in t["emotion_scores"])
+
+    print(f"texts={len(texts)}  primary emotion agreement={top1 * 100:.1f}%  "
+          f"top-3 overlap={np.mean(top3) * 100:.1f}%  mean |score diff|={np.mean(score_diffs):.4f}  "
+          f"max |score diff|={np.max(score_diffs):.4f}")
+    return top1
+
+
+def measure_latency(detector, texts, batch_size, repeats):
+    """
+    Returns the latencies in seconds of single-text calls and of batched calls.
+    """
+    single, batched = [], []
+    for _ in range(repeats):
+        for text in texts:
+            start_time = time.perf_counter()
+            detector.detect_emotion(text)
+            single.append(time.perf_counter() - start_time)
+        for start in range(0, len(texts), batch_size):
+            start_time = time.perf_counter()
+            detector.detect_emotion_batch(texts[start:start + batch_size])
+            batched.append(time.perf_counter() - start_time)
+    return single, batched
+
+
+def summarize(name, values):
+    values = np.array(values) * 1000
+    print(f"{name:<22} mean={values.mean():8.2f} ms  p50={np.percentile(values, 50):8.2f} ms  "
+          f"p95={np.percentile(values, 95):8.2f} ms")
+
+
+def main(repeats: int, batch_size: int, min_agreement: float):
+    texts = pd.read_csv(SAMPLE_PATH)["user_input"].tolist()
+    torch_detector = create_emotion_detector("torch", tiered=False)
+    onnx_detector = create_emotion_detector("onnx", tiered=False)
+    print(f"ONNX model: {onnx_detector.model_path} ({os.path.getsize(onnx_detector.model_path) / 2**20:.1f} MiB)")
+
+    agreement = check_agreement(torch_detector, onnx_detector, texts, batch_size)
+
+    for name, detector in (("torch", torch_detector), ("onnx-int8", onnx_detector)):
+        # Warm up outside of the measurement
+        detector.detect_emotion_batch(texts[:batch_size])
+        single, batched = measure_latency(detector, texts, batch_size, repeats)
+        summarize(f"{name} single", single)
+        summarize(f"{name} batch={batch_size}", batched)
+
+    if agreement < min_agreement:
+        raise SystemExit(f"Primary emotion agreement {agreement * 100:.1f}% is below {min_agreement * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the torch and the ONNX int8 emotion backends.")
+    parser.add_argument("--repeats", type=int, default=3, help="Number of passes over the sample inputs.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Batch size of the batched measurement.")
+    parser.add_argument("--min-agreement", type=float, default=0.9, help="Fail below this primary emotion agreement.")
+    args = parser.parse_args()
+    main(args.repeats, args.batch_size, args.min_agreement)
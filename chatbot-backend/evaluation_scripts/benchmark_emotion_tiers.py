@@ -0,0 +1,92 @@
+"""
+Tiered emotion detection benchmark: how often each tier answers and how much transformer time it saves.
+
+The lexical tier first learns from the transformer on the training split of the sample user inputs
+(plus short everyday phrases), then a held-out stream of turns, mixing the remaining inputs with short
+phrases as users type them, is classified by the tiered detector and by the transformer alone.
+Reports the tier shares, the total detection time of both and how often the tiered answer matches
+the transformer's.
+
+Run from the chatbot-backend directory:
+    python -m evaluation_scripts.benchmark_emotion_tiers --turns 500
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from emotion.emotion_detection.go_emotions import create_emotion_detector
+from emotion.emotion_detection.tiered_detector import TieredEmotionDetector
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_logs_sample.csv")
+
+SHORT_TURNS = [
+    "ok", "okay", "Ok.", "thank you", "Thank you!", "thanks", "thanks a lot", "good morning", "Good morning!",
+    "good night", "yes", "no", "sure", "I see", "hello", "hi", "bye", "see you tomorrow", "that's nice",
+    "I'm fine", "not bad", "great", "I love it", "that's sad", "I'm tired", "I miss her", "wow",
+]
+
+############################################################################################################
+
+def make_turns(texts, turns, short_share, rng):
+    """
+    Builds a stream of turns where `short_share` of them are short everyday phrases.
+    """
+    return [rng.choice(SHORT_TURNS) if rng.random() < short_share else rng.choice(texts) for _ in range(turns)]
+
+
+def main(turns: int, short_share: float, train_share: float, min_samples: int, seed: int):
+    rng = random.Random(seed)
+    texts = pd.read_csv(SAMPLE_PATH)["user_input"].tolist()
+    rng.shuffle(texts)
+    split = int(len(texts) * train_share)
+    train_texts, test_texts = texts[:split], texts[split:] or texts
+
+    transformer = create_emotion_detector(tiered=False)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tiered = TieredEmotionDetector(transformer, model_path=os.path.join(tmp_dir, "lexical.joblib"),
+                                        min_samples=min_samples)
+
+        # Training phase: the transformer labels the texts the lexical tier learns from
+        for text in train_texts + SHORT_TURNS:
+            tiered.detect_emotion(text)
+        print(f"lexical model trained on {tiered.lexical_samples} samples")
+
+        stream = make_turns(test_texts, turns, short_share, rng)
+        # Measure the transformer alone first so it is warm for both runs
+        transformer_results, transformer_time = [], 0.0
+        for text in stream:
+            start_time = time.perf_counter()
+            transformer_results.append(transformer.detect_emotion(text))
+            transformer_time += time.perf_counter() - start_time
+
+        before = tiered.get_stats()
+        tiered_results, tiered_time = [], 0.0
+        for text in stream:
+            start_time = time.perf_counter()
+            tiered_results.append(tiered.detect_emotion(text))
+            tiered_time += time.perf_counter() - start_time
+        after = tiered.get_stats()
+
+    answered = {tier: after[tier] - before[tier] for tier in ("cache", "lexical", "transformer")}
+    agreement = np.mean([t["primary_emotion"] == r["primary_emotion"] for t, r in zip(transformer_results, tiered_results)])
+    for tier, count in answered.items():
+        print(f"{tier:<12} answered {count:>5} turns ({count / len(stream) * 100:5.1f}%)")
+    print(f"transformer only: {transformer_time * 1000:9.1f} ms total, {transformer_time / len(stream) * 1000:6.2f} ms/turn")
+    print(f"tiered:           {tiered_time * 1000:9.1f} ms total, {tiered_time / len(stream) * 1000:6.2f} ms/turn")
+    print(f"time saved: {(transformer_time - tiered_time) * 1000:.1f} ms ({(1 - tiered_time / transformer_time) * 100:.1f}%), "
+          f"estimated by the detector: {(after['seconds_saved'] - before['seconds_saved']) * 1000:.1f} ms")
+    print(f"primary emotion agreement with the transformer: {agreement * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the tier shares and the time saved by tiered emotion detection.")
+    parser.add_argument("--turns", type=int, default=500, help="Number of turns in the measured stream.")
+    parser.add_argument("--short-share", type=float, default=0.5, help="Share of short everyday phrases in the stream.")
+    parser.add_argument("--train-share", type=float, default=0.7, help="Share of the sample inputs used for training.")
+    parser.add_argument("--min-samples", type=int, default=40, help="Training samples before the lexical tier may answer.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args.turns, args.short_share, args.train_share, args.min_samples, args.seed)
@@ -0,0 +1,90 @@
+"""
+Local vector store benchmark: search latency and recall of the exact and IVF search at 10k-1M memories per user.
+
+Fills one namespace with synthetic clustered unit vectors (the shape of sentence embeddings: many memories
+close to a few topics), spread over sessions, then queries it like MemoryManager does (top-k with the
+`session_id` filter) with perturbed copies of stored vectors. The exact search is the ground truth of the
+IVF recall@k. Vectors are written in a temporary directory, 1M vectors of dimension 1024 take 2 GB.
+
+Run from the chatbot-backend directory:
+    python -m evaluation_scripts.benchmark_local_vector_store --sizes 10000 100000 1000000
+"""
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from memory.local_vector_store import LocalVectorStore
+
+INSERT_BATCH = 10_000
+
+############################################################################################################
+
+def fill(store: LocalVectorStore, size: int, dim: int, sessions: int, topics: int, rng) -> np.ndarray:
+    """
+    Adds `size` clustered vectors to the "bench" namespace and returns their topic centers.
+    """
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    for start in range(0, size, INSERT_BATCH):
+        count = min(INSERT_BATCH, size - start)
+        vectors = centers[rng.integers(topics, size=count)] + 0.8 * rng.standard_normal((count, dim)).astype(np.float32)
+        store.add_embeddings(vectors, [f"memory {start + i}" for i in range(count)],
+                             [{"session_id": f"s{(start + i) % sessions}"} for i in range(count)],
+                             namespace="bench")
+    return centers
+
+
+def timed_search(store: LocalVectorStore, queries, k: int, sessions: list):
+    results, latencies = [], []
+    for query, session in zip(queries, sessions):
+        start_time = time.perf_counter()
+        hits = store.similarity_search_by_vector_with_score(query, k=k, filter={"session_id": session}, namespace="bench")
+        latencies.append((time.perf_counter() - start_time) * 1000)
+        results.append({doc.id for doc, _ in hits})
+    return results, np.array(latencies)
+
+
+def main(sizes, dim: int, queries: int, k: int, sessions: int, topics: int, nprobes, seed: int):
+    rows = []
+    for size in sizes:
+        rng = np.random.default_rng(seed)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            exact = LocalVectorStore(tmp_dir, embedding=None, dim=dim, search_mode="exact")
+            start_time = time.perf_counter()
+            fill(exact, size, dim, sessions, topics, rng)
+            print(f"{size} vectors inserted in {time.perf_counter() - start_time:.1f}s")
+
+            targets = np.asarray(exact._namespace("bench").matrix()[rng.integers(size, size=queries)], dtype=np.float32)
+            query_vectors = targets + 0.05 * rng.standard_normal(targets.shape).astype(np.float32)
+            query_sessions = [f"s{i}" for i in rng.integers(sessions, size=queries)]
+
+            truth, latencies = timed_search(exact, query_vectors, k, query_sessions)
+            rows.append({"size": size, "search": "exact", "recall": 1.0,
+                         "p50_ms": np.percentile(latencies, 50), "p95_ms": np.percentile(latencies, 95)})
+
+            ivf = LocalVectorStore(tmp_dir, embedding=None, dim=dim, search_mode="ivf")
+            start_time = time.perf_counter()
+            ivf._namespace("bench").build_ivf()
+            print(f"IVF index of {len(ivf._namespace('bench').ivf.centroids)} lists built in {time.perf_counter() - start_time:.1f}s")
+            for nprobe in nprobes:
+                ivf.nprobe = nprobe
+                found, latencies = timed_search(ivf, query_vectors, k, query_sessions)
+                recall = np.mean([len(f & t) / max(len(t), 1) for f, t in zip(found, truth)])
+                rows.append({"size": size, "search": f"ivf nprobe={nprobe}", "recall": recall,
+                             "p50_ms": np.percentile(latencies, 50), "p95_ms": np.percentile(latencies, 95)})
+
+    print(pd.DataFrame(rows).to_string(index=False, float_format=lambda value: f"{value:.3f}"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the recall and latency of the local vector store.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="Memories per user.")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension.")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries per size.")
+    parser.add_argument("--k", type=int, default=3, help="Results per query (MemoryManager max_results).")
+    parser.add_argument("--sessions", type=int, default=20, help="Number of sessions the memories are spread over.")
+    parser.add_argument("--topics", type=int, default=256, help="Number of vector clusters.")
+    parser.add_argument("--nprobes", type=int, nargs="+", default=[4, 16, 64], help="IVF lists searched per query.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args.sizes, args.dim, args.queries, args.k, args.sessions, args.topics, args.nprobes, args.seed)
@@ -0,0 +1,121 @@
+"""
+Prompt layout benchmark: time to first token of the legacy and the prefix_cache prompt layouts.
+
+Replays the conversations of conversation_logs_sample.csv directly against the local Ollama model.
+Each turn sends the conversation so far, a different set of recall memories and an emotion guidance,
+formatted with each PromptManager layout, and measures the time to first token and Ollama's prompt
+evaluation (prefill) time. With the prefix_cache layout the system prompt and the history stay a
+byte-identical prefix, so Ollama only has to prefill the tokens of the new turn.
+
+Run from the chatbot-backend directory (requires Ollama, and Supabase or the prompt cache):
+    python -m evaluation_scripts.benchmark_prompt_layout --turns 30
+"""
+import os
+import time
+import random
+import asyncio
+import argparse
+import numpy as np
+import pandas as pd
+from langchain_core.messages import AIMessage, HumanMessage
+from model.model_utils import load_json_config
+from model.prompt_manager import PromptManager, PROMPT_LAYOUTS
+from companion.digital_companion import DigitalCompanion
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_logs_sample.csv")
+
+############################################################################################################
+
+def build_turns(logs: pd.DataFrame, turns: int, stm_limit: int, seed: int = 0):
+    """
+    Builds the per-turn prompt inputs from the sample conversations.
+
+    Args:
+        logs (pd.DataFrame): The sample conversation logs.
+        turns (int): Number of turns to build.
+        stm_limit (int): Number of messages kept in the short-term memory.
+        seed (int): Seed for the sampled memories.
+
+    Returns:
+        list[dict]: Inputs of every turn (messages, recall_memories, detected_emotion, emotion_prompt).
+    """
+    rng = random.Random(seed)
+    all_inputs = logs["user_input"].tolist()
+    emotions = ["neutral", "sadness", "joy", "fear", "anger"]
+    inputs = []
+    for _, conversation in logs.sort_values(["conv_id", "turn_id"]).groupby("conv_id"):
+        history = []
+        for row in conversation.itertuples():
+            history.append(HumanMessage(content=row.user_input))
+            inputs.append({
+                "messages": history[-stm_limit:],
+                "recall_memories": "\n".join(rng.sample(all_inputs, k=min(3, len(all_inputs)))),
+                "detected_emotion": rng.choice(emotions),
+                "emotion_prompt": "Respond with warmth and acknowledge how the user feels.",
+            })
+            history.append(AIMessage(content=row.default_bot_response))
+            if len(inputs) == turns:
+                return inputs
+    return inputs
+
+
+async def measure_layout(model, prompt_manager, turn_inputs):
+    """
+    Streams a response for every turn and returns the time to first token and the prefill time.
+
+    Returns:
+        tuple[list[float], list[float]]: Time to first token and prompt evaluation time in seconds per turn.
+    """
+    chain = prompt_manager.prompt_template | model
+    ttfts, prefills = [], []
+    for inputs in turn_inputs:
+        start_time = time.perf_counter()
+        first_token_time = None
+        gathered = None
+        async for chunk in chain.astream(inputs):
+            if first_token_time is None and chunk.content:
+                first_token_time = time.perf_counter() - start_time
+            gathered = chunk if gathered is None else gathered + chunk
+        if first_token_time is not None:
+            ttfts.append(first_token_time)
+        prompt_eval_duration = (gathered.response_metadata or {}).get("prompt_eval_duration") if gathered else None
+        if prompt_eval_duration:
+            prefills.append(prompt_eval_duration / 1e9)
+    return ttfts, prefills
+
+
+def summarize(name, values):
+    if not values:
+        print(f"{name:<26} no samples")
+        return
+    values = np.array(values) * 1000
+    print(f"{name:<26} turns={len(values):>3}  mean={values.mean():8.1f} ms  "
+          f"p50={np.percentile(values, 50):8.1f} ms  p95={np.percentile(values, 95):8.1f} ms")
+
+
+async def main(turns: int, stm_limit: int):
+    config = load_json_config(DigitalCompanion.config_path)
+    model = DigitalCompanion.get_model(config)
+    system_prompt, _ = DigitalCompanion.get_prompt_data()
+    turn_inputs = build_turns(pd.read_csv(SAMPLE_PATH), turns, stm_limit)
+
+    results = {}
+    for layout in PROMPT_LAYOUTS:
+        prompt_manager = PromptManager(system_prompt=system_prompt, layout=layout)
+        # Load the model and fill the cache with a different conversation outside of the measurement
+        await measure_layout(model, prompt_manager, [dict(turn_inputs[0], messages=[HumanMessage(content="Hello!")])])
+        results[layout] = await measure_layout(model, prompt_manager, turn_inputs)
+
+    for layout, (ttfts, prefills) in results.items():
+        summarize(f"{layout} ttft", ttfts)
+        summarize(f"{layout} prefill", prefills)
+    before, after = np.mean(results["legacy"][0]), np.mean(results["prefix_cache"][0])
+    print(f"mean TTFT change: {(after - before) * 1000:+.1f} ms ({(after / before - 1) * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the time to first token of the prompt layouts.")
+    parser.add_argument("--turns", type=int, default=30, help="Number of turns to replay.")
+    parser.add_argument("--stm-limit", type=int, default=7, help="Number of messages kept in the short-term memory.")
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.stm_limit))
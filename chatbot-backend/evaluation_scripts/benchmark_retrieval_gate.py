@@ -0,0 +1,59 @@
+"""
+Retrieval gate benchmark: how many long-term memory lookups the gate skips and the time it saves.
+
+Replays the sample conversations as new users, mixed with short everyday turns as users type them.
+A session has no memories until its short-term memory overflows (stm_limit messages), after which every
+exchange adds one, as MemoryManager does. Every turn is decided by the RetrievalGate and the skipped
+lookups are valued at the measured (or given) retrieval latency.
+
+Run from the chatbot-backend directory:
+    python -m evaluation_scripts.benchmark_retrieval_gate --retrieval-ms 180
+"""
+import os
+import random
+import argparse
+import pandas as pd
+from memory.retrieval_gate import RetrievalGate
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_logs_sample.csv")
+
+SHORT_TURNS = ["ok", "thanks", "thank you", "hi", "hello", "yes", "no", "good morning", "hmm", "I see", "bye"]
+
+############################################################################################################
+
+def main(short_share: float, stm_limit: int, retrieval_ms: float, seed: int):
+    rng = random.Random(seed)
+    samples = pd.read_csv(SAMPLE_PATH).sort_values(["conv_id", "turn_id"])
+    gate = RetrievalGate()
+    gate.observe_latency(retrieval_ms / 1000)
+
+    for conv_id, conversation in samples.groupby("conv_id"):
+        key = ("benchmark", str(conv_id))
+        # A new user: the probe finds no stored memories
+        gate.set_count(key, 0)
+        messages = 0
+        for user_input in conversation["user_input"]:
+            turns = [rng.choice(SHORT_TURNS)] if rng.random() < short_share else []
+            for text in turns + [user_input]:
+                gate.decide(key, text)
+                messages += 2
+                if messages > stm_limit:
+                    # The oldest exchange moves to long-term memory
+                    gate.add(key)
+
+    stats = gate.get_stats()
+    decided = stats["retrieve"] + stats["no_memories"] + stats["trivial_input"]
+    for decision in ("retrieve", "no_memories", "trivial_input"):
+        print(f"{decision:<14} {stats[decision]:>5} turns ({stats[decision] / decided * 100:5.1f}%)")
+    print(f"skip rate: {stats['skip_rate'] * 100:.1f}%, retrieval time saved: {stats['seconds_saved'] * 1000:.0f} ms "
+          f"over {decided} turns ({stats['seconds_saved'] / decided * 1000:.1f} ms/turn at {retrieval_ms:.0f} ms per lookup)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the skip rate of the long-term memory retrieval gate.")
+    parser.add_argument("--short-share", type=float, default=0.3, help="Share of turns preceded by a short everyday turn.")
+    parser.add_argument("--stm-limit", type=int, default=7, help="Messages kept in short-term memory.")
+    parser.add_argument("--retrieval-ms", type=float, default=150, help="Latency of a lookup (embedding and query).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+    main(args.short_share, args.stm_limit, args.retrieval_ms, args.seed)
@@ -0,0 +1,76 @@
+"""
+Time-to-first-token benchmark for DigitalCompanion.
+
+Replays the user inputs of conversation_logs_sample.csv against two companions, one with the
+pre-generation stages run sequentially and one with them run concurrently, and reports the
+time to first token of each turn.
+
+Run from the chatbot-backend directory (requires Ollama, Pinecone and Supabase):
+    python -m evaluation_scripts.benchmark_ttft --turns 20
+"""
+import os
+import time
+import uuid
+import asyncio
+import argparse
+import numpy as np
+import pandas as pd
+from companion.digital_companion import DigitalCompanion
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_logs_sample.csv")
+
+############################################################################################################
+
+async def measure_ttft(companion, user_inputs):
+    """
+    Streams a response for every input and returns the time to first token of each turn.
+
+    Args:
+        companion (DigitalCompanion): The companion to benchmark.
+        user_inputs (list[str]): The user inputs to replay in order.
+
+    Returns:
+        list[float]: Time to first token in seconds per turn.
+    """
+    ttfts = []
+    for user_input in user_inputs:
+        start_time = time.perf_counter()
+        first_token_time = None
+        async for _ in companion.stream_workflow_response(user_input):
+            if first_token_time is None:
+                first_token_time = time.perf_counter() - start_time
+        if first_token_time is not None:
+            ttfts.append(first_token_time)
+        # Let the write-behind work finish so it does not overlap with the next measurement
+        await companion.wait_for_background_tasks()
+    return ttfts
+
+
+def summarize(name, ttfts):
+    values = np.array(ttfts) * 1000
+    print(f"{name:<12} turns={len(values):>3}  mean={values.mean():8.1f} ms  "
+          f"p50={np.percentile(values, 50):8.1f} ms  p95={np.percentile(values, 95):8.1f} ms")
+
+
+async def main(turns: int):
+    user_inputs = pd.read_csv(SAMPLE_PATH)["user_input"].tolist()[:turns]
+    results = {}
+    for name, concurrent_stages in (("sequential", False), ("concurrent", True)):
+        user_id = f"bench-ttft-{uuid.uuid4().hex[:8]}"
+        companion = DigitalCompanion(user_id=user_id, thread_id=user_id, concurrent_stages=concurrent_stages)
+        # Warm up the model and the emotion detector outside of the measurement
+        await measure_ttft(companion, ["Hello!"])
+        results[name] = await measure_ttft(companion, user_inputs)
+        await companion.clear_all_memories()
+
+    for name, ttfts in results.items():
+        summarize(name, ttfts)
+    before, after = np.mean(results["sequential"]), np.mean(results["concurrent"])
+    print(f"mean TTFT change: {(after - before) * 1000:+.1f} ms ({(after / before - 1) * 100:+.1f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure time to first token before/after concurrent stages.")
+    parser.add_argument("--turns", type=int, default=20, help="Number of user inputs to replay.")
+    args = parser.parse_args()
+    asyncio.run(main(args.turns))
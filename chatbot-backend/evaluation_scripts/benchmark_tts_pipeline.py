@@ -0,0 +1,95 @@
+"""
+Time-to-first-audio benchmark for the voice endpoint.
+
+Replays the user inputs of conversation_logs_sample.csv through the two TTS pipelines of
+audio.tts_utils and reports the time from the start of generation to the first audio chunk:
+- "full": the whole reply is generated, then split into sentences and synthesized.
+- "sentence": every sentence is synthesized as soon as it is generated.
+Speech-to-text is left out, it is the same for both.
+
+Run from the chatbot-backend directory (requires Ollama, Pinecone, Supabase and the Kokoro venv):
+    python -m evaluation_scripts.benchmark_tts_pipeline --turns 10
+"""
+import os
+import time
+import uuid
+import asyncio
+import argparse
+import numpy as np
+import pandas as pd
+from nltk.tokenize import sent_tokenize
+from companion.digital_companion import DigitalCompanion
+from audio.tts_utils import get_tts_worker, shutdown_tts_worker, preprocess_text, reply_sentences, stream_audio_chunks
+from utils.cancellation import CancellationToken
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversation_logs_sample.csv")
+
+############################################################################################################
+
+async def full_reply_sentences(companion, user_input, cancel_token):
+    response_text = ""
+    async for chunk in companion.stream_workflow_response(user_input, cancel_token=cancel_token):
+        response_text += chunk
+    return sent_tokenize(preprocess_text(response_text))
+
+
+async def measure_ttfa(companion, user_inputs, pipeline):
+    """
+    Streams the reply audio of every input and returns the time to first audio of each turn.
+
+    Args:
+        companion (DigitalCompanion): The companion generating the replies.
+        user_inputs (list[str]): The user inputs to replay in order.
+        pipeline (str): "full" or "sentence".
+
+    Returns:
+        list[float]: Time to first audio chunk in seconds per turn.
+    """
+    ttfas = []
+    for user_input in user_inputs:
+        cancel_token = CancellationToken()
+        start_time = time.perf_counter()
+        if pipeline == "full":
+            sentences = await full_reply_sentences(companion, user_input, cancel_token)
+        else:
+            sentences = reply_sentences(companion, user_input, cancel_token)
+        first_audio_time = None
+        async for _ in stream_audio_chunks(sentences, cancel_token):
+            if first_audio_time is None:
+                first_audio_time = time.perf_counter() - start_time
+        if first_audio_time is not None:
+            ttfas.append(first_audio_time)
+        await companion.wait_for_background_tasks()
+    return ttfas
+
+
+def summarize(name, ttfas):
+    values = np.array(ttfas) * 1000
+    print(f"{name:<10} turns={len(values):>3}  mean={values.mean():8.1f} ms  "
+          f"p50={np.percentile(values, 50):8.1f} ms  p95={np.percentile(values, 95):8.1f} ms")
+
+
+async def main(turns: int):
+    user_inputs = pd.read_csv(SAMPLE_PATH)["user_input"].tolist()[:turns]
+    await get_tts_worker().ensure_worker_ready()
+    results = {}
+    for pipeline in ("full", "sentence"):
+        user_id = f"bench-tts-{uuid.uuid4().hex[:8]}"
+        companion = DigitalCompanion(user_id=user_id, thread_id=user_id)
+        # Warm up the model, the emotion detector and the TTS outside of the measurement
+        await measure_ttfa(companion, ["Hello!"], pipeline)
+        results[pipeline] = await measure_ttfa(companion, user_inputs, pipeline)
+        await companion.clear_all_memories()
+
+    for pipeline, ttfas in results.items():
+        summarize(pipeline, ttfas)
+    before, after = np.mean(results["full"]), np.mean(results["sentence"])
+    print(f"mean time-to-first-audio change: {(after - before) * 1000:+.1f} ms ({(after / before - 1) * 100:+.1f}%)")
+    await shutdown_tts_worker()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure time to first audio of the full and sentence TTS pipelines.")
+    parser.add_argument("--turns", type=int, default=10, help="Number of user inputs to replay.")
+    args = parser.parse_args()
+    asyncio.run(main(args.turns))
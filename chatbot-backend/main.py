@@ -1,16 +1,29 @@
+from utils.readiness import readiness
 from fastapi import FastAPI, Request, BackgroundTasks, UploadFile,Depends ,HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 import json
 from companion.digital_companion import DigitalCompanion
+from companion.session_registry import SessionRegistry
 from audio.tts_utils import (
     cancel_stream,
     conversation_audio_stream_kokoro,
-    tts_worker,
+    ensure_nltk_data,
+    get_tts_worker,
+    seed_tts_cache,
+    shutdown_tts_worker,
+    tts_cache,
 )
 import subprocess
+import asyncio
 from fastapi.responses import FileResponse
 from audio import stt_utils
+from utils.executors import run_in_pool, shutdown_executors
+from utils import metrics as metrics_labels
+from utils.metrics import Gauge, render_metrics
+from utils.cancellation import CancellationToken, cancel_on_disconnect, cancellations
+from memory.memory_manager import MemoryManager
+from model.model_utils import load_json_config
 
 
 
@@ -65,20 +78,77 @@ app.add_middleware(
 # ----------------------------------------------------------------
 # DigitalCompanion regard to user_id
 
-chat_instances = {}
+chat_instances = SessionRegistry.from_env(
+    factory=lambda user_id: DigitalCompanion(user_id=user_id, thread_id=user_id)
+)
 
 
-def get_chatbot_instance(user_id: str) -> DigitalCompanion:
+async def get_chatbot_instance(user_id: str) -> DigitalCompanion:
     """
-    Get the chatbot instance for the given user_id.
+    Get the chatbot instance for the given user_id, a new one is built in a thread (it may load models).
     """
-    if user_id not in chat_instances:
-       
-        chat_instances[user_id] = DigitalCompanion(
-            user_id=user_id,
-            thread_id=user_id
-        )
-    return chat_instances[user_id]
+    return await chat_instances.aget(user_id)
+
+
+Gauge("sage_sessions_active", "Number of live DigitalCompanion sessions.",
+      callback=lambda: len(chat_instances))
+Gauge("sage_session_registry_events", "Session registry hits, misses, evictions, spills and restores.",
+      labelnames=("event",), callback=lambda: {(event,): count for event, count in chat_instances.stats.items()})
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Expose per-stage latency histograms and service counters in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/sessions/stats")
+async def session_stats():
+    """
+    Report session registry counters (hits, misses, evictions) used to size the session cap.
+    """
+    return JSONResponse(content=chat_instances.get_stats())
+
+
+@app.get("/emotion/stats")
+async def emotion_stats():
+    """
+    Report how often each emotion detection tier answered and the estimated transformer time saved.
+    """
+    handler = DigitalCompanion._emotion_handler
+    if handler is None:
+        # Loading the emotion model here would block the event loop, the warm-up loads it
+        raise HTTPException(status_code=503, detail="Emotion detector not loaded yet.")
+    detector = handler.emotion_detector
+    if not hasattr(detector, "get_stats"):
+        return JSONResponse(content={"tiered": False})
+    return JSONResponse(content={"tiered": True, **detector.get_stats()})
+
+
+@app.get("/memory/stats")
+async def memory_stats():
+    """
+    Report how long-term memory queries were served: gate decisions, prefetch hit rate, retrieval outcomes and the hot memory tier.
+    """
+    guard = MemoryManager.retrieval_guard
+    tier = MemoryManager.hot_tier
+    return JSONResponse(content={
+        "retrieval": guard.get_stats() if guard is not None else None,
+        "hot_tier": tier.get_stats() if tier is not None else None,
+        "gate": MemoryManager.retrieval_gate.get_stats() if MemoryManager.retrieval_gate is not None else None,
+        "prefetch": MemoryManager.get_prefetch_stats(),
+    })
+
+
+@app.get("/tts/stats")
+async def tts_stats():
+    """
+    Report the state of every Kokoro TTS worker (running, queued sentences, failures and restarts) and the TTS cache hit rate.
+    """
+    return JSONResponse(content={"workers": get_tts_worker().get_stats(),
+                                 "cache": tts_cache.get_stats() if tts_cache is not None else None})
 
 
 
@@ -105,7 +175,9 @@ async def conversation(request: Request ,  user_id: str = Depends(get_current_us
     
 
     # Get chatbot instance for the user
-    companion = get_chatbot_instance(user_id)
+    companion = await get_chatbot_instance(user_id)
+    metrics_labels.bind(endpoint="/conversation", model=companion.model_name)
+    cancel_token = cancellations.create(user_id)
     
     async def response_stream():
         """
@@ -115,12 +187,21 @@ async def conversation(request: Request ,  user_id: str = Depends(get_current_us
         - Partial response tokens
         - Final empty token to signal stream completion
         """
-        async for token in companion.stream_workflow_response(user_input):
-            # Send partial response tokens
-            yield f"data: {json.dumps({'response': token, 'is_final': False})}\n\n"
-        
-        # Signal end of stream
-        yield f"data: {json.dumps({'response': '', 'is_final': True})}\n\n"
+        completed = False
+        try:
+            with chat_instances.lease(user_id):
+                async for token in companion.stream_workflow_response(user_input, cancel_token=cancel_token):
+                    # Send partial response tokens
+                    yield f"data: {json.dumps({'response': token, 'is_final': False})}\n\n"
+            
+            # Signal end of stream
+            yield f"data: {json.dumps({'response': '', 'is_final': True})}\n\n"
+            completed = True
+        finally:
+            # The stream is closed early when the client disconnects: stop the generation and background work
+            if not completed:
+                cancel_token.cancel("client disconnected")
+            cancellations.release(cancel_token)
     
     # Return streaming response with server-sent events
     return StreamingResponse(
@@ -130,68 +211,126 @@ async def conversation(request: Request ,  user_id: str = Depends(get_current_us
     )
 
 
+async def evict_idle_sessions():
+    """
+    Periodically evict idle sessions so memory is released even when no new requests arrive.
+    """
+    while True:
+        await asyncio.sleep(60)
+        chat_instances.evict_expired()
+
+
+async def warm_up_whisper():
+    await run_in_pool("stt", stt_utils.warm_up)
+
+
+async def warm_up_emotion():
+    handler = await asyncio.to_thread(DigitalCompanion.get_emotion_handler)
+    await handler.agenerate_emotion_prompt("Hello, how are you?")
+
+
+async def warm_up_vector_store():
+    await asyncio.to_thread(MemoryManager.get_vector_store,
+                            index_name="chatbot-memory",
+                            embedding_model="intfloat/multilingual-e5-large",
+                            embedding_dim=1024)
+
+
+async def warm_up_ollama():
+    # Load the model into Ollama with a short generation
+    model = DigitalCompanion.get_model(load_json_config(DigitalCompanion.config_path))
+    response = await model.ainvoke("Hello, how are you?")
+    print("Ollama warmed up, response: ", response.content)
+
+
+async def warm_up_tokenizer():
+    # Load the tokenizer used for the prompt size check (falls back to the model's counter if unavailable)
+    config = load_json_config(DigitalCompanion.config_path)
+    token_counter = DigitalCompanion.get_token_counter(config["model"], DigitalCompanion.get_model(config))
+    await asyncio.to_thread(token_counter.warm_up)
+
+
+async def warm_up_kokoro():
+    # Initialize the worker and generate a sample audio to confirm it works
+    # (served by the TTS cache after the first start, the workers answered a ping once their model was loaded)
+    await get_tts_worker().ensure_worker_ready()
+    from audio.tts_utils import stream_audio_chunks
+    startup_text = ["TTS worker is ready and operational."]
+    audio_chunks = [chunk async for chunk in stream_audio_chunks(startup_text, CancellationToken("warmup"))]
+    if not audio_chunks:
+        raise RuntimeError("Failed to generate startup audio.")
+    print(f"TTS worker is ready, generated {len(audio_chunks)} audio chunk(s)")
+
+
+readiness.register("nltk", lambda: asyncio.to_thread(ensure_nltk_data))
+readiness.register("prompts", lambda: asyncio.to_thread(DigitalCompanion.get_prompt_manager))
+readiness.register("checkpointer", lambda: asyncio.to_thread(DigitalCompanion.get_checkpointer))
+readiness.register("whisper", warm_up_whisper)
+readiness.register("emotion", warm_up_emotion)
+readiness.register("vector_store", warm_up_vector_store)
+readiness.register("ollama", warm_up_ollama)
+readiness.register("tokenizer", warm_up_tokenizer, required=False)
+readiness.register("kokoro", warm_up_kokoro)
+
+
+async def warm_up_tts_cache():
+    seeded = await seed_tts_cache()
+    print(f"TTS cache seeded with {seeded} new phrase(s)")
+
+
+readiness.register("tts_cache", warm_up_tts_cache, required=False)
+
+
 @app.on_event("startup")
 async def startup_event():
-    import nltk
-    nltk.download('punkt_tab')
-    #warm up whisper
-    try:
-        import numpy as np
-        dummy_audio = np.zeros(16000, dtype=np.float32)  # 1 second of silence
-        stt_utils.model.transcribe(dummy_audio, beam_size=1)
-        print("Whisper model loaded and warmed up successfully.")
-    except Exception as e:
-        print(f"Error warming up Whisper model: {e}")
-
-    #warm up ollama:
-    try:
-        # Collect the entire response to ensure full model initialization
-        temp_companion = DigitalCompanion(user_id="warmup", thread_id="warmup")
-        full_response = ""
-        async for chunk in temp_companion.stream_workflow_response("Hello, how are you?"):
-                full_response += chunk
-        print(f"Ollama warmed up with prompt: Hello, how are you")
-        print("Full repsonse: ", full_response)
-
-    except Exception as e:
-        print(f"Error warming up Ollama")
-
-    # Initialize the worker
-    await tts_worker.ensure_worker_ready()
-
-    # warm up Kokoro:
-    # Generate a sample audio to confirm TTS worker
-    try:
-        from audio.tts_utils import stream_audio_chunks, cancel_event
-        
-        # Prepare a startup confirmation text
-        startup_text = ["TTS worker is ready and operational."]
-        
-        # Use stream_audio_chunks to generate and verify audio
-        audio_chunks = []
-        async for chunk in stream_audio_chunks(startup_text, cancel_event):
-            audio_chunks.append(chunk)
-        
-        # Confirm audio chunks were generated
-        if audio_chunks and len(audio_chunks) > 0:
-            print("Successfully generated startup audio. TTS worker is ready.")
-            print(f"Generated {len(audio_chunks)} audio chunk(s)")
-        else:
-            print("Failed to generate startup audio.")
-    
-    except Exception as e:
-        print(f"Error during startup audio generation: {e}")
+    app.state.eviction_task = asyncio.create_task(evict_idle_sessions())
+    # Warm up every component in parallel in the background, /readyz reports the progress
+    app.state.warm_up_task = asyncio.create_task(readiness.warm_up_all())
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness probe: the process is up and serving requests. Reports each component's state.
+    """
+    return JSONResponse(content={"status": "ok", **readiness.snapshot()})
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness probe: returns 503 until every required component has been warmed up.
+    """
+    snapshot = readiness.snapshot()
+    return JSONResponse(content=snapshot, status_code=200 if snapshot["ready"] else 503)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    checkpointer = DigitalCompanion.get_checkpointer()
+    if hasattr(checkpointer, "close"):
+        checkpointer.close()
+    # Keep what the lexical emotion tier has learned for the next start
+    emotion_detector = getattr(DigitalCompanion._emotion_handler, "emotion_detector", None)
+    if hasattr(emotion_detector, "save_lexical_model"):
+        emotion_detector.save_lexical_model()
+    # Queued long-term memories must reach the vector store, or be spilled to disk for the next start
+    await MemoryManager.close_pending_writes(timeout=MemoryManager.LTM_FLUSH_TIMEOUT_S)
+    if tts_cache is not None:
+        await tts_cache.flush()
+    await shutdown_tts_worker()
+    shutdown_executors()
 
 
 @app.post("/cancel")
-async def handle_cancel_stream():
+async def handle_cancel_stream(user_id: str = Depends(get_current_user_id)):
     """
-    Endpoint to cancel ongoing audio processing.
+    Endpoint to cancel the ongoing requests of the current user.
     """
-    return await cancel_stream()
+    return await cancel_stream(user_id)
 
 @app.post("/conversation-audio-stream")
-async def handle_conversation_audio_stream(audio: UploadFile, background_tasks: BackgroundTasks,
+async def handle_conversation_audio_stream(request: Request, audio: UploadFile, background_tasks: BackgroundTasks,
     user_id: str = Depends(get_current_user_id)):
     """
     Stream audio conversation with real-time processing.
@@ -201,8 +340,22 @@ async def handle_conversation_audio_stream(audio: UploadFile, background_tasks:
     2. Generate streaming chatbot response
     3. Stream text-to-speech audio chunks
     """
-    companion = get_chatbot_instance(user_id)
-    return await conversation_audio_stream_kokoro(audio, background_tasks, companion)
+    companion = await get_chatbot_instance(user_id)
+    metrics_labels.bind(endpoint="/conversation-audio-stream", model=companion.model_name)
+    cancel_token = cancellations.create(user_id)
+    # Until the audio starts streaming, watch for the client going away
+    disconnect_watcher = asyncio.create_task(cancel_on_disconnect(request, cancel_token))
+    try:
+        with chat_instances.lease(user_id):
+            # With the sentence pipeline the reply is generated by the response body, which leases again
+            response = await conversation_audio_stream_kokoro(audio, background_tasks, companion, cancel_token,
+                                                              lease=lambda: chat_instances.lease(user_id))
+    finally:
+        disconnect_watcher.cancel()
+    if not isinstance(response, StreamingResponse):
+        # Nothing left to stream, the token is released by the audio stream otherwise
+        cancellations.release(cancel_token)
+    return response
 
 if __name__ == "__main__":
     # Run FastAPI application using Uvicorn ASGI server
@@ -0,0 +1,436 @@
+import os
+import zlib
+import atexit
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence, Tuple
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    copy_checkpoint,
+    get_checkpoint_id,
+)
+from langgraph.checkpoint.memory import MemorySaver
+from utils.executors import run_in_pool
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+# Payloads above this size are zlib-compressed; the stored type gets a "+z" suffix
+_COMPRESS_MIN_BYTES = 512
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver):
+    """
+    Durable LangGraph checkpointer backed by a local SQLite database in WAL mode.
+
+    - Checkpoints are serialized with the graph serializer and zlib-compressed.
+    - Writes are buffered and flushed in one transaction every `flush_interval` seconds
+      or as soon as `batch_size` operations are pending.
+    - The latest checkpoint of each thread is kept in a bounded read-through cache that is
+      validated against the database, so any worker sharing the file can serve any thread.
+    - Only the newest `keep_last` checkpoints per thread are retained on disk.
+    """
+
+    durable = True
+
+    def __init__(self,
+                 path: str,
+                 batch_size: int = 64,
+                 flush_interval: float = 0.05,
+                 cache_size: int = 1024,
+                 keep_last: int = 2,
+                 serde=None):
+        super().__init__(serde=serde)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.keep_last = keep_last
+
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+
+        # Pending operations: ("checkpoint", row) or ("write", row)
+        self._pending = []
+        self._pending_threads = {}
+        # (thread_id, checkpoint_ns) -> CheckpointTuple of the latest checkpoint
+        self._cache = OrderedDict()
+
+        self._flush_requested = threading.Event()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="checkpoint-flusher", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    ############################################################################################################
+    def _dumps(self, obj) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) >= _COMPRESS_MIN_BYTES:
+            return f"{type_}+z", zlib.compress(data, 6)
+        return type_, data
+
+    def _loads(self, type_: str, data: bytes):
+        if type_.endswith("+z"):
+            type_, data = type_[:-2], zlib.decompress(data)
+        return self.serde.loads_typed((type_, data))
+
+    @staticmethod
+    def _thread_key(config: RunnableConfig):
+        configurable = config["configurable"]
+        return configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+    ############################################################################################################
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        """
+        Returns the requested checkpoint, or the latest one of the thread when no id is given.
+        """
+        key = self._thread_key(config)
+        checkpoint_id = get_checkpoint_id(config)
+
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                cached_id = cached.config["configurable"]["checkpoint_id"]
+                if checkpoint_id == cached_id or (
+                        checkpoint_id is None and
+                        (key in self._pending_threads or self._latest_id(key) == cached_id)):
+                    self._cache.move_to_end(key)
+                    return self._copy(cached)
+
+            self._flush_locked()
+            result = next(self._select(key[0], key[1], checkpoint_id, limit=1), None)
+            if result is not None and checkpoint_id is None:
+                self._remember(key, self._copy(result))
+            return result
+
+    def list(self,
+             config: Optional[RunnableConfig],
+             *,
+             filter: Optional[dict] = None,
+             before: Optional[RunnableConfig] = None,
+             limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        """
+        Lists the stored checkpoints of a thread, newest first.
+        """
+        with self._lock:
+            self._flush_locked()
+            if config is None:
+                thread_ids = [row[0] for row in self._conn.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+                checkpoint_ns = None
+            else:
+                thread_ids = [config["configurable"]["thread_id"]]
+                checkpoint_ns = config["configurable"].get("checkpoint_ns")
+            before_id = get_checkpoint_id(before) if before else None
+            results = []
+            for thread_id in thread_ids:
+                for item in self._select(thread_id, checkpoint_ns, get_checkpoint_id(config) if config else None,
+                                         before_id=before_id):
+                    if filter and not all(item.metadata.get(k) == v for k, v in filter.items()):
+                        continue
+                    results.append(item)
+                    if limit is not None and len(results) >= limit:
+                        break
+                if limit is not None and len(results) >= limit:
+                    break
+        yield from results
+
+    def put(self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        """
+        Buffers a checkpoint for the next batched flush and makes it the cached latest state.
+        """
+        thread_id, checkpoint_ns = self._thread_key(config)
+        parent_id = config["configurable"].get("checkpoint_id")
+        checkpoint_type, checkpoint_blob = self._dumps(checkpoint)
+        metadata_type, metadata_blob = self._dumps(metadata)
+        saved_config = {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+        parent_config = ({"configurable": {"thread_id": thread_id,
+                                           "checkpoint_ns": checkpoint_ns,
+                                           "checkpoint_id": parent_id}}
+                         if parent_id else None)
+
+        with self._lock:
+            self._enqueue("checkpoint",
+                          (thread_id, checkpoint_ns, checkpoint["id"], parent_id,
+                           checkpoint_type, checkpoint_blob, metadata_type, metadata_blob))
+            self._remember((thread_id, checkpoint_ns),
+                           CheckpointTuple(config=saved_config,
+                                           checkpoint=copy_checkpoint(checkpoint),
+                                           metadata=metadata,
+                                           parent_config=parent_config,
+                                           pending_writes=[]))
+        return saved_config
+
+    def put_writes(self,
+                   config: RunnableConfig,
+                   writes: Sequence[Tuple[str, Any]],
+                   task_id: str,
+                   task_path: str = "") -> None:
+        """
+        Buffers intermediate writes linked to a checkpoint.
+        """
+        thread_id, checkpoint_ns = self._thread_key(config)
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            cached = self._cache.get((thread_id, checkpoint_ns))
+            for idx, (channel, value) in enumerate(writes):
+                value_type, value_blob = self._dumps(value)
+                self._enqueue("write",
+                              (thread_id, checkpoint_ns, checkpoint_id, task_id,
+                               WRITES_IDX_MAP.get(channel, idx), channel, value_type, value_blob, task_path))
+                if cached is not None and cached.config["configurable"]["checkpoint_id"] == checkpoint_id:
+                    cached.pending_writes.append((task_id, channel, value))
+
+    def delete_thread(self, thread_id: str) -> None:
+        """
+        Deletes every checkpoint and write stored for the thread.
+        """
+        with self._lock:
+            self._flush_locked()
+            self._conn.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            self._conn.execute("DELETE FROM writes WHERE thread_id = ?", (thread_id,))
+            for key in [key for key in self._cache if key[0] == thread_id]:
+                del self._cache[key]
+
+    ############################################################################################################
+    # The graph is driven through its async API. The sync implementations take the lock shared with the
+    # flusher thread and may query SQLite (cache validation, flush on a miss), so they run in the
+    # "checkpoint" pool instead of on the event loop.
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await run_in_pool("checkpoint", self.get_tuple, config)
+
+    async def alist(self,
+                    config: Optional[RunnableConfig],
+                    *,
+                    filter: Optional[dict] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await run_in_pool("checkpoint", lambda: list(self.list(config, filter=filter, before=before,
+                                                                       limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self,
+                   config: RunnableConfig,
+                   checkpoint: Checkpoint,
+                   metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await run_in_pool("checkpoint", self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self,
+                          config: RunnableConfig,
+                          writes: Sequence[Tuple[str, Any]],
+                          task_id: str,
+                          task_path: str = "") -> None:
+        await run_in_pool("checkpoint", self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await run_in_pool("checkpoint", self.delete_thread, thread_id)
+
+    ############################################################################################################
+    @staticmethod
+    def _copy(checkpoint_tuple: CheckpointTuple) -> CheckpointTuple:
+        # Callers may mutate the returned checkpoint, the cached one must stay intact
+        return checkpoint_tuple._replace(checkpoint=copy_checkpoint(checkpoint_tuple.checkpoint),
+                                         pending_writes=list(checkpoint_tuple.pending_writes or []))
+
+    def _remember(self, key, checkpoint_tuple: CheckpointTuple):
+        self._cache[key] = checkpoint_tuple
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _enqueue(self, kind: str, row: tuple):
+        self._pending.append((kind, row))
+        key = (row[0], row[1])
+        self._pending_threads[key] = self._pending_threads.get(key, 0) + 1
+        if len(self._pending) >= self.batch_size:
+            self._flush_requested.set()
+
+    def _latest_id(self, key) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT 1", key).fetchone()
+        return row[0] if row else None
+
+    def _select(self, thread_id, checkpoint_ns, checkpoint_id=None, before_id=None, limit=None):
+        query = ("SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                 "metadata_type, metadata FROM checkpoints WHERE thread_id = ?")
+        params = [thread_id]
+        if checkpoint_ns is not None:
+            query += " AND checkpoint_ns = ?"
+            params.append(checkpoint_ns)
+        if checkpoint_id:
+            query += " AND checkpoint_id = ?"
+            params.append(checkpoint_id)
+        if before_id:
+            query += " AND checkpoint_id < ?"
+            params.append(before_id)
+        query += " ORDER BY checkpoint_id DESC"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+
+        for (thread_id_, checkpoint_ns_, checkpoint_id_, parent_id,
+             checkpoint_type, checkpoint_blob, metadata_type, metadata_blob) in self._conn.execute(query, params).fetchall():
+            writes = self._conn.execute(
+                "SELECT task_id, channel, type, value FROM writes WHERE thread_id = ? AND checkpoint_ns = ? "
+                "AND checkpoint_id = ? ORDER BY task_id, idx", (thread_id_, checkpoint_ns_, checkpoint_id_)).fetchall()
+            yield CheckpointTuple(
+                config={"configurable": {"thread_id": thread_id_,
+                                         "checkpoint_ns": checkpoint_ns_,
+                                         "checkpoint_id": checkpoint_id_}},
+                checkpoint=self._loads(checkpoint_type, checkpoint_blob),
+                metadata=self._loads(metadata_type, metadata_blob),
+                parent_config=({"configurable": {"thread_id": thread_id_,
+                                                 "checkpoint_ns": checkpoint_ns_,
+                                                 "checkpoint_id": parent_id}}
+                               if parent_id else None),
+                pending_writes=[(task_id, channel, self._loads(value_type, value))
+                                for task_id, channel, value_type, value in writes],
+            )
+
+    ############################################################################################################
+    def _flush_loop(self):
+        while not self._closed:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing checkpoints: {e}")
+
+    def flush(self) -> None:
+        """
+        Writes every pending checkpoint and write to the database in a single transaction.
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        pending, threads = self._pending, self._pending_threads
+        self._pending, self._pending_threads = [], {}
+
+        checkpoints = [row for kind, row in pending if kind == "checkpoint"]
+        writes = [row for kind, row in pending if kind == "write"]
+        try:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if checkpoints:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)", checkpoints)
+            if writes:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", writes)
+            if self.keep_last:
+                for thread_id, checkpoint_ns in threads:
+                    self._prune(thread_id, checkpoint_ns)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            # Keep the batch so the next flush retries it
+            self._pending = pending + self._pending
+            for key, count in threads.items():
+                self._pending_threads[key] = self._pending_threads.get(key, 0) + count
+            raise
+
+    def _prune(self, thread_id: str, checkpoint_ns: str):
+        stale = [row[0] for row in self._conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?", (thread_id, checkpoint_ns, self.keep_last))]
+        if stale:
+            self._conn.executemany(
+                "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                [(thread_id, checkpoint_ns, checkpoint_id) for checkpoint_id in stale])
+            self._conn.executemany(
+                "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                [(thread_id, checkpoint_ns, checkpoint_id) for checkpoint_id in stale])
+
+    def close(self) -> None:
+        """
+        Flushes pending operations and stops the background flusher.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._flush_requested.set()
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error(f"Error flushing checkpoints on close: {e}")
+
+
+####################################################################################################
+
+def create_checkpointer():
+    """
+    Creates the conversation checkpointer selected by the CHECKPOINT_BACKEND environment variable.
+
+    Backends:
+        - "sqlite" (default): durable SQLite/WAL store at CHECKPOINT_DB_PATH, shared by all workers.
+        - "memory": the in-process LangGraph MemorySaver.
+
+    Returns:
+        BaseCheckpointSaver: The checkpointer instance.
+    """
+    backend = os.environ.get("CHECKPOINT_BACKEND", "sqlite").lower()
+    if backend == "memory":
+        return MemorySaver()
+    if backend == "sqlite":
+        return SQLiteCheckpointSaver(
+            path=os.environ.get("CHECKPOINT_DB_PATH", os.path.join("data", "checkpoints.sqlite")),
+            batch_size=int(os.environ.get("CHECKPOINT_BATCH_SIZE", 64)),
+            flush_interval=float(os.environ.get("CHECKPOINT_FLUSH_INTERVAL", 0.05)),
+            cache_size=int(os.environ.get("CHECKPOINT_CACHE_SIZE", 1024)),
+            keep_last=int(os.environ.get("CHECKPOINT_KEEP_LAST", 2)),
+        )
+    raise ValueError(f"Unknown checkpoint backend: {backend}")
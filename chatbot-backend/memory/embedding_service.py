@@ -0,0 +1,193 @@
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List
+from langchain_core.embeddings import Embeddings
+from utils.micro_batcher import ThreadMicroBatcher
+from utils.metrics import Counter
+
+EMBEDDING_PRECISIONS = ("fp32", "fp16", "int8")
+
+EMBEDDING_CACHE = Counter(
+    "sage_embedding_cache_total",
+    "Embedding cache lookups by result (hit, miss).",
+    labelnames=("result",),
+)
+
+
+class CachedBatchedEmbeddings(Embeddings):
+    """
+    LangChain Embeddings backed by a sentence-transformers model, with a cache and cross-request batching.
+
+    - Texts are looked up in an LRU cache keyed by the SHA-1 of the text.
+    - Missing texts of all concurrent callers (threads or coroutines) are grouped into one forward pass.
+    - The model can run in fp16 (GPU) or with int8 dynamic quantization of its linear layers (CPU).
+
+    The vectors are the same as HuggingFaceEmbeddings' with the default settings, so existing indexes
+    stay valid (apart from the small deviation of the fp16/int8 modes).
+    """
+
+    def __init__(self, model_name: str, precision: str = "fp32", device: str = None, cache_size: int = 10_000,
+                 max_batch_size: int = 32, max_wait_ms: float = 5, normalize: bool = False):
+        """
+        Args:
+            model_name (str): The sentence-transformers model, e.g. "intfloat/multilingual-e5-large".
+            precision (str): "fp32", "fp16" or "int8".
+            device (str, optional): Torch device, detected automatically when None.
+            cache_size (int): Number of cached embeddings.
+            max_batch_size (int): The maximum number of texts per forward pass.
+            max_wait_ms (float): How long a text waits for others to join its batch.
+            normalize (bool): Whether the embeddings are L2-normalized.
+        """
+        if precision not in EMBEDDING_PRECISIONS:
+            raise ValueError(f"Unknown embedding precision '{precision}', expected one of {EMBEDDING_PRECISIONS}")
+        self.model_name = model_name
+        self.precision = precision
+        self.normalize = normalize
+        self.cache_size = cache_size
+        self.model = self._load_model(model_name, precision, device)
+        self.stats = {"hits": 0, "misses": 0}
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.batcher = ThreadMicroBatcher(self._encode_batch, max_batch_size=max_batch_size,
+                                          max_wait_ms=max_wait_ms, name="embedding")
+
+    @staticmethod
+    def _load_model(model_name: str, precision: str, device: str):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+        if precision == "int8":
+            # Dynamic quantization only runs on the CPU
+            device = "cpu"
+        model = SentenceTransformer(model_name, device=device)
+        if precision == "fp16":
+            if device == "cpu":
+                logging.warning("fp16 embeddings on the CPU are usually slower than fp32, consider int8.")
+            model.half()
+        elif precision == "int8":
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.eval()
+        logging.info(f"Loaded embedding model {model_name} ({precision}, {device})")
+        return model
+
+    ############################################################################################################
+
+    @staticmethod
+    def cache_key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _encode_batch(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                                    normalize_embeddings=self.normalize, show_progress_bar=False)
+        return vectors.astype("float32").tolist()
+
+    def _lookup(self, texts: List[str]):
+        """
+        Returns the cached embedding of every text (None when missing) and the keys of the texts.
+        """
+        keys = [self.cache_key(text) for text in texts]
+        with self._cache_lock:
+            vectors = []
+            for key in keys:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    self._cache.move_to_end(key)
+                vectors.append(vector)
+        hits = sum(vector is not None for vector in vectors)
+        self._count(hits, len(texts) - hits)
+        return vectors, keys
+
+    def _count(self, hits: int, misses: int) -> None:
+        with self._cache_lock:
+            self.stats["hits"] += hits
+            self.stats["misses"] += misses
+        if hits:
+            EMBEDDING_CACHE.inc(hits, result="hit")
+        if misses:
+            EMBEDDING_CACHE.inc(misses, result="miss")
+
+    def _store(self, keys: List[str], vectors: List[List[float]]) -> None:
+        with self._cache_lock:
+            for key, vector in zip(keys, vectors):
+                self._cache[key] = vector
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _missing(self, texts: List[str], vectors: list, keys: List[str]):
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                # Identical texts in one call are embedded once
+                missing.setdefault(keys[i], (texts[i], []))[1].append(i)
+        return missing
+
+    ############################################################################################################
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds the texts, batched with the concurrent requests of other threads.
+        """
+        vectors, keys = self._lookup(texts)
+        missing = self._missing(texts, vectors, keys)
+        if missing:
+            computed = self.batcher.run([text for text, _ in missing.values()])
+            self._store(list(missing), computed)
+            for (_, indexes), vector in zip(missing.values(), computed):
+                for i in indexes:
+                    vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds the texts without blocking the event loop, batched with the concurrent requests.
+        """
+        vectors, keys = self._lookup(texts)
+        missing = self._missing(texts, vectors, keys)
+        if missing:
+            futures = [asyncio.wrap_future(self.batcher.submit(text)) for text, _ in missing.values()]
+            computed = await asyncio.gather(*futures)
+            self._store(list(missing), computed)
+            for (_, indexes), vector in zip(missing.values(), computed):
+                for i in indexes:
+                    vectors[i] = vector
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def get_stats(self) -> dict:
+        with self._cache_lock:
+            return {**self.stats, "cached": len(self._cache), "precision": self.precision}
+
+
+def create_embeddings(model_name: str) -> Embeddings:
+    """
+    Creates the embeddings of the memory vector store.
+
+    EMBEDDING_SERVICE selects "cached" (CachedBatchedEmbeddings, default) or "huggingface" (plain
+    HuggingFaceEmbeddings). The cached service reads EMBEDDING_PRECISION (fp32), EMBEDDING_CACHE_SIZE (10000),
+    EMBEDDING_BATCH_SIZE (32) and EMBEDDING_BATCH_WAIT_MS (5).
+    """
+    service = os.environ.get("EMBEDDING_SERVICE", "cached").lower()
+    if service == "huggingface":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=model_name)
+    if service != "cached":
+        raise ValueError(f"Unknown embedding service '{service}', expected 'cached' or 'huggingface'")
+    return CachedBatchedEmbeddings(
+        model_name,
+        precision=os.environ.get("EMBEDDING_PRECISION", "fp32").lower(),
+        cache_size=int(os.environ.get("EMBEDDING_CACHE_SIZE", 10_000)),
+        max_batch_size=int(os.environ.get("EMBEDDING_BATCH_SIZE", 32)),
+        max_wait_ms=float(os.environ.get("EMBEDDING_BATCH_WAIT_MS", 5)),
+    )
@@ -0,0 +1,231 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from utils.executors import run_in_pool
+from utils.metrics import Counter
+
+HOT_MEMORY_QUERIES = Counter(
+    "sage_hot_memory_queries_total",
+    "Long-term memory queries by how the hot tier served them (hit, partial, fallback).",
+    labelnames=("result",),
+)
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class _UserMemories:
+    """
+    The hot memories of one user, oldest first.
+    """
+
+    def __init__(self, dim: int, rows: list, complete: bool):
+        self.ids = [row[0] for row in rows]
+        self.texts = [row[2] for row in rows]
+        self.metadatas = [row[3] for row in rows]
+        self.vectors = _normalize([row[1] for row in rows]).astype(np.float16) if rows else np.empty((0, dim), dtype=np.float16)
+        # Whether these are all the memories of the user, so the remote index has nothing more to offer
+        self.complete = complete
+        self.loaded_at = time.monotonic()
+        self.loaded_wall_time = time.time()
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + sum(len(text) for text in self.texts)
+
+    def rows(self) -> list:
+        return list(zip(self.ids, self.vectors, self.texts, self.metadatas))
+
+
+class HotMemoryTier:
+    """
+    Per-user, in-process copy of the most recent long-term memories, serving similarity queries without
+    a round trip to the remote vector store.
+
+    - A user's memories are loaded from the remote store (`loader`) when their session starts, the most
+      recent `max_per_user` by their `created_at` metadata.
+    - New memories are added here first (write-through) while LTMWriter writes them asynchronously.
+    - When older memories did not fit (`complete` is False) and the hot ones do not answer a query,
+      MemoryManager falls back to the remote store.
+
+    Consistency across workers: every worker has its own tier, so a memory written by another worker is
+    only seen after the entry expires. Entries are reloaded after `ttl_s` seconds, which bounds the
+    staleness, and a user's entry is dropped when their memories are cleared on this worker. A reload
+    lists the user's ids again but only fetches the memories the tier does not hold yet.
+    """
+
+    def __init__(self, loader: Callable, dim: int, max_per_user: int = 1000, max_megabytes: float = 256,
+                 ttl_s: float = 300, max_scan: int = 10_000):
+        """
+        Args:
+            loader (callable): loader(user_id, max_scan, known_rows=...) returns (rows, exhausted), the rows
+                being (id, vector, text, metadata) tuples. `known_rows` maps the ids already held to their
+                row, the loader reuses them instead of fetching them again. Blocking (it runs on the
+                vector-store pool).
+            dim (int): The dimension of the embeddings.
+            max_per_user (int): Memories kept per user, the most recent ones.
+            max_megabytes (float): Memory budget of the tier, the least recently used users are evicted.
+            ttl_s (float): Seconds after which a user's memories are reloaded from the remote store.
+            max_scan (int): The maximum number of memories the loader reads per user.
+        """
+        self.loader = loader
+        self.dim = dim
+        self.max_per_user = max_per_user
+        self.max_bytes = int(max_megabytes * 1024 * 1024)
+        self.ttl_s = ttl_s
+        self.max_scan = max_scan
+        self.stats = {"hit": 0, "partial": 0, "fallback": 0, "loads": 0, "evictions": 0}
+        self._users = OrderedDict()
+        self._loading = {}
+
+    ############################################################################################################
+
+    def prefetch(self, user_id: str) -> None:
+        """
+        Starts loading the user's memories in the background, e.g. when their session starts.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self.get(user_id) is None:
+            self._start_load(user_id)
+
+    async def ensure_loaded(self, user_id: str) -> None:
+        """
+        Loads the user's memories unless a fresh copy is already held.
+        """
+        if self.get(user_id) is None:
+            await asyncio.shield(self._start_load(user_id))
+
+    def _start_load(self, user_id: str) -> asyncio.Task:
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._load(user_id))
+            self._loading[user_id] = task
+            task.add_done_callback(lambda done: self._on_load_done(user_id, done))
+        return task
+
+    def _on_load_done(self, user_id: str, task: asyncio.Task) -> None:
+        if self._loading.get(user_id) is task:
+            self._loading.pop(user_id)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Loading the hot memories of user {user_id} failed: {task.exception()}")
+
+    async def _load(self, user_id: str) -> None:
+        previous = self._users.get(user_id)
+        known_rows = {row[0]: row for row in previous.rows()} if previous is not None else {}
+        rows, exhausted = await run_in_pool("vector-store", self.loader, user_id, self.max_scan,
+                                           known_rows=known_rows)
+        if previous is not None:
+            # Keep the memories written here since the last load, the remote write may still be pending
+            loaded_ids = {row[0] for row in rows}
+            rows = rows + [row for row in previous.rows()
+                           if row[0] not in loaded_ids and row[3].get("created_at", 0) >= previous.loaded_wall_time]
+        rows.sort(key=lambda row: row[3].get("created_at", 0))
+        complete = exhausted and len(rows) <= self.max_per_user
+        self._users[user_id] = _UserMemories(self.dim, rows[-self.max_per_user:], complete)
+        self._users.move_to_end(user_id)
+        self.stats["loads"] += 1
+        self._evict()
+        logging.info(f"Loaded {len(self._users[user_id].ids)} hot memories of user {user_id} (complete: {complete})")
+
+    def _evict(self) -> None:
+        total = sum(memories.nbytes for memories in self._users.values())
+        while total > self.max_bytes and len(self._users) > 1:
+            _, memories = self._users.popitem(last=False)
+            total -= memories.nbytes
+            self.stats["evictions"] += 1
+
+    ############################################################################################################
+
+    def get(self, user_id: str) -> Optional[_UserMemories]:
+        """
+        Returns the user's memories if loaded and not expired.
+        """
+        memories = self._users.get(user_id)
+        if memories is None or time.monotonic() - memories.loaded_at > self.ttl_s:
+            return None
+        self._users.move_to_end(user_id)
+        return memories
+
+    def add(self, user_id: str, id: str, vector, text: str, metadata: dict) -> bool:
+        """
+        Adds a new memory of a loaded user. Returns False when the user is not held by the tier.
+        """
+        memories = self._users.get(user_id)
+        if memories is None:
+            return False
+        if id in memories.ids:
+            # Same content saved again, ids are content hashes
+            return True
+        memories.ids.append(id)
+        memories.texts.append(text)
+        memories.metadatas.append(metadata)
+        memories.vectors = np.vstack([memories.vectors, _normalize([vector]).astype(np.float16)])
+        if len(memories.ids) > self.max_per_user:
+            del memories.ids[0], memories.texts[0], memories.metadatas[0]
+            memories.vectors = memories.vectors[1:]
+            memories.complete = False
+        self._evict()
+        return True
+
+    def count(self, user_id: str, session_id: str = None) -> Optional[int]:
+        """
+        Returns the number of memories of the user (and session), None unless every one of them is held.
+        """
+        memories = self.get(user_id)
+        if memories is None or not memories.complete:
+            return None
+        return sum(session_id is None or metadata.get("session_id") == session_id for metadata in memories.metadatas)
+
+    def drop(self, user_id: str) -> None:
+        self._users.pop(user_id, None)
+        task = self._loading.pop(user_id, None)
+        if task is not None:
+            # The memories being loaded are about to be deleted
+            task.cancel()
+
+    def search(self, user_id: str, vector, k: int, session_id: str = None,
+               score_threshold: float = None) -> Optional[Tuple[List[Tuple[str, float]], bool]]:
+        """
+        Similarity search over the user's hot memories.
+
+        Args:
+            user_id (str): The user (namespace).
+            vector: The query embedding.
+            k (int): The maximum number of results.
+            session_id (str, optional): Only memories with this `session_id` metadata.
+            score_threshold (float, optional): The minimum relevance score, (cosine + 1) / 2 like Pinecone.
+
+        Returns:
+            The (text, score) results best first and whether they are authoritative (every memory of the
+            user is held), or None when the user is not held by the tier.
+        """
+        memories = self.get(user_id)
+        if memories is None:
+            return None
+        rows = np.array([row for row, metadata in enumerate(memories.metadatas)
+                         if session_id is None or metadata.get("session_id") == session_id], dtype=np.int64)
+        if len(rows) == 0:
+            return [], memories.complete
+        scores = (np.asarray(memories.vectors[rows], dtype=np.float32) @ _normalize(vector) + 1) / 2
+        order = np.argsort(-scores)[:k]
+        results = [(memories.texts[rows[i]], float(scores[i])) for i in order
+                   if score_threshold is None or scores[i] >= score_threshold]
+        return results, memories.complete
+
+    def record(self, result: str) -> None:
+        self.stats[result] += 1
+        HOT_MEMORY_QUERIES.inc(result=result)
+
+    def get_stats(self) -> dict:
+        return {**self.stats,
+                "users": len(self._users),
+                "megabytes": round(sum(memories.nbytes for memories in self._users.values()) / 1024 / 1024, 2)}
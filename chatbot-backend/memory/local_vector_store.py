@@ -0,0 +1,426 @@
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+from typing import Any, Iterable, List, Optional, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from utils.executors import run_in_pool
+
+## "exact" scans every vector, "ivf" searches the closest clusters only, "auto" switches to IVF for large namespaces
+SEARCH_MODES = ("exact", "ivf", "auto")
+IVF_AUTO_MIN_VECTORS = int(os.environ.get("LOCAL_VECTOR_IVF_MIN_VECTORS", 100_000))
+IVF_NPROBE = int(os.environ.get("LOCAL_VECTOR_NPROBE", 16))
+## IVF clusters need a minimum number of vectors to be meaningful
+IVF_MIN_TRAIN_VECTORS = 1_000
+IVF_TRAIN_SAMPLE = 50_000
+IVF_TRAIN_ITERATIONS = 10
+## Rows scored per matrix product, bounds the float32 working set
+SEARCH_CHUNK_ROWS = 65_536
+
+
+def _normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class _IVFIndex:
+    """
+    Inverted file index: k-means centroids and the rows assigned to each of them.
+    """
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray):
+        self.centroids = centroids
+        self.assignments = assignments
+        # Number of vectors when the index was trained, rows added later are only assigned
+        self.trained_size = len(assignments)
+        self.lists = [np.flatnonzero(assignments == i) for i in range(len(centroids))]
+
+    @classmethod
+    def train(cls, matrix, seed: int = 0) -> "_IVFIndex":
+        n = matrix.shape[0]
+        nlist = int(min(max(4 * np.sqrt(n), 16), 4096))
+        rng = np.random.default_rng(seed)
+        sample = _normalize(matrix[np.sort(rng.choice(n, size=min(n, IVF_TRAIN_SAMPLE), replace=False))])
+        centroids = sample[rng.choice(len(sample), size=min(nlist, len(sample)), replace=False)]
+        for _ in range(IVF_TRAIN_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(len(centroids)):
+                members = sample[labels == i]
+                if len(members):
+                    centroids[i] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        return cls(centroids, cls.assign_rows(centroids, matrix))
+
+    @staticmethod
+    def assign_rows(centroids, matrix) -> np.ndarray:
+        assignments = np.empty(matrix.shape[0], dtype=np.int32)
+        for start in range(0, matrix.shape[0], SEARCH_CHUNK_ROWS):
+            block = np.asarray(matrix[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return assignments
+
+    def add(self, first_row: int, vectors: np.ndarray) -> None:
+        labels = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        self.assignments = np.concatenate([self.assignments, labels])
+        for offset, label in enumerate(labels):
+            self.lists[label] = np.append(self.lists[label], first_row + offset)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        closest = np.argsort(-(self.centroids @ query))[:nprobe]
+        return np.sort(np.concatenate([self.lists[i] for i in closest]))
+
+
+class _Namespace:
+    """
+    The memories of one namespace (user), stored in a directory:
+    - vectors.f16: unit-normalized float16 vectors, appended row by row and read through a memory map,
+    - meta.jsonl: one line per row (id, text, metadata) and tombstone lines for deleted ids,
+    - ivf.npz: the IVF index, when one has been built.
+    A row is only visible once its metadata line is written, vectors past the last line are discarded on load.
+    """
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.dim = dim
+        self.lock = threading.RLock()
+        self.ids, self.texts, self.metadatas = [], [], []
+        self.row_of = {}
+        self.deleted_rows = set()
+        self.ivf = None
+        self._matrix = None
+        self._columns = {}
+        self._code_arrays = {}
+        self._load()
+
+    @property
+    def vectors_path(self) -> str:
+        return os.path.join(self.path, "vectors.f16")
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.path, "meta.jsonl")
+
+    @property
+    def ivf_path(self) -> str:
+        return os.path.join(self.path, "ivf.npz")
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "deleted" in entry:
+                    row = self.row_of.pop(entry["deleted"], None)
+                    if row is not None:
+                        self.deleted_rows.add(row)
+                    continue
+                self._append_row(entry["id"], entry["text"], entry["metadata"])
+
+        # Drop vectors written by an interrupted insert
+        row_bytes = self.dim * 2
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if size > len(self.ids) * row_bytes:
+            with open(self.vectors_path, "r+b") as file:
+                file.truncate(len(self.ids) * row_bytes)
+        elif size < len(self.ids) * row_bytes:
+            raise RuntimeError(f"Vector file of {self.path} is shorter than its metadata")
+
+        if os.path.exists(self.ivf_path):
+            saved = np.load(self.ivf_path)
+            assignments = saved["assignments"]
+            if len(assignments) <= len(self.ids):
+                self.ivf = _IVFIndex(saved["centroids"], assignments)
+                if len(assignments) < len(self.ids):
+                    self.ivf.add(len(assignments), np.asarray(self.matrix()[len(assignments):], dtype=np.float32))
+
+    def _append_row(self, id: str, text: str, metadata: dict) -> None:
+        if id in self.row_of:
+            # Same id again: the new row replaces the old one, as an upsert does
+            self.deleted_rows.add(self.row_of[id])
+        self.row_of[id] = len(self.ids)
+        self.ids.append(id)
+        self.texts.append(text)
+        self.metadatas.append(metadata)
+        for key, (codes, code_of) in self._columns.items():
+            codes.append(code_of.setdefault(metadata.get(key), len(code_of)))
+
+    def matrix(self):
+        n = len(self.ids)
+        if self._matrix is None or self._matrix.shape[0] != n:
+            if n == 0:
+                return np.empty((0, self.dim), dtype=np.float16)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(n, self.dim))
+        return self._matrix
+
+    def close(self) -> None:
+        """
+        Releases the memory map of the vectors, the files cannot be deleted while mapped on Windows.
+        """
+        if self._matrix is not None:
+            try:
+                self._matrix._mmap.close()
+            except (AttributeError, BufferError):
+                # Still referenced by an ongoing search, unmapped once it is collected
+                pass
+            self._matrix = None
+
+    def add(self, vectors: np.ndarray, texts: List[str], metadatas: List[dict], ids: List[str]) -> None:
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            first_row = len(self.ids)
+            # Vectors first: a row only exists once its metadata line is written
+            with open(self.vectors_path, "ab") as file:
+                file.write(vectors.astype(np.float16).tobytes())
+            with open(self.meta_path, "a", encoding="utf-8") as file:
+                for id, text, metadata in zip(ids, texts, metadatas):
+                    file.write(json.dumps({"id": id, "text": text, "metadata": metadata}) + "\n")
+            for id, text, metadata in zip(ids, texts, metadatas):
+                self._append_row(id, text, metadata)
+            if self.ivf is not None:
+                self.ivf.add(first_row, vectors)
+
+    def delete(self, ids: List[str]) -> None:
+        with self.lock:
+            with open(self.meta_path, "a", encoding="utf-8") as file:
+                for id in ids:
+                    row = self.row_of.pop(id, None)
+                    if row is not None:
+                        self.deleted_rows.add(row)
+                        file.write(json.dumps({"deleted": id}) + "\n")
+
+    def _column(self, key: str) -> Tuple[list, dict]:
+        """
+        Integer codes of the values of a metadata key, kept up to date once a filter has used the key.
+        """
+        if key not in self._columns:
+            code_of = {}
+            codes = [code_of.setdefault(metadata.get(key), len(code_of)) for metadata in self.metadatas]
+            self._columns[key] = (codes, code_of)
+        return self._columns[key]
+
+    def _code_array(self, key: str, codes: list) -> np.ndarray:
+        array = self._code_arrays.get(key)
+        if array is None or len(array) != len(codes):
+            array = self._code_arrays[key] = np.asarray(codes, dtype=np.int32)
+        return array
+
+    def mask(self, filter: Optional[dict]) -> Optional[np.ndarray]:
+        """
+        Rows matching the metadata filter ({key: value} or {key: {"$eq": value}}) and not deleted, None for all rows.
+        """
+        if not filter and not self.deleted_rows:
+            return None
+        mask = np.ones(len(self.ids), dtype=bool)
+        for key, value in (filter or {}).items():
+            if isinstance(value, dict):
+                if set(value) != {"$eq"}:
+                    raise ValueError(f"Unsupported filter operator for '{key}': {value}, only $eq is supported")
+                value = value["$eq"]
+            codes, code_of = self._column(key)
+            if value not in code_of:
+                return np.zeros(len(self.ids), dtype=bool)
+            mask &= self._code_array(key, codes) == code_of[value]
+        if self.deleted_rows:
+            mask[list(self.deleted_rows)] = False
+        return mask
+
+    def build_ivf(self) -> None:
+        with self.lock:
+            logging.info(f"Building the IVF index of {self.path} ({len(self.ids)} vectors)")
+            self.ivf = _IVFIndex.train(self.matrix())
+            tmp_path = self.ivf_path + ".tmp.npz"
+            np.savez(tmp_path, centroids=self.ivf.centroids, assignments=self.ivf.assignments)
+            os.replace(tmp_path, self.ivf_path)
+
+    def search(self, query: np.ndarray, k: int, filter: Optional[dict], use_ivf: bool, nprobe: int) -> List[Tuple[int, float]]:
+        """
+        Returns the (row, cosine similarity) pairs of the k closest rows.
+        """
+        with self.lock:
+            matrix = self.matrix()
+            mask = self.mask(filter)
+            ivf = self.ivf if use_ivf else None
+        if matrix.shape[0] == 0:
+            return []
+
+        if ivf is not None:
+            rows = ivf.candidates(query, nprobe)
+            rows = rows[rows < matrix.shape[0]]
+            if mask is not None:
+                rows = rows[mask[rows]]
+        elif mask is not None:
+            rows = np.flatnonzero(mask)
+        else:
+            rows = None
+
+        total = matrix.shape[0] if rows is None else len(rows)
+        if total == 0:
+            return []
+        scores = np.empty(total, dtype=np.float32)
+        for start in range(0, total, SEARCH_CHUNK_ROWS):
+            block = matrix[start:start + SEARCH_CHUNK_ROWS] if rows is None else matrix[rows[start:start + SEARCH_CHUNK_ROWS]]
+            scores[start:start + len(block)] = np.asarray(block, dtype=np.float32) @ query
+        # Rounding the vectors to float16 can put near-identical matches slightly above 1
+        np.clip(scores, -1.0, 1.0, out=scores)
+
+        k = min(k, total)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(top_index if rows is None else rows[top_index]), float(scores[top_index])) for top_index in top]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store keeping the memories on local disk, a drop-in for the PineconeVectorStore of MemoryManager.
+
+    Supports the calls MemoryManager makes: (a)add_texts with a namespace, (a)similarity_search_with_score
+    and the relevance-score variants with a `session_id` metadata filter and `score_threshold`, and
+    (a)delete(ids or delete_all, namespace). Similarities are cosine, relevance scores are (cosine + 1) / 2
+    like Pinecone's, so the same thresholds apply.
+    """
+
+    def __init__(self, path: str, embedding: Embeddings, dim: int, search_mode: str = "auto", nprobe: int = IVF_NPROBE):
+        """
+        Args:
+            path (str): Root directory of the store, one subdirectory per namespace.
+            embedding (Embeddings): The embedding model.
+            dim (int): The dimension of the embeddings.
+            search_mode (str): "exact", "ivf" or "auto" (IVF from LOCAL_VECTOR_IVF_MIN_VECTORS vectors on).
+            nprobe (int): Number of IVF clusters searched per query.
+        """
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{search_mode}', expected one of {SEARCH_MODES}")
+        self.path = path
+        self._embedding = embedding
+        self.dim = dim
+        self.search_mode = search_mode
+        self.nprobe = nprobe
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @staticmethod
+    def _namespace_key(namespace) -> str:
+        # Callers pass user ids, which are not always strings
+        return "" if namespace is None else str(namespace)
+
+    def _namespace(self, namespace: Optional[str]) -> _Namespace:
+        namespace = self._namespace_key(namespace)
+        with self._lock:
+            if namespace not in self._namespaces:
+                # Hashed directory names: namespaces are user ids and may contain any character
+                directory = hashlib.sha1(namespace.encode("utf-8")).hexdigest()
+                self._namespaces[namespace] = _Namespace(os.path.join(self.path, directory), self.dim)
+            return self._namespaces[namespace]
+
+    def _use_ivf(self, space: _Namespace) -> bool:
+        if self.search_mode == "exact" or len(space) < IVF_MIN_TRAIN_VECTORS:
+            return False
+        if self.search_mode == "auto" and len(space) < IVF_AUTO_MIN_VECTORS:
+            return False
+        # Retrain once the namespace has doubled since the index was built
+        if space.ivf is None or len(space) > 2 * space.ivf.trained_size:
+            space.build_ivf()
+        return True
+
+    def count(self, namespace: Optional[str] = None, filter: Optional[dict] = None) -> int:
+        """
+        Returns the number of memories of the namespace matching the metadata filter.
+        """
+        space = self._namespace(namespace)
+        with space.lock:
+            mask = space.mask(filter)
+            return len(space) if mask is None else int(mask.sum())
+
+    ############################################################################################################
+
+    def add_embeddings(self, embeddings, texts: List[str], metadatas: Optional[List[dict]] = None,
+                       ids: Optional[List[str]] = None, namespace: Optional[str] = None) -> List[str]:
+        """
+        Adds precomputed embeddings with their texts.
+        """
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        self._namespace(namespace).add(_normalize(embeddings), list(texts), metadatas, ids)
+        return ids
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                  namespace: Optional[str] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(self._embedding.embed_documents(texts), texts, metadatas, ids, namespace)
+
+    async def aadd_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                         namespace: Optional[str] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        embeddings = await self._embedding.aembed_documents(texts)
+        return await run_in_pool("vector-store", self.add_embeddings, embeddings, texts, metadatas, ids, namespace)
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4, filter: Optional[dict] = None,
+                                               namespace: Optional[str] = None) -> List[Tuple[Document, float]]:
+        """
+        Returns the k closest memories to `embedding` with their cosine similarity.
+        """
+        space = self._namespace(namespace)
+        query = _normalize(embedding)
+        hits = space.search(query, k, filter, self._use_ivf(space), self.nprobe)
+        return [(Document(id=space.ids[row], page_content=space.texts[row], metadata=space.metadatas[row]), score)
+                for row, score in hits]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                                     namespace: Optional[str] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter, namespace)
+
+    async def asimilarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                                            namespace: Optional[str] = None, **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = await self._embedding.aembed_query(query)
+        return await run_in_pool("vector-store", self.similarity_search_by_vector_with_score, embedding, k, filter, namespace)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        # Same mapping of the cosine similarity to [0, 1] as PineconeVectorStore
+        return lambda score: (score + 1) / 2
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: Optional[bool] = None,
+               namespace: Optional[str] = None, **kwargs: Any) -> None:
+        """
+        Deletes the given ids, or the whole namespace with `delete_all`.
+        """
+        space = self._namespace(namespace)
+        if delete_all:
+            with self._lock, space.lock:
+                space.close()
+                for name in os.listdir(space.path) if os.path.isdir(space.path) else []:
+                    os.remove(os.path.join(space.path, name))
+                del self._namespaces[self._namespace_key(namespace)]
+        elif ids:
+            space.delete(ids)
+
+    async def adelete(self, ids: Optional[List[str]] = None, delete_all: Optional[bool] = None,
+                      namespace: Optional[str] = None, **kwargs: Any) -> None:
+        await run_in_pool("vector-store", self.delete, ids, delete_all, namespace)
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   path: str = os.path.join("data", "vectors"), dim: int = None, **kwargs: Any) -> "LocalVectorStore":
+        embeddings = embedding.embed_documents(list(texts))
+        store = cls(path, embedding, dim or len(embeddings[0]))
+        store.add_embeddings(embeddings, list(texts), metadatas, kwargs.get("ids"), kwargs.get("namespace"))
+        return store
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import contextvars
+from collections import OrderedDict
+from memory.embedding_service import CachedBatchedEmbeddings
+from utils.metrics import Counter, Gauge, Histogram, BATCH_BUCKETS, STAGE_SECONDS
+
+LTM_WRITE_QUEUE_DEPTH = Gauge(
+    "sage_ltm_write_queue_depth",
+    "Long-term memory writes waiting for the background writer.",
+)
+LTM_WRITE_LAG_SECONDS = Histogram(
+    "sage_ltm_write_lag_seconds",
+    "Time from queueing a long-term memory write to its upsert in the vector store.",
+)
+LTM_WRITE_BATCH_SIZE = Histogram(
+    "sage_ltm_write_batch_size",
+    "Memories per background upsert batch.",
+    buckets=BATCH_BUCKETS + (128, 256),
+)
+LTM_WRITES = Counter(
+    "sage_ltm_writes_total",
+    "Long-term memory writes by result (written, duplicate, spilled, failed).",
+    labelnames=("result",),
+)
+
+
+def memory_id(namespace: str, session_id: str, text: str) -> str:
+    """
+    Content-hash id of a memory: writing the same exchange again (retried or duplicated turn)
+    overwrites the existing vector instead of adding a new one.
+    """
+    return hashlib.sha256(f"{namespace}\n{session_id}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+
+def _is_transient(error: Exception) -> bool:
+    """
+    Whether a write error comes from the vector store (unreachable, overloaded, misconfigured) rather than
+    from the memories written, so that retrying the same memories later can succeed.
+    """
+    if isinstance(error, (OSError, asyncio.TimeoutError)):
+        return True
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if isinstance(status, int):
+        # 401/403: every write fails until the API key is fixed, not the fault of these memories
+        return status in (401, 403, 408, 429) or status >= 500
+    # Connection errors of the Pinecone REST client
+    return type(error).__module__.startswith("urllib3")
+
+
+class LTMWriter:
+    """
+    Global write-behind writer of long-term memories.
+
+    Sessions queue their memories and return immediately. A background task collects the queued writes of
+    all sessions, up to `batch_size` or `max_wait_ms` after the first one, embeds them in one call and
+    upserts them per namespace. A batch failing with transient errors (the store is unreachable) is retried
+    until it is written, with a backoff capped at `max_backoff_s` (the content-hash ids make retries
+    idempotent): the sessions already consider these memories saved, so they are not dropped while the
+    process runs. A batch failing `max_attempts` times with other errors is split in halves written
+    separately, down to the single memories that cannot be written (e.g. metadata over the store's size
+    limit): those are appended to `dead_letter_path` and count as failed, the others are written.
+    `flush()` waits until everything queued so far is written or dead-lettered. On `close()`, the memories
+    still unwritten are spilled to `spill_path` and queued again by the next writer (e.g. after a restart);
+    they only count as failed if that fails too.
+    """
+
+    def __init__(self, vector_store, batch_size: int = 64, max_wait_ms: float = 200, max_backoff_s: float = 30,
+                 max_attempts: int = 5, spill_path: str = None, dead_letter_path: str = None):
+        """
+        Args:
+            vector_store: The vector store (PineconeVectorStore or LocalVectorStore).
+            batch_size (int): The maximum number of memories per batch, 100 vectors per upsert suits Pinecone.
+            max_wait_ms (float): How long the first write of a batch waits for others.
+            max_backoff_s (float): The longest wait between two attempts of a failed batch.
+            max_attempts (int): Attempts of a batch failing with non-transient errors before it is split.
+            spill_path (str, optional): JSONL file keeping the memories unwritten on close. Dropped when None.
+            dead_letter_path (str, optional): JSONL file keeping the memories that cannot be written. Dropped
+                when None.
+        """
+        self.vector_store = vector_store
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_backoff_s = max_backoff_s
+        self.max_attempts = max(1, max_attempts)
+        self.spill_path = spill_path
+        self.dead_letter_path = dead_letter_path
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        # The batch being collected or written, out of the queue but not written yet
+        self._inflight = []
+        self._unwritten = 0
+        self._replayed = False
+
+    def _ensure_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._worker is not None and not self._worker.done():
+            return
+        self._loop = loop
+        fresh_queue = self._queue is None or self._queue.empty()
+        if fresh_queue:
+            self._queue = asyncio.Queue()
+        if not self._replayed:
+            self._replayed = True
+            self._replay_spill()
+        # A worker that stopped leaves its batch behind, it is queued again
+        for entry in self._inflight:
+            self._queue.put_nowait(entry)
+            if not fresh_queue:
+                # Already counted by this queue when it was first put
+                self._queue.task_done()
+        self._inflight = []
+        # Start the worker in an empty context so it does not inherit the labels of the first request
+        self._worker = contextvars.Context().run(loop.create_task, self._run())
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def enqueue(self, namespace: str, text: str, metadata: dict, id: str = None) -> str:
+        """
+        Queues a memory for writing.
+
+        Args:
+            namespace (str): The namespace (user id).
+            text (str): The memory text.
+            metadata (dict): Its metadata, e.g. session_id and created_at.
+            id (str, optional): The memory id, the content hash by default.
+
+        Returns:
+            str: The memory id.
+        """
+        self._ensure_worker()
+        id = id or memory_id(namespace, metadata.get("session_id", ""), text)
+        self._unwritten += 1
+        await self._queue.put((namespace, text, metadata, id, time.perf_counter()))
+        LTM_WRITE_QUEUE_DEPTH.set(self._queue.qsize())
+        return id
+
+    async def flush(self, timeout: float = None) -> None:
+        """
+        Waits until every queued memory has been written (or dead-lettered).
+
+        Raises:
+            RuntimeError: When the writer task stopped with memories still unwritten.
+            asyncio.TimeoutError: When they are not written within `timeout` seconds (e.g. the vector store is down).
+        """
+        if not self._unwritten:
+            return
+        worker = self._worker
+        if worker is None or worker.done():
+            raise RuntimeError(f"The long-term memory writer is not running, "
+                               f"{self._unwritten} memories are unwritten") from self._worker_error(worker)
+        joined = asyncio.ensure_future(self._queue.join())
+        try:
+            done, _ = await asyncio.wait({joined, worker}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            joined.cancel()
+        if joined in done:
+            return
+        if worker in done:
+            raise RuntimeError(f"The long-term memory writer stopped, "
+                               f"{self._unwritten} memories are unwritten") from self._worker_error(worker)
+        raise asyncio.TimeoutError(f"{self._unwritten} long-term memories still unwritten after {timeout} s")
+
+    @staticmethod
+    def _worker_error(worker):
+        return worker.exception() if worker is not None and worker.done() and not worker.cancelled() else None
+
+    async def close(self, timeout: float = None) -> None:
+        """
+        Waits up to `timeout` seconds for the queued memories, stops the writer and spills the unwritten ones.
+        """
+        try:
+            await self.flush(timeout)
+        except (RuntimeError, asyncio.TimeoutError) as e:
+            logging.error(f"Long-term memory writer did not finish: {e}")
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except BaseException:
+                pass
+            self._worker = None
+        entries = self._inflight
+        self._inflight = []
+        while self._queue is not None and not self._queue.empty():
+            entries.append(self._queue.get_nowait())
+            self._queue.task_done()
+        self._unwritten = 0
+        self._spill(entries)
+
+    ############################################################################################################
+
+    @staticmethod
+    def _append(path: str, entries: list, error: Exception = None) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a", encoding="utf-8") as file:
+            for namespace, text, metadata, id, _ in entries:
+                record = {"namespace": namespace, "text": text, "metadata": metadata, "id": id}
+                if error is not None:
+                    record["error"] = repr(error)
+                file.write(json.dumps(record) + "\n")
+
+    def _spill(self, entries: list) -> None:
+        if not entries:
+            return
+        if self.spill_path:
+            try:
+                self._append(self.spill_path, entries)
+                logging.warning(f"Spilled {len(entries)} unwritten long-term memories to {self.spill_path}")
+                LTM_WRITES.inc(len(entries), result="spilled")
+                return
+            except (OSError, TypeError, ValueError) as e:
+                logging.error(f"Could not spill long-term memories to {self.spill_path}: {e}")
+        logging.error(f"Dropping {len(entries)} unwritten long-term memories")
+        LTM_WRITES.inc(len(entries), result="failed")
+
+    def _dead_letter(self, entries: list, error: Exception) -> None:
+        LTM_WRITES.inc(len(entries), result="failed")
+        if self.dead_letter_path:
+            try:
+                self._append(self.dead_letter_path, entries, error)
+                logging.error(f"Could not write {len(entries)} long-term memories, kept in "
+                              f"{self.dead_letter_path}: {error}")
+                return
+            except (OSError, TypeError, ValueError) as e:
+                logging.error(f"Could not keep long-term memories in {self.dead_letter_path}: {e}")
+        logging.error(f"Dropping {len(entries)} long-term memories that cannot be written: {error}")
+
+    def _replay_spill(self) -> None:
+        """
+        Queues the memories spilled by a previous writer.
+        """
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        try:
+            with open(self.spill_path, "r", encoding="utf-8") as file:
+                spilled = [json.loads(line) for line in file if line.strip()]
+            os.remove(self.spill_path)
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not read the spilled long-term memories from {self.spill_path}: {e}")
+            return
+        for entry in spilled:
+            self._unwritten += 1
+            self._queue.put_nowait((entry["namespace"], entry["text"], entry["metadata"], entry["id"], time.perf_counter()))
+        logging.info(f"Queued {len(spilled)} long-term memories spilled by a previous run")
+
+    async def _collect(self, batch: list) -> None:
+        batch.append(await self._queue.get())
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _run(self) -> None:
+        while True:
+            await self._collect(self._inflight)
+            LTM_WRITE_QUEUE_DEPTH.set(self._queue.qsize())
+            await self._write_until_done(self._inflight)
+            count = len(self._inflight)
+            self._inflight = []
+            self._unwritten -= count
+            for _ in range(count):
+                self._queue.task_done()
+
+    async def _write_until_done(self, batch: list) -> None:
+        # The same memory queued twice in a batch is written once
+        unique = OrderedDict()
+        for entry in batch:
+            unique[(entry[0], entry[3])] = entry
+        if len(unique) < len(batch):
+            LTM_WRITES.inc(len(batch) - len(unique), result="duplicate")
+        await self._write_isolating(list(unique.values()))
+
+    async def _write_isolating(self, entries: list) -> None:
+        """
+        Writes the entries, retrying while the errors are transient. After `max_attempts` other errors the
+        entries are written in two halves, a single entry is dead-lettered.
+        """
+        attempt = 0
+        failures = 0
+        while True:
+            attempt += 1
+            try:
+                await self._write(entries)
+                break
+            except Exception as e:
+                if not _is_transient(e):
+                    failures += 1
+                    if failures >= self.max_attempts:
+                        if len(entries) == 1:
+                            self._dead_letter(entries, e)
+                            return
+                        logging.warning(f"Writing {len(entries)} long-term memories failed {failures} times, "
+                                        f"writing them in halves: {e}")
+                        middle = len(entries) // 2
+                        await self._write_isolating(entries[:middle])
+                        await self._write_isolating(entries[middle:])
+                        return
+                delay = min(0.5 * 2 ** (attempt - 1), self.max_backoff_s)
+                logging.warning(f"Writing {len(entries)} long-term memories failed (attempt {attempt}), "
+                                f"retrying in {delay:.1f} s: {e}")
+                await asyncio.sleep(delay)
+
+        now = time.perf_counter()
+        for entry in entries:
+            LTM_WRITE_LAG_SECONDS.observe(now - entry[4])
+        LTM_WRITES.inc(len(entries), result="written")
+
+    async def _write(self, entries: list) -> None:
+        LTM_WRITE_BATCH_SIZE.observe(len(entries))
+        with STAGE_SECONDS.time(stage="ltm_write"):
+            await self._upsert(entries)
+
+    async def _upsert(self, entries: list) -> None:
+        embeddings = self.vector_store.embeddings
+        if isinstance(embeddings, CachedBatchedEmbeddings):
+            # One forward pass for the whole batch, the per-namespace upserts then hit the embedding cache
+            await embeddings.aembed_documents([text for _, text, _, _, _ in entries])
+
+        by_namespace = OrderedDict()
+        for namespace, text, metadata, id, _ in entries:
+            by_namespace.setdefault(namespace, []).append((text, metadata, id))
+        for namespace, memories in by_namespace.items():
+            await self.vector_store.aadd_texts(
+                texts=[text for text, _, _ in memories],
+                metadatas=[metadata for _, metadata, _ in memories],
+                ids=[id for _, _, id in memories],
+                namespace=namespace,
+                batch_size=self.batch_size,
+            )
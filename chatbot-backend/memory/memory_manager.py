@@ -1,16 +1,112 @@
-import uuid
+import os
+import time
+import asyncio
 import logging
-from typing import List, Union
+from functools import partial
+from typing import List, Tuple, Union
 from langchain_core.messages import AIMessage, HumanMessage
 from langgraph.graph import MessagesState
-from memory.pinecone_utils import initialize_pinecone, setup_vector_store, get_retriever
+from memory.pinecone_utils import initialize_pinecone, setup_vector_store, fetch_namespace, count_namespace
+from memory.embedding_service import create_embeddings
+from memory.hot_memory_tier import HotMemoryTier
+from memory.ltm_writer import LTMWriter, memory_id
+from memory.retrieval_guard import RetrievalGuard, CircuitOpenError
+from memory.retrieval_gate import RetrievalGate
 from model.summarizer import Summarizer
-pc = initialize_pinecone()
+from utils.metrics import STAGE_SECONDS, Counter
+from utils.executors import run_in_pool
+import threading
+import numpy as np
+
+
+def _unit(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+MEMORY_PREFETCH = Counter(
+    "sage_memory_prefetch_total",
+    "Use of the memories prefetched for the next turn (reused, merged, miss, pending).",
+    labelnames=("result",),
+)
 
 
 class MemoryManager:
     vector_store = None
+    hot_tier = None
+    ltm_writer = None
+    retrieval_guard = None
+    retrieval_gate = None
     summarizer = None
+    _init_lock = threading.Lock()
+    _background_probes = set()
+    prefetch_stats = {"reused": 0, "merged": 0, "miss": 0, "pending": 0}
+    # Memories prefetched for the next turn, as a multiple of max_results (see _use_prefetched)
+    PREFETCH_CANDIDATES = int(os.environ.get("PREFETCH_CANDIDATES", 4))
+    PREFETCH_TTL_S = float(os.environ.get("PREFETCH_TTL_S", 600))
+    # Longest wait for the queued memories before clearing a user's memories or shutting down
+    LTM_FLUSH_TIMEOUT_S = float(os.environ.get("LTM_WRITE_FLUSH_TIMEOUT_S", 30))
+    
+    @classmethod
+    def get_vector_store(cls, index_name, embedding_model, embedding_dim):
+        """
+        Lazily create the vector store shared by all sessions.
+
+        VECTOR_STORE_BACKEND selects "pinecone" (default) or "local" (LocalVectorStore on disk, under
+        LOCAL_VECTOR_STORE_PATH, searched with LOCAL_VECTOR_SEARCH = exact, ivf or auto).
+
+        With a serverless Pinecone index, HOT_MEMORY_TIER (false) keeps the recent memories of active users
+        in process, sized with HOT_MEMORY_MAX_PER_USER (1000), HOT_MEMORY_MAX_MB (256) and HOT_MEMORY_TTL_S
+        (300). Pod indexes cannot list a namespace's ids, which the tier needs to load a user.
+
+        Memories are written by the global LTMWriter, batched with LTM_WRITE_BATCH_SIZE (64) and
+        LTM_WRITE_WAIT_MS (200), retried with a backoff up to LTM_WRITE_MAX_BACKOFF_S (30) and spilled to
+        LTM_WRITE_SPILL_PATH when still unwritten at shutdown. Memories failing LTM_WRITE_MAX_ATTEMPTS (5)
+        times on their own are kept in LTM_WRITE_DEAD_LETTER_PATH instead. Retrieval is bounded by the RetrievalGuard and skipped by the RetrievalGate
+        when it cannot help (see RETRIEVAL_* variables).
+        """
+        if cls.vector_store is None:
+            with cls._init_lock:
+                if cls.vector_store is None:
+                    backend = os.environ.get("VECTOR_STORE_BACKEND", "pinecone").lower()
+                    if backend == "local":
+                        from memory.local_vector_store import LocalVectorStore
+                        cls.vector_store = LocalVectorStore(
+                            path=os.environ.get("LOCAL_VECTOR_STORE_PATH", os.path.join("data", "vectors")),
+                            embedding=create_embeddings(embedding_model),
+                            dim=embedding_dim,
+                            search_mode=os.environ.get("LOCAL_VECTOR_SEARCH", "auto").lower(),
+                        )
+                        logging.info(f"Local vector store initialized in '{cls.vector_store.path}'.")
+                    elif backend == "pinecone":
+                        pc = initialize_pinecone()
+                        cls.vector_store = setup_vector_store(pc=pc, 
+                                                              index_name=index_name, 
+                                                              embed_model=embedding_model, 
+                                                              embed_dim=embedding_dim)
+                    else:
+                        raise ValueError(f"Unknown vector store backend '{backend}', expected 'pinecone' or 'local'")
+                    cls.retrieval_guard = RetrievalGuard.from_env()
+                    cls.retrieval_gate = RetrievalGate.from_env()
+                    cls.ltm_writer = LTMWriter(
+                        cls.vector_store,
+                        batch_size=int(os.environ.get("LTM_WRITE_BATCH_SIZE", 64)),
+                        max_wait_ms=float(os.environ.get("LTM_WRITE_WAIT_MS", 200)),
+                        max_backoff_s=float(os.environ.get("LTM_WRITE_MAX_BACKOFF_S", 30)),
+                        max_attempts=int(os.environ.get("LTM_WRITE_MAX_ATTEMPTS", 5)),
+                        spill_path=os.environ.get("LTM_WRITE_SPILL_PATH", os.path.join("data", "ltm_pending.jsonl")),
+                        dead_letter_path=os.environ.get("LTM_WRITE_DEAD_LETTER_PATH",
+                                                        os.path.join("data", "ltm_failed.jsonl")),
+                    )
+                    if backend == "pinecone" and os.environ.get("HOT_MEMORY_TIER", "false").lower() == "true":
+                        cls.hot_tier = HotMemoryTier(
+                            loader=partial(fetch_namespace, cls.vector_store),
+                            dim=embedding_dim,
+                            max_per_user=int(os.environ.get("HOT_MEMORY_MAX_PER_USER", 1000)),
+                            max_megabytes=float(os.environ.get("HOT_MEMORY_MAX_MB", 256)),
+                            ttl_s=float(os.environ.get("HOT_MEMORY_TTL_S", 300)),
+                        )
+        return cls.vector_store
     
     def __init__(self, model, user_id: str, thread_id: str, index_name , embedding_model , embedding_dim , max_results, score_threshold, stm_limit: int = 7):
         """
@@ -18,34 +114,104 @@ class MemoryManager:
 
         Args:
             vector_store: The vector store instance for long-term memory.
-            retriever: The retriever instance for memory retrieval.
             summarizer: A callable summarizer instance.
             user_id (str): The unique identifier for the user.
             thread_id (str): The current thread or session ID.
+            max_results (int): The maximum number of memories retrieved per query.
+            score_threshold (float): The minimum relevance score of a retrieved memory.
             stm_limit (int): The maximum number of messages to retain in short-term memory.
         """
-        if not MemoryManager.vector_store:
-            MemoryManager.vector_store = setup_vector_store(pc=pc, 
-                                                            index_name=index_name, 
-                                                            embed_model=embedding_model, 
-                                                            embed_dim=embedding_dim)
+        MemoryManager.get_vector_store(index_name, embedding_model, embedding_dim)
         #if not MemoryManager.summarizer:
         #    MemoryManager.summarizer = Summarizer(model= model)
                 
-        self.retriever = get_retriever(MemoryManager.vector_store, max_results=max_results, score_threshold=score_threshold, namespace=str(user_id))    
         self.user_id = user_id
         self.thread_id = thread_id
         self.stm_limit = stm_limit
+        self.max_results = max_results
+        self.score_threshold = score_threshold
         self.is_saved_in_pinecone = False
+        # Index (in the STM message list) up to which messages have been saved to LTM
+        self.ltm_saved_upto = None
+        self._transfer_lock = asyncio.Lock()
+        # (query embedding, memories, time) retrieved for the next turn, see prefetch_next_context
+        self._prefetched = None
+        self._prefetch_running = False
+        if MemoryManager.hot_tier is not None:
+            # Load the user's recent memories while the session starts
+            MemoryManager.hot_tier.prefetch(str(user_id))
+        self._start_memory_count_probe()
         
 
+    @property
+    def session_key(self) -> Tuple[str, str]:
+        return str(self.user_id), self.thread_id
+
+
+    def _start_memory_count_probe(self) -> None:
+        """
+        Counts the stored memories of the session in the background, so the retrieval gate knows
+        when there is nothing to retrieve.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        task = asyncio.create_task(self._probe_memory_count())
+        MemoryManager._background_probes.add(task)
+        task.add_done_callback(MemoryManager._background_probes.discard)
+
+
+    async def _probe_memory_count(self) -> None:
+        try:
+            count = None
+            if MemoryManager.hot_tier is not None:
+                await MemoryManager.hot_tier.ensure_loaded(str(self.user_id))
+                count = MemoryManager.hot_tier.count(str(self.user_id), session_id=self.thread_id)
+            if count is None:
+                count = await run_in_pool("vector-store", self._count_stored_memories)
+            if count is not None:
+                MemoryManager.retrieval_gate.set_count(self.session_key, count)
+        except Exception as e:
+            logging.warning(f"Could not count the memories of user {self.user_id}: {e}")
+
+
+    def _count_stored_memories(self):
+        vector_store = MemoryManager.vector_store
+        if hasattr(vector_store, "count"):
+            return vector_store.count(namespace=str(self.user_id), filter={"session_id": self.thread_id})
+        # Pinecone only reports the namespace total, which settles the case of a user without memories
+        return 0 if count_namespace(vector_store, str(self.user_id)) == 0 else None
+
+
+    @classmethod
+    async def flush_pending_writes(cls, timeout: float = None) -> None:
+        """
+        Waits until every memory queued by the sessions has been written to the vector store.
+
+        Raises:
+            RuntimeError: When the writer stopped with memories unwritten.
+            asyncio.TimeoutError: When they are not written within `timeout` seconds.
+        """
+        if cls.ltm_writer is not None:
+            await cls.ltm_writer.flush(timeout)
+
+    @classmethod
+    async def close_pending_writes(cls, timeout: float = None) -> None:
+        """
+        Stops the writer on shutdown, the memories not written within `timeout` seconds are spilled to disk.
+        """
+        if cls.ltm_writer is not None:
+            await cls.ltm_writer.close(timeout)
+
     async def save_to_ltm(self, messages: List[AIMessage | HumanMessage]) -> None:
         """
         Save a list of Human and AI messages to Pinecone as long-term memory (LTM).
 
         This function combines all the provided messages into a single string, with each message
-        prefixed by its type ("Human" for `HumanMessage` and "AI" for `AIMessage`), and stores the
-        resulting string in Pinecone under the specified namespace and thread ID.
+        prefixed by its type ("Human" for `HumanMessage` and "AI" for `AIMessage`), and queues the
+        resulting string for the background writer under the specified namespace and thread ID.
+        The id is a hash of the content, so saving the same exchange again does not duplicate it.
 
         Args:
             messages (List[Union[AIMessage, HumanMessage]]): 
@@ -69,13 +235,12 @@ class MemoryManager:
                 return
             
             combined_text = "\n".join(combined_messages)
+            metadata = {'session_id': self.thread_id, 'created_at': time.time()}
+            id = memory_id(str(self.user_id), self.thread_id, combined_text)
 
-            await MemoryManager.vector_store.aadd_texts(
-                texts=[combined_text],
-                namespace=str(self.user_id),
-                metadatas=[{'session_id': self.thread_id}],
-                ids=[str(uuid.uuid4())],
-            )
+            await self._add_to_hot_tier(combined_text, id, metadata)
+            await MemoryManager.ltm_writer.enqueue(str(self.user_id), combined_text, metadata, id)
+            MemoryManager.retrieval_gate.add(self.session_key)
             self.is_saved_in_pinecone = True
             #logging.info("Messages saved to long-term memory.")
         
@@ -83,6 +248,34 @@ class MemoryManager:
             logging.error(f"Error saving messages to LTM: {e}")
             raise RuntimeError("Failed to save messages to long-term memory.")
 
+
+    async def _add_to_hot_tier(self, text: str, id: str, metadata: dict) -> None:
+        """
+        Makes the memory searchable in the hot tier right away, before the writer stores it.
+        """
+        tier = MemoryManager.hot_tier
+        if tier is None or tier.get(str(self.user_id)) is None:
+            return
+        [vector] = await MemoryManager.vector_store.embeddings.aembed_documents([text])
+        tier.add(str(self.user_id), id, vector, text, metadata)
+
+
+    async def _search_hot_tier(self, query: str, k: int, score_threshold: float):
+        """
+        Searches the hot tier. Returns None when the user is not held, otherwise the results and whether
+        they answer the query alone (every memory of the user is held). Enough matches among a partial
+        copy do not make it authoritative: an older memory in the remote store may score higher.
+        """
+        tier = MemoryManager.hot_tier
+        user_id = str(self.user_id)
+        if tier is None:
+            return None
+        if tier.get(user_id) is None:
+            tier.prefetch(user_id)
+            return None
+        vector = await MemoryManager.vector_store.embeddings.aembed_query(query)
+        return tier.search(user_id, vector, k, session_id=self.thread_id, score_threshold=score_threshold)
+
     
     async def retrieve_relevant_context(self, query: str) -> List[str]:
         """
@@ -94,15 +287,195 @@ class MemoryManager:
         Returns:
             List[str]: A list of relevant memories.
         """
+        return [memory for memory, _ in await self.retrieve_scored_context(query)]
+
+    
+    async def retrieve_scored_context(self, query: str) -> List[Tuple[str, float]]:
+        """
+        Retrieve relevant long-term memory for the given query together with the relevance scores.
+
+        The lookup is skipped when the session has no memories or the query is trivial (see RetrievalGate).
+        The retrieval has a deadline: when it expires the turn goes on without memories, and what the
+        retrieval finds later is added to the next turn of the session.
+
+        Args:
+            query (str): The query string to search for.
+
+        Returns:
+            List[Tuple[str, float]]: The relevant memories and their scores, best first.
+        """
         try:
-            docs = await self.retriever.ainvoke(query, filter={"session_id": self.thread_id})
-            results = [doc.page_content for doc in docs]
-            #logging.info(f"Retrieved {len(results)} relevant memories for query: {query}")
+            if MemoryManager.retrieval_gate.decide(self.session_key, query) != "retrieve":
+                return []
+            if MemoryManager.retrieval_gate.needs_probe(self.session_key):
+                self._start_memory_count_probe()
+            start_time = time.perf_counter()
+            with STAGE_SECONDS.time(stage="ltm_retrieval"):
+                results = await MemoryManager.retrieval_guard.run(
+                    self.session_key,
+                    lambda: self._retrieve_with_prefetch(query),
+                    self.max_results,
+                )
+            MemoryManager.retrieval_gate.observe_latency(time.perf_counter() - start_time)
             return results
         except Exception as e:
             logging.error(f"Error retrieving context: {e}")
             return []
 
+
+    async def _retrieve_with_prefetch(self, query: str) -> List[Tuple[str, float]]:
+        """
+        Answers from the prefetched memories when they provably hold the best matches of the query,
+        otherwise retrieves and merges them into the results.
+        """
+        prefetched, use = await self._use_prefetched(query)
+        if use == "reused":
+            return prefetched
+        results = await self._retrieve(query)
+        if use == "merged":
+            merged = dict(results)
+            for memory, score in prefetched:
+                merged[memory] = max(score, merged.get(memory, 0))
+            results = sorted(merged.items(), key=lambda item: item[1], reverse=True)[:self.max_results]
+        return results
+
+
+    async def prefetch_next_context(self, user_input: str, reply: str) -> None:
+        """
+        Retrieves the memories related to the exchange that just finished, the likely context of the next
+        turn, while the session waits for the user. The next turn re-scores them against its own query.
+
+        Args:
+            user_input (str): The user's message of the finished turn.
+            reply (str): The reply to it.
+        """
+        if MemoryManager.retrieval_gate.get_count(self.session_key) == 0 or MemoryManager.retrieval_guard.circuit_open:
+            return
+        self._prefetch_running = True
+        try:
+            # Same format as the stored memories
+            query = f"Human: {user_input}\nAI: {reply}"
+            embeddings = MemoryManager.vector_store.embeddings
+            vector = await embeddings.aembed_query(query)
+            # A wider pool than a turn needs, without score threshold: the next query ranks it differently
+            limit = self.max_results * MemoryManager.PREFETCH_CANDIDATES
+            memories = await self._retrieve(query, k=limit, score_threshold=0.0, background=True)
+            texts = [memory for memory, _ in memories]
+            # The memories are stored as document embeddings, mostly served by the embedding cache
+            vectors = await embeddings.aembed_documents(texts) if texts else []
+            self._prefetched = (_unit(vector), texts, _unit(vectors) if texts else np.empty((0, len(vector))),
+                                len(texts) < limit, time.monotonic())
+        except Exception as e:
+            logging.warning(f"Memory prefetch failed for user {self.user_id}: {e}")
+        finally:
+            self._prefetch_running = False
+
+
+    async def _use_prefetched(self, query: str):
+        """
+        Re-scores the prefetched memories against the query.
+
+        The pool holds the `limit` memories closest to the prefetch query p (or every memory of the session
+        when it returned fewer), so a memory m outside it has cos(p, m) <= c_min, the lowest cosine in the
+        pool. With the angle between the query q and p, the triangle inequality on angles bounds cos(q, m)
+        from above. When that bound does not exceed the k-th re-scored memory (or the score threshold),
+        no memory outside the pool can enter the results and they are reused, with no tuned similarity.
+
+        Returns:
+            tuple: The re-scored memories and how to use them ("reused", "merged"), or ([], None).
+        """
+        prefetched, self._prefetched = self._prefetched, None
+        if prefetched is None or time.monotonic() - prefetched[4] > MemoryManager.PREFETCH_TTL_S:
+            if self._prefetch_running:
+                self._record_prefetch("pending")
+            return [], None
+        prefetch_vector, texts, vectors, exhaustive, _ = prefetched
+        vector = _unit(await MemoryManager.vector_store.embeddings.aembed_query(query))
+
+        cosines = vectors @ vector
+        order = np.argsort(-cosines)[:self.max_results]
+        # Relevance scores are (cosine + 1) / 2, like the vector stores report them
+        threshold_cosine = 2 * self.score_threshold - 1
+        results = [(texts[i], float(cosines[i] + 1) / 2) for i in order if cosines[i] >= threshold_cosine]
+        if exhaustive:
+            bound = -1.0
+        else:
+            pool_angle = np.arccos(np.clip(np.min(vectors @ prefetch_vector), -1, 1))
+            query_angle = np.arccos(np.clip(vector @ prefetch_vector, -1, 1))
+            bound = float(np.cos(max(pool_angle - query_angle, 0.0)))
+        needed = float(cosines[order[-1]]) if len(results) == self.max_results else threshold_cosine
+        if bound <= needed:
+            use = "reused"
+        elif results:
+            use = "merged"
+        else:
+            self._record_prefetch("miss")
+            return [], None
+        self._record_prefetch(use)
+        return results, use
+
+
+    @classmethod
+    def _record_prefetch(cls, result: str) -> None:
+        cls.prefetch_stats[result] += 1
+        MEMORY_PREFETCH.inc(result=result)
+
+
+    @classmethod
+    def get_prefetch_stats(cls) -> dict:
+        used = cls.prefetch_stats["reused"] + cls.prefetch_stats["merged"]
+        attempts = used + cls.prefetch_stats["miss"] + cls.prefetch_stats["pending"]
+        return {**cls.prefetch_stats, "hit_rate": used / attempts if attempts else 0.0}
+
+
+    async def _retrieve(self, query: str, k: int = None, score_threshold: float = None,
+                        background: bool = False) -> List[Tuple[str, float]]:
+        """
+        Searches the hot tier, then the vector store (through the circuit breaker) when needed.
+
+        Args:
+            query (str): The query.
+            k (int, optional): The number of results, `max_results` by default.
+            score_threshold (float, optional): The minimum relevance score, `score_threshold` by default.
+            background (bool): For prefetching: the query is not counted in the hot tier and circuit breaker
+                statistics (which describe the turns), and failures are raised instead of answered from the
+                hot tier alone.
+        """
+        k = k or self.max_results
+        if score_threshold is None:
+            score_threshold = self.score_threshold
+        hot = await self._search_hot_tier(query, k, score_threshold)
+        if hot is not None and hot[1]:
+            if not background:
+                MemoryManager.hot_tier.record("hit")
+            return hot[0]
+        search = lambda: MemoryManager.vector_store.asimilarity_search_with_relevance_scores(
+            query,
+            k=k,
+            score_threshold=score_threshold,
+            namespace=str(self.user_id),
+            filter={"session_id": self.thread_id},
+        )
+        if background:
+            docs_and_scores = await search()
+        else:
+            try:
+                docs_and_scores = await MemoryManager.retrieval_guard.call(search)
+            except CircuitOpenError:
+                # The vector store is unhealthy: answer from the hot tier alone
+                return hot[0] if hot is not None else []
+        results = [(doc.page_content, score) for doc, score in docs_and_scores]
+        if MemoryManager.hot_tier is not None and not background:
+            MemoryManager.hot_tier.record("fallback" if hot is None else "partial")
+        if hot is not None:
+            # Older memories come from the remote store, recent ones may not have reached it yet
+            merged = dict(results)
+            for memory, score in hot[0]:
+                merged[memory] = max(score, merged.get(memory, 0))
+            results = sorted(merged.items(), key=lambda item: item[1], reverse=True)[:k]
+        #logging.info(f"Retrieved {len(results)} relevant memories for query: {query}")
+        return results
+
     
     async def clear_long_term_memory(self) -> None:
         """
@@ -112,6 +485,11 @@ class MemoryManager:
             None
         """
         try:
+            if MemoryManager.hot_tier is not None:
+                MemoryManager.hot_tier.drop(str(self.user_id))
+            MemoryManager.retrieval_gate.reset_user(str(self.user_id))
+            # A queued write must not land after the deletion
+            await MemoryManager.flush_pending_writes(timeout=MemoryManager.LTM_FLUSH_TIMEOUT_S)
             if self.is_saved_in_pinecone:
                 await MemoryManager.vector_store.adelete(delete_all=True, namespace=self.user_id)
                 self.is_saved_in_pinecone = False
@@ -139,24 +517,39 @@ class MemoryManager:
         Notes:
             - The `stm_limit` attribute defines the maximum number of messages to retain in STM.
             - Messages that exceed the limit are saved to long-term memory (LTM) using `save_to_LTM`.
+            - Progress is tracked in `ltm_saved_upto`, so exchanges skipped by a cancelled
+              transfer are saved by the next one.
 
         """
         try:
-            ## Total number of messages in the current state
-            total_messages = len(state["messages"])
-            logging.info(f"Total messages: {total_messages}")
-            
-            # Check if the total exceeds the short-term memory limit
-            if total_messages > self.stm_limit:
-                excess_messages_end = total_messages - self.stm_limit
-                messages_to_save = state["messages"][excess_messages_end - 2 : excess_messages_end]
-                
-                logging.info(f"Messages to save to long-term memory: {messages_to_save}")
+            async with self._transfer_lock:
+                ## Total number of messages in the current state
+                total_messages = len(state["messages"])
+                logging.info(f"Total messages: {total_messages}")
                 
-                await self.save_to_ltm(messages=messages_to_save)
-                logging.info(f"Successfully saved {len(messages_to_save)} messages to long-term memory.")
+                # Check if the total exceeds the short-term memory limit
+                if total_messages > self.stm_limit:
+                    excess_messages_end = total_messages - self.stm_limit
+                    if self.ltm_saved_upto is None or self.ltm_saved_upto > excess_messages_end:
+                        # Unknown progress (new session): assume everything before the last exchange is saved
+                        self.ltm_saved_upto = max(excess_messages_end - 2, 0)
+                    
+                    # Save one exchange (Human + AI) at a time
+                    for start in range(self.ltm_saved_upto, excess_messages_end, 2):
+                        messages_to_save = state["messages"][start : min(start + 2, excess_messages_end)]
+                        logging.info(f"Messages to save to long-term memory: {messages_to_save}")
+                        
+                        await self.save_to_ltm(messages=messages_to_save)
+                        self.ltm_saved_upto = start + len(messages_to_save)
+                        logging.info(f"Successfully saved {len(messages_to_save)} messages to long-term memory.")
                 
         except Exception as e:
             logging.error(f"Error occurred while managing memory: {e}")
-            raise       
-    
+            raise
+
+
+    def reset_ltm_progress(self) -> None:
+        """
+        Forget the LTM transfer progress, e.g. after the short-term memory has been cleared.
+        """
+        self.ltm_saved_upto = None
@@ -2,7 +2,7 @@
 
 from pinecone import Pinecone, ServerlessSpec
 from langchain_pinecone import PineconeVectorStore
-from langchain_huggingface import HuggingFaceEmbeddings
+from memory.embedding_service import create_embeddings
 from dotenv import load_dotenv
 import logging
 import os
@@ -81,8 +81,8 @@ def setup_vector_store(pc: Pinecone, index_name="chatbot-memory", embed_model="i
     """
     index = get_pinocone_index(pc=pc, index_name=index_name, dimension=embed_dim)
     
-    ## Set up the embeddings
-    embeddings = HuggingFaceEmbeddings(model_name=embed_model)
+    ## Set up the embeddings (cached and batched across requests, see EMBEDDING_SERVICE)
+    embeddings = create_embeddings(embed_model)
     
     ## Create the vector store
     vector_store = PineconeVectorStore(index, embeddings)
@@ -103,4 +103,56 @@ def get_retriever(vector_store, max_results , score_threshold, namespace):
                 "namespace": namespace
             }
         ) 
-        return retriever
\ No newline at end of file
+        return retriever
+
+####################################################################################################
+
+def fetch_namespace(vector_store: PineconeVectorStore, namespace: str, max_ids: int = 10_000, batch_size: int = 100,
+                    known_rows: dict = None):
+    """
+    Fetches the stored memories of a namespace, e.g. to load them into the hot memory tier.
+    Listing the ids of a namespace is only supported by serverless indexes.
+
+    Args:
+        vector_store (PineconeVectorStore): The vector store.
+        namespace (str): The namespace (user id).
+        max_ids (int): The maximum number of memories fetched.
+        batch_size (int): Ids per fetch request.
+        known_rows (dict, optional): Rows already held by the caller by id, only the other ids are fetched.
+
+    Returns:
+        tuple: The (id, vector, text, metadata) rows and whether every memory of the namespace was read.
+    """
+    index = vector_store._index
+    text_key = getattr(vector_store, "_text_key", "text")
+    ids, exhausted = [], True
+    for page in index.list(namespace=namespace):
+        ids.extend(page)
+        if len(ids) >= max_ids:
+            # There may be more, the caller treats the rows as a partial copy
+            exhausted = False
+            break
+    ids = ids[:max_ids]
+
+    known_rows = known_rows or {}
+    # Memories are never updated in place (ids are content hashes), a known row is still current
+    rows = [known_rows[id] for id in ids if id in known_rows]
+    ids = [id for id in ids if id not in known_rows]
+    for start in range(0, len(ids), batch_size):
+        response = index.fetch(ids=ids[start:start + batch_size], namespace=namespace)
+        for id, vector in response.vectors.items():
+            metadata = dict(vector.metadata or {})
+            text = metadata.pop(text_key, "")
+            rows.append((id, vector.values, text, metadata))
+    return rows, exhausted
+
+
+####################################################################################################
+
+def count_namespace(vector_store: PineconeVectorStore, namespace: str) -> int:
+    """
+    Returns the number of vectors stored in a namespace, from the index statistics.
+    """
+    stats = vector_store._index.describe_index_stats()
+    namespace_stats = stats.namespaces.get(namespace)
+    return namespace_stats.vector_count if namespace_stats is not None else 0
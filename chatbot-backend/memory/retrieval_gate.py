@@ -0,0 +1,177 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+from utils.metrics import Counter
+
+RETRIEVAL_GATE_DECISIONS = Counter(
+    "sage_memory_retrieval_gate_total",
+    "Long-term memory retrieval gate decisions (retrieve, no_memories, trivial_input).",
+    labelnames=("decision",),
+)
+RETRIEVAL_GATE_SECONDS_SAVED = Counter(
+    "sage_memory_retrieval_seconds_saved_total",
+    "Estimated retrieval time saved by skipped lookups, in seconds.",
+)
+
+## Inputs made only of these words carry nothing to search memories for (greetings, acknowledgements, fillers)
+TRIVIAL_WORDS = {
+    "hi", "hello", "hey", "yo", "hiya", "ok", "okay", "k", "kk", "thanks", "thank", "you", "thx", "ty", "yes",
+    "yeah", "yep", "yup", "no", "nope", "nah", "sure", "bye", "goodbye", "good", "morning", "night", "evening",
+    "afternoon", "lol", "haha", "hmm", "hm", "uh", "um", "oh", "ah", "cool", "great", "nice", "fine", "alright",
+    "right", "see", "i", "a", "lot", "so", "much", "too", "wow", "and", "got", "it", "me", "again", "there",
+}
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+class RetrievalGate:
+    """
+    Decides whether a turn's long-term memory lookup can return anything useful, so the embedding and the
+    vector store query are skipped when it cannot:
+
+    - "no_memories": the session is known to have no stored memories. Counts come from a probe when the
+      session starts (hot tier, local store or Pinecone namespace stats) and from the memories saved since.
+      An unknown count never skips. A zero count expires after `zero_ttl_s` (another worker may have saved
+      memories since), the session is then probed again.
+    - "trivial_input": the input is too short or only made of greetings and fillers (the heuristic of the
+      original ChatBot class, extended).
+    """
+
+    def __init__(self, enabled: bool = True, min_chars: int = 5, max_sessions: int = 100_000,
+                 zero_ttl_s: float = 300):
+        """
+        Args:
+            enabled (bool): Whether lookups may be skipped at all.
+            min_chars (int): Inputs shorter than this are trivial.
+            max_sessions (int): Sessions whose memory count is remembered, the least recently used are forgotten.
+            zero_ttl_s (float): Seconds a count of zero is trusted before the session is probed again.
+        """
+        self.enabled = enabled
+        self.min_chars = min_chars
+        self.max_sessions = max_sessions
+        self.zero_ttl_s = zero_ttl_s
+        self.stats = {"retrieve": 0, "no_memories": 0, "trivial_input": 0, "seconds_saved": 0.0, "reprobes": 0}
+        self._counts = OrderedDict()
+        # When each zero count was recorded
+        self._zero_since = {}
+        # Sessions whose zero count expired and that need a new probe
+        self._reprobe = set()
+        # Memories saved for sessions whose probe has not reported yet, bounded like the counts
+        self._unconfirmed_adds = OrderedDict()
+        # Moving average of the retrieval latency, what a skipped lookup is estimated to save
+        self._average_latency = None
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates a gate configured from RETRIEVAL_GATE_* environment variables.
+        """
+        return cls(enabled=os.environ.get("RETRIEVAL_GATE", "true").lower() == "true",
+                   min_chars=int(os.environ.get("RETRIEVAL_GATE_MIN_CHARS", 5)),
+                   zero_ttl_s=float(os.environ.get("RETRIEVAL_GATE_ZERO_TTL_S", 300)))
+
+    ############################################################################################################
+
+    def is_informative(self, text: str) -> bool:
+        text = text.strip().lower()
+        if len(text) < self.min_chars:
+            return False
+        words = _WORD.findall(text)
+        return any(word not in TRIVIAL_WORDS for word in words)
+
+    def get_count(self, key: Hashable) -> Optional[int]:
+        """
+        Returns the known memory count of a session, None when unknown or when its zero count expired.
+        """
+        count = self._counts.get(key)
+        if count == 0 and time.monotonic() - self._zero_since.get(key, 0) > self.zero_ttl_s:
+            del self._counts[key]
+            self._zero_since.pop(key, None)
+            self._reprobe.add(key)
+            return None
+        return count
+
+    def needs_probe(self, key: Hashable) -> bool:
+        """
+        Whether the session's count expired and should be probed again (reported once).
+        """
+        if key in self._reprobe:
+            self._reprobe.discard(key)
+            self.stats["reprobes"] += 1
+            return True
+        return False
+
+    def _set(self, key: Hashable, count: int) -> None:
+        self._counts[key] = count
+        self._counts.move_to_end(key)
+        if count == 0:
+            self._zero_since[key] = time.monotonic()
+        else:
+            self._zero_since.pop(key, None)
+        while len(self._counts) > self.max_sessions:
+            evicted, _ = self._counts.popitem(last=False)
+            self._zero_since.pop(evicted, None)
+
+    def set_count(self, key: Hashable, count: int) -> None:
+        """
+        Records the memory count of a session found by a probe.
+        """
+        # Memories saved while the probe ran may be missing from its count, overcounting is harmless
+        self._set(key, count + self._unconfirmed_adds.pop(key, 0))
+        self._reprobe.discard(key)
+
+    def add(self, key: Hashable, count: int = 1) -> None:
+        """
+        Records memories saved for a session.
+        """
+        if key in self._counts:
+            self._set(key, self._counts[key] + count)
+        else:
+            self._unconfirmed_adds[key] = self._unconfirmed_adds.pop(key, 0) + count
+            while len(self._unconfirmed_adds) > self.max_sessions:
+                self._unconfirmed_adds.popitem(last=False)
+
+    def reset_user(self, user_id: str) -> None:
+        """
+        Records that every memory of the user has been deleted (keys are (user_id, session_id) pairs).
+        """
+        for key in [key for key in self._counts if key[0] == user_id]:
+            self._set(key, 0)
+        for key in [key for key in self._unconfirmed_adds if key[0] == user_id]:
+            del self._unconfirmed_adds[key]
+
+    ############################################################################################################
+
+    def decide(self, key: Hashable, text: str) -> str:
+        """
+        Returns "retrieve", or the reason the lookup is skipped ("no_memories", "trivial_input").
+        """
+        if self.get_count(key) == 0:
+            decision = "no_memories"
+        elif not self.is_informative(text):
+            decision = "trivial_input"
+        else:
+            decision = "retrieve"
+        if decision != "retrieve" and not self.enabled:
+            decision = "retrieve"
+        self.stats[decision] += 1
+        RETRIEVAL_GATE_DECISIONS.inc(decision=decision)
+        if decision != "retrieve" and self._average_latency is not None:
+            self.stats["seconds_saved"] += self._average_latency
+            RETRIEVAL_GATE_SECONDS_SAVED.inc(self._average_latency)
+        return decision
+
+    def observe_latency(self, seconds: float) -> None:
+        if self._average_latency is None:
+            self._average_latency = seconds
+        else:
+            self._average_latency = 0.9 * self._average_latency + 0.1 * seconds
+
+    def get_stats(self) -> dict:
+        decided = self.stats["retrieve"] + self.stats["no_memories"] + self.stats["trivial_input"]
+        skipped = decided - self.stats["retrieve"]
+        return {**self.stats,
+                "skip_rate": skipped / decided if decided else 0.0,
+                "average_retrieval_ms": (self._average_latency or 0) * 1000,
+                "sessions_counted": len(self._counts)}
@@ -0,0 +1,239 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Hashable, List, Tuple
+from utils.metrics import Counter, Gauge
+
+MEMORY_RETRIEVAL = Counter(
+    "sage_memory_retrieval_total",
+    "Long-term memory retrieval outcomes (ok, timeout, error, late_result_used, circuit_open, hedged, hedge_won).",
+    labelnames=("outcome",),
+)
+MEMORY_CIRCUIT_OPEN = Gauge(
+    "sage_memory_retrieval_circuit_open",
+    "1 while the circuit breaker skips remote memory retrieval.",
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised instead of calling the remote vector store while the circuit breaker is open.
+    """
+
+
+def _merge(results: list, extra: list, k: int) -> List[Tuple[str, float]]:
+    merged = dict(results)
+    for memory, score in extra:
+        merged[memory] = max(score, merged.get(memory, 0))
+    return sorted(merged.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class RetrievalGuard:
+    """
+    Bounds the time long-term memory retrieval may cost a turn.
+
+    - `run` gives the whole retrieval a deadline, when one is set. When it expires the turn goes on without
+      memories and the retrieval finishes in the background; its result is added to the next turn of the
+      same session. There is none by default: embedding the query with e5-large on CPU plus a Pinecone
+      round trip easily takes several hundred ms, set it from the `latency_p95_ms` reported by get_stats.
+    - `call` wraps the remote vector store query with a circuit breaker: after `breaker_failures`
+      consecutive failed calls, remote queries are skipped for `breaker_cooldown_s`, then a single trial
+      call decides whether to close it again. Slow answers are still answers and do not count.
+    - With `hedge`, a second identical query is sent when the first has not answered after the p95 of
+      the recent latencies, and the first answer wins.
+    """
+
+    def __init__(self, deadline_ms: float = None, hedge: bool = False, hedge_min_ms: float = 20,
+                 breaker_failures: int = 5, breaker_cooldown_s: float = 30, late_ttl_s: float = 120,
+                 latency_window: int = 200):
+        """
+        Args:
+            deadline_ms (float): Time budget of a retrieval, None or 0 for no deadline.
+            hedge (bool): Whether slow remote queries are hedged.
+            hedge_min_ms (float): Lower bound of the hedging delay.
+            breaker_failures (int): Consecutive failures opening the circuit breaker.
+            breaker_cooldown_s (float): How long the open breaker skips remote queries.
+            late_ttl_s (float): How long a late result is kept for the next turn.
+            latency_window (int): Number of recent query latencies the hedging delay and p95 are computed from.
+        """
+        self.deadline = deadline_ms / 1000 if deadline_ms else None
+        self.hedge = hedge
+        self.hedge_min = hedge_min_ms / 1000
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown_s = breaker_cooldown_s
+        self.late_ttl_s = late_ttl_s
+        self.stats = {"ok": 0, "timeout": 0, "error": 0, "late_result_used": 0,
+                      "circuit_open": 0, "hedged": 0, "hedge_won": 0}
+        self._latencies = deque(maxlen=latency_window)
+        self._late = {}
+        self._failures = 0
+        self._open_until = None
+        self._trial_running = False
+
+    @classmethod
+    def from_env(cls):
+        """
+        Creates a guard configured from RETRIEVAL_* environment variables.
+        """
+        return cls(deadline_ms=float(os.environ.get("RETRIEVAL_DEADLINE_MS", 0)),
+                   hedge=os.environ.get("RETRIEVAL_HEDGE", "false").lower() == "true",
+                   hedge_min_ms=float(os.environ.get("RETRIEVAL_HEDGE_MIN_MS", 20)),
+                   breaker_failures=int(os.environ.get("RETRIEVAL_BREAKER_FAILURES", 5)),
+                   breaker_cooldown_s=float(os.environ.get("RETRIEVAL_BREAKER_COOLDOWN_S", 30)),
+                   late_ttl_s=float(os.environ.get("RETRIEVAL_LATE_TTL_S", 120)))
+
+    def _record(self, outcome: str) -> None:
+        self.stats[outcome] += 1
+        MEMORY_RETRIEVAL.inc(outcome=outcome)
+
+    ############################################################################################################
+
+    async def run(self, key: Hashable, fetch: Callable[[], Awaitable[list]], k: int) -> List[Tuple[str, float]]:
+        """
+        Runs a retrieval within the deadline.
+
+        Args:
+            key (Hashable): Identifies the session a late result is kept for.
+            fetch (callable): Returns the retrieval coroutine, which yields (memory, score) pairs.
+            k (int): The maximum number of results.
+
+        Returns:
+            List[Tuple[str, float]]: The memories found in time, plus the late result of the previous turn.
+        """
+        late = self._pop_late(key)
+        task = asyncio.create_task(fetch())
+        try:
+            results = await asyncio.wait_for(asyncio.shield(task), self.deadline)
+            self._record("ok")
+        except asyncio.TimeoutError:
+            self._record("timeout")
+            logging.warning(f"Memory retrieval missed its {self.deadline * 1000:.0f} ms deadline, continuing without memories")
+            task.add_done_callback(lambda done: self._store_late(key, done))
+            results = []
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        except Exception as e:
+            self._record("error")
+            logging.error(f"Memory retrieval failed: {e}")
+            results = []
+        if late:
+            self._record("late_result_used")
+            results = _merge(results, late, k)
+        return results
+
+    def _store_late(self, key: Hashable, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is not None or not task.result():
+            return
+        self._late[key] = (task.result(), time.monotonic())
+        # Drop the late results nobody came back for
+        for stale_key in [late_key for late_key, (_, stored) in self._late.items() if time.monotonic() - stored > self.late_ttl_s]:
+            del self._late[stale_key]
+
+    def _pop_late(self, key: Hashable) -> list:
+        entry = self._late.pop(key, None)
+        if entry is None or time.monotonic() - entry[1] > self.late_ttl_s:
+            return []
+        return entry[0]
+
+    ############################################################################################################
+
+    @property
+    def circuit_open(self) -> bool:
+        return self._open_until is not None and time.monotonic() < self._open_until
+
+    def _allow(self) -> bool:
+        if self._open_until is None:
+            return True
+        if time.monotonic() < self._open_until or self._trial_running:
+            return False
+        # Cooldown over: let one trial call through
+        self._trial_running = True
+        return True
+
+    def _on_success(self, duration: float) -> None:
+        self._latencies.append(duration)
+        self._failures = 0
+        self._trial_running = False
+        if self._open_until is not None:
+            logging.info("Memory retrieval circuit breaker closed")
+            self._open_until = None
+            MEMORY_CIRCUIT_OPEN.set(0)
+
+    def _on_failure(self) -> None:
+        self._failures += 1
+        if self._trial_running or self._failures >= self.breaker_failures:
+            if not self.circuit_open:
+                logging.warning(f"Memory retrieval circuit breaker open for {self.breaker_cooldown_s}s "
+                                f"after {self._failures} failed queries")
+            self._open_until = time.monotonic() + self.breaker_cooldown_s
+            MEMORY_CIRCUIT_OPEN.set(1)
+        self._trial_running = False
+
+    def latency_p95(self):
+        """
+        The p95 of the recent query latencies in seconds, None until enough queries were measured.
+        """
+        if len(self._latencies) < 20:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def hedge_delay(self):
+        """
+        The hedging delay: the p95 of the recent query latencies, None until enough queries were measured.
+        """
+        p95 = self.latency_p95() if self.hedge else None
+        return max(p95, self.hedge_min) if p95 is not None else None
+
+    async def call(self, query: Callable[[], Awaitable]):
+        """
+        Calls the remote vector store through the circuit breaker, hedged when enabled.
+
+        Args:
+            query (callable): Returns the query coroutine, called again for the hedged request.
+
+        Raises:
+            CircuitOpenError: While the breaker is open.
+        """
+        if not self._allow():
+            self._record("circuit_open")
+            raise CircuitOpenError("Remote memory retrieval is paused by the circuit breaker")
+
+        start_time = time.perf_counter()
+        first = asyncio.create_task(query())
+        pending, error = {first}, None
+        delay = self.hedge_delay()
+        try:
+            while pending:
+                timeout = None if delay is None else max(delay - (time.perf_counter() - start_time), 0)
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self._record("hedged")
+                    pending.add(asyncio.create_task(query()))
+                    delay = None
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self._record("hedge_won")
+                        self._on_success(time.perf_counter() - start_time)
+                        return task.result()
+                    error = task.exception()
+            self._on_failure()
+            raise error
+        except asyncio.CancelledError:
+            # An abandoned call says nothing about the backend
+            self._trial_running = False
+            raise
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "breaker_open": self.circuit_open, "hedge_delay_ms": (self.hedge_delay() or 0) * 1000,
+                "latency_p95_ms": (self.latency_p95() or 0) * 1000,
+                "deadline_ms": self.deadline * 1000 if self.deadline is not None else None,
+                "late_results": len(self._late)}
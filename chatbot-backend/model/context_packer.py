@@ -0,0 +1,138 @@
+import os
+import logging
+from typing import List, Tuple
+from langchain_core.messages import AIMessage, HumanMessage
+from model.prompt_manager import PromptManager
+from model.token_counter import TokenCounter
+
+## Prompt token budget per turn (Ollama's default context window), the reply budget is taken out of it
+DEFAULT_CONTEXT_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 2048))
+## Share of the free budget reserved for recall memories before the older messages are added
+MEMORY_BUDGET_SHARE = float(os.environ.get("CONTEXT_MEMORY_SHARE", 0.3))
+## Items are only shortened when at least this many tokens of them fit
+MIN_FRAGMENT_TOKENS = 32
+
+
+class ContextPacker:
+    """
+    Fills the prompt of a turn up to a token budget.
+
+    The system prompt, the emotional guidance and the user's latest message are always included (the
+    guidance is dropped and the message shortened if they do not fit on their own). The remaining
+    budget is filled with the highest-scoring memories and the most recent messages; the oldest
+    messages and the lowest-scoring memories are dropped first, and the last memory that does not fit
+    is shortened when worthwhile.
+    Token counts come from the cached counts of the TokenCounter.
+    """
+
+    def __init__(self, prompt_manager: PromptManager, token_counter: TokenCounter, max_tokens: int,
+                 context_budget: int = DEFAULT_CONTEXT_BUDGET, memory_share: float = MEMORY_BUDGET_SHARE):
+        """
+        Args:
+            prompt_manager (PromptManager): The prompt manager whose template is filled.
+            token_counter (TokenCounter): Token counter using the tokenizer of the model.
+            max_tokens (int): Number of tokens reserved for the reply.
+            context_budget (int): Total number of tokens of the prompt and the reply.
+            memory_share (float): Share of the free budget reserved for recall memories.
+        """
+        self.prompt_manager = prompt_manager
+        self.token_counter = token_counter
+        self.budget = min(context_budget, prompt_manager.max_context_tokens) - max_tokens
+        self.memory_share = memory_share
+
+    def shorten(self, text: str, max_tokens: int) -> str:
+        """
+        Cuts `text` at a word boundary so that it fits in `max_tokens` tokens.
+        """
+        count = self.token_counter.count_text(text)
+        while count > max_tokens and text:
+            # Keep a proportional share of the text, at least one character less than before
+            keep = min(len(text) - 1, int(len(text) * max_tokens / count))
+            text = text[:keep].rsplit(" ", 1)[0] if " " in text[:keep] else text[:keep]
+            count = self.token_counter.count_text(text)
+        return text
+
+    def _take_memories(self, scored_memories, budget: int, packed: list, shorten_last: bool) -> int:
+        """
+        Adds memories best-first while they fit and returns the number of tokens used.
+        With `shorten_last`, the first memory that does not fit is shortened to the remaining budget.
+        """
+        used = 0
+        for memory, _ in scored_memories[len(packed):]:
+            # Memories are joined with a newline
+            cost = self.token_counter.count_text(memory) + 1
+            if used + cost > budget:
+                if shorten_last and budget - used - 1 >= MIN_FRAGMENT_TOKENS:
+                    memory = self.shorten(memory, budget - used - 1)
+                    packed.append(memory)
+                    used += self.token_counter.count_text(memory) + 1
+                break
+            packed.append(memory)
+            used += cost
+        return used
+
+    def pack(self,
+             detected_emotion: str,
+             emotion_guidance: str,
+             scored_memories: List[Tuple[str, float]],
+             stm_messages: List[HumanMessage | AIMessage]) -> Tuple[dict, int]:
+        """
+        Selects the prompt content of the turn.
+
+        Args:
+            detected_emotion (str): The detected emotion of the user.
+            emotion_guidance (str): The emotion-specific prompt to guide the response.
+            scored_memories (list[tuple[str, float]]): Retrieved memories with their relevance scores.
+            stm_messages (list[HumanMessage | AIMessage]): Short-term memory, the user's latest message last.
+
+        Returns:
+            tuple[dict, int]: The prompt template inputs and their total token count.
+        """
+        counter = self.token_counter
+        history, latest = list(stm_messages[:-1]), stm_messages[-1]
+
+        # Mandatory part: template, system prompt, emotion and the latest message
+        used = self.prompt_manager.calculate_total_tokens(counter, detected_emotion, emotion_guidance, [], [latest])
+        if used > self.budget and emotion_guidance:
+            emotion_guidance = ""
+            used = self.prompt_manager.calculate_total_tokens(counter, detected_emotion, emotion_guidance, [], [latest])
+        latest_tokens = counter.count_text(latest.content)
+        if used > self.budget and latest_tokens > MIN_FRAGMENT_TOKENS:
+            content = self.shorten(latest.content, max(latest_tokens - (used - self.budget), MIN_FRAGMENT_TOKENS))
+            latest = latest.model_copy(update={"content": content})
+            used = self.prompt_manager.calculate_total_tokens(counter, detected_emotion, emotion_guidance, [], [latest])
+            logging.warning(f"Latest message shortened from {latest_tokens} tokens to fit the context budget of {self.budget}")
+        if used > self.budget:
+            logging.warning(f"System prompt and latest message take {used} tokens, over the context budget of {self.budget}")
+
+        # Memories first up to their share, then the newest messages, then more memories with what is left
+        scored_memories = sorted(scored_memories, key=lambda item: item[1], reverse=True)
+        memories = []
+        free = max(self.budget - used, 0)
+        used += self._take_memories(scored_memories, int(free * self.memory_share), memories, shorten_last=False)
+
+        kept = []
+        for message in reversed(history):
+            cost = counter.count_text(message.content) + counter.message_overhead
+            if used + cost > self.budget:
+                break
+            kept.append(message)
+            used += cost
+        kept.reverse()
+
+        if len(memories) < len(scored_memories):
+            used += self._take_memories(scored_memories, self.budget - used, memories, shorten_last=True)
+
+        dropped_messages = len(history) - len(kept)
+        dropped_memories = len(scored_memories) - len(memories)
+        if dropped_messages or dropped_memories:
+            logging.info(f"Context packing dropped {dropped_messages} messages and {dropped_memories} memories "
+                         f"to fit {used}/{self.budget} tokens")
+
+        inputs = {
+            "messages": kept + [latest],
+            "detected_emotion": detected_emotion,
+            "emotion_prompt": emotion_guidance,
+            "recall_memories": "\n".join(memories),
+        }
+        return inputs, used
@@ -1,13 +1,20 @@
+import os
 import logging
 from typing import List
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from model.token_counter import TokenCounter
 
+## "legacy": memories and emotion are part of the system message ahead of the conversation.
+## "prefix_cache": the system prompt is sent unchanged as the first message and the per-turn context
+## follows the conversation, so the LLM server can reuse the prefilled prefix across turns.
+PROMPT_LAYOUTS = ("legacy", "prefix_cache")
+DEFAULT_PROMPT_LAYOUT = os.environ.get("PROMPT_LAYOUT", "legacy")
 
 
 class PromptManager:
     
-    def __init__(self, system_prompt: str, max_context_tokens: int = 128_000):
+    def __init__(self, system_prompt: str, max_context_tokens: int = 128_000, layout: str = DEFAULT_PROMPT_LAYOUT):
         """
         Initializes the PromptManager.
 
@@ -15,9 +22,20 @@ class PromptManager:
             system_prompt (str): The base system prompt template.
             emotion_prompts (dict): A dictionary mapping emotions to specific prompts.
             max_context_tokens (int): Maximum allowed tokens for the prompt.
+            layout (str): The prompt layout, one of PROMPT_LAYOUTS (defaults to the PROMPT_LAYOUT env var).
         """
-        self.prompt_template = self.create_prompt_template(system_prompt)
+        if layout not in PROMPT_LAYOUTS:
+            raise ValueError(f"Unknown prompt layout '{layout}', expected one of {PROMPT_LAYOUTS}")
+        self.layout = layout
+        if layout == "prefix_cache":
+            self.prompt_template = self.create_prefix_cache_prompt_template(system_prompt)
+        else:
+            self.prompt_template = self.create_prompt_template(system_prompt)
         self.max_context_tokens = max_context_tokens
+        # The fixed part of the prompt, counted once by the token counter
+        self.template_messages = self.prompt_template.format_messages(
+            recall_memories="", detected_emotion="", emotion_prompt="", messages=[]
+        )
 
 
     def create_prompt_template(self, system_prompt) -> ChatPromptTemplate:
@@ -40,6 +58,32 @@ class PromptManager:
             ]
         )
 
+
+    def create_prefix_cache_prompt_template(self, system_prompt) -> ChatPromptTemplate:
+        """
+        Creates a ChatPromptTemplate whose first message is the system prompt, byte for byte.
+
+        The system prompt is passed as a message (not a template) so it is never reformatted, and the
+        recall memories and emotional guidance are added as a second system message after the conversation.
+        Only the tokens after the previous turn's input change, the rest of the prompt is a reusable prefix.
+        Takes the same input variables as `create_prompt_template`.
+        """
+        return ChatPromptTemplate.from_messages(
+            [
+                SystemMessage(content=system_prompt),
+                ("placeholder", "{messages}"),
+                (
+                    "system",
+                    "## Recall Memories\n"
+                    "Recall memories are contextually retrieved based on the current conversation:\n"
+                    "{recall_memories}\n\n"
+                    "## Emotional Guidance\n"
+                    "The user's emotion has been detected as '{detected_emotion}' based on their input.\n"
+                    "{emotion_prompt}"
+                ),
+            ]
+        )
+
     def build_prompt_text(
         self, 
         detected_emotion: str, 
@@ -73,84 +117,45 @@ class PromptManager:
     
     
     def calculate_total_tokens(self, 
-                               detected_emotion: str, 
-                               emotion_prompt: str, 
-                               recall_memories: list[str], 
-                               stm_messages: list[AIMessage, HumanMessage],
-                               token_counter) -> int:
-        """
-        Calculates the total token usage for the constructed prompt.
-
-        Args:
-            detected_emotion (str): The detected emotion of the user.
-            emotion_prompt (str): The emotion-specific prompt to guide the response.
-            recall_memories (list[str]): List of retrieved memories relevant to the conversation.
-            stm_messages (list[Union[AIMessage, HumanMessage]]): List of short-term memory (STM) messages.
-            token_counter (callable): Function to calculate token count.
-
-        Returns:
-            int: Total token count of the constructed prompt.
-        """
-        prompt_text = self.build_prompt_text(
-            detected_emotion=detected_emotion,
-            emotion_prompt=emotion_prompt,
-            recall_memories=recall_memories,
-            stm_messages=stm_messages,
-        )
-        return token_counter(prompt_text)
-    
-
-############################################################################################################
-
-    def str_token_counter(self, model, text: str) -> int:
-        """
-        Counts the number of tokens in a given text using the model's tokenizer.
-
-        Args:
-            text (str): The input text to be tokenized.
-
-        Returns:
-            int: The number of tokens in the input text.
-        """
-        token_ids = model.get_token_ids(text)
-        
-        return len(token_ids)
-    
-    ############################################################################################################    
-    def calculate_total_tokens(self, 
-                              model,
+                              token_counter: TokenCounter,
                               detected_emotion: str,
                               emotion_guidance: str,
                               recall_memories: List[str], 
                               stm_messages: List[HumanMessage | AIMessage]
                               ) -> int:
         """
-        Calculates the total number of tokens for the generated prompt text.
+        Calculates the total number of tokens of the prompt without rendering or re-tokenizing it.
+
+        The prompt is counted as the sum of its fragments: the fixed text of the template, the emotion,
+        the emotion guidance, each memory and each message. `token_counter` caches the count of every
+        fragment, so only the text that is new in this turn is tokenized.
 
         Args:
+            token_counter (TokenCounter): Token counter using the tokenizer of the model.
             detected_emotion (str): The detected emotion of the user.
-            emotion_prompt (str): The emotion-specific prompt to guide the response.
+            emotion_guidance (str): The emotion-specific prompt to guide the response.
             recall_memories (list[str]): List of retrieved memories relevant to the conversation.
             stm_messages (list[HumanMessage | AIMessage]): List of short-term memory (STM) messages.
 
         Returns:
             int: The total token count of the constructed prompt.
         """
-        # Build the full prompt text
-        prompt_text = self.build_prompt_text(detected_emotion, emotion_guidance, recall_memories, stm_messages) 
-        
-        # Count the number of tokens in the prompt text  
-        num_tokens = self.str_token_counter(model, prompt_text)
+        # Template messages rendered without any variable, counted once and then served from the cache
+        num_tokens = token_counter.count_messages(self.template_messages) + token_counter.prompt_overhead
+        num_tokens += token_counter.count_text(detected_emotion) + token_counter.count_text(emotion_guidance)
+        # Memories are joined with a newline
+        num_tokens += sum(token_counter.count_text(memory) + 1 for memory in recall_memories)
+        num_tokens += token_counter.count_messages(stm_messages)
         
         return num_tokens
     
     
     
-    def validate_prompt_size(self, model, detected_emotion, emotion_guidance, recall_memories, stm_messages, max_tokens: int) -> bool:
+    def validate_prompt_size(self, token_counter, detected_emotion, emotion_guidance, recall_memories, stm_messages, max_tokens: int) -> bool:
         
-        total_tokens = self.calculate_total_tokens(model, detected_emotion, emotion_guidance, recall_memories, stm_messages)
+        total_tokens = self.calculate_total_tokens(token_counter, detected_emotion, emotion_guidance, recall_memories, stm_messages)
         if total_tokens > self.max_context_tokens - max_tokens:
             logging.error(f"Prompt exceeds token limit: {total_tokens} > {self.max_context_tokens - max_tokens}")
             return False
         
-        return True
\ No newline at end of file
+        return True
@@ -0,0 +1,105 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+## Hugging Face tokenizer per Ollama model family (the part of the model name before the tag).
+## Override with TOKENIZER_NAME. The repositories below are ungated copies of the Meta tokenizers.
+MODEL_TOKENIZERS = {
+    "llama3.2": "unsloth/Llama-3.2-1B-Instruct",
+    "llama3.1": "unsloth/Meta-Llama-3.1-8B-Instruct",
+    "llama3": "unsloth/llama-3-8b-Instruct",
+}
+
+## Llama 3 chat template: <|start_header_id|>role<|end_header_id|>\n\n ... <|eot_id|> around every message,
+## <|begin_of_text|> and the assistant header around the whole prompt
+MESSAGE_OVERHEAD_TOKENS = 5
+PROMPT_OVERHEAD_TOKENS = 5
+
+
+class TokenCounter:
+    """
+    Counts tokens with the tokenizer of the configured model and caches the count of every text fragment.
+
+    Prompts are counted as the sum of their fragments (system prompt, emotion prompt, each memory,
+    each message), so a turn only tokenizes the text it has not seen before.
+    """
+
+    def __init__(self, model_name: str, fallback_model=None, tokenizer_name: str = None, cache_size: int = None):
+        """
+        Args:
+            model_name (str): The Ollama model name, e.g. "llama3.2:1b".
+            fallback_model: A LangChain model whose `get_token_ids` is used when the tokenizer cannot be loaded.
+            tokenizer_name (str, optional): Hugging Face tokenizer to use instead of the mapped one.
+            cache_size (int, optional): Number of fragment counts to keep (TOKEN_CACHE_SIZE, default 4096).
+        """
+        family = model_name.split(":")[0]
+        self.model_name = model_name
+        self.tokenizer_name = tokenizer_name or os.environ.get("TOKENIZER_NAME") or MODEL_TOKENIZERS.get(family)
+        self.fallback_model = fallback_model
+        self.cache_size = cache_size or int(os.environ.get("TOKEN_CACHE_SIZE", 4096))
+        self.message_overhead = MESSAGE_OVERHEAD_TOKENS
+        self.prompt_overhead = PROMPT_OVERHEAD_TOKENS
+        self.stats = {"hits": 0, "misses": 0}
+        self._tokenizer = None
+        self._encode = None
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._init_lock = threading.Lock()
+
+    def _load_encoder(self):
+        """
+        Loads the tokenizer once and returns a function mapping a text to its token ids.
+        """
+        if self._encode is not None:
+            return self._encode
+        with self._init_lock:
+            if self._encode is None:
+                try:
+                    if self.tokenizer_name is None:
+                        raise ValueError(f"No tokenizer known for model '{self.model_name}', set TOKENIZER_NAME")
+                    from transformers import AutoTokenizer
+                    self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name, token=os.environ.get("HUGGINGFACE_TOKEN"))
+                    self._encode = lambda text: self._tokenizer.encode(text, add_special_tokens=False)
+                    logging.info(f"Loaded tokenizer {self.tokenizer_name} for {self.model_name}")
+                except Exception as e:
+                    if self.fallback_model is None:
+                        raise
+                    logging.warning(f"Could not load tokenizer for {self.model_name}, falling back to the model's token counter: {e}")
+                    self._encode = self.fallback_model.get_token_ids
+        return self._encode
+
+    def warm_up(self) -> None:
+        """
+        Loads the tokenizer ahead of the first request.
+        """
+        self.count_text("Hello!")
+
+    def count_text(self, text) -> int:
+        """
+        Returns the number of tokens in `text`, from the cache when it was counted before.
+        """
+        if not text:
+            return 0
+        if not isinstance(text, str):
+            text = str(text)
+        with self._cache_lock:
+            count = self._cache.get(text)
+            if count is not None:
+                self._cache.move_to_end(text)
+                self.stats["hits"] += 1
+                return count
+            self.stats["misses"] += 1
+
+        count = len(self._load_encoder()(text))
+        with self._cache_lock:
+            self._cache[text] = count
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    def count_messages(self, messages) -> int:
+        """
+        Returns the number of tokens of `messages` as rendered by the chat template.
+        """
+        return sum(self.count_text(message.content) + self.message_overhead for message in messages)
@@ -0,0 +1,69 @@
+import json
+import asyncio
+from memory.ltm_writer import LTMWriter
+
+
+class FakeVectorStore:
+    """
+    Records the upserted memories, the texts in `bad_texts` fail every write they are part of.
+    """
+
+    embeddings = None
+
+    def __init__(self, bad_texts=(), error=ValueError("Metadata size exceeds the limit"), transient_failures=0):
+        self.bad_texts = set(bad_texts)
+        self.error = error
+        self.transient_failures = transient_failures
+        self.written = {}
+
+    async def aadd_texts(self, texts, metadatas, ids, namespace, batch_size):
+        if self.transient_failures:
+            self.transient_failures -= 1
+            raise ConnectionError("Connection refused")
+        if self.bad_texts.intersection(texts):
+            raise self.error
+        for text, id in zip(texts, ids):
+            self.written[(namespace, id)] = text
+
+
+async def _write_all(writer, texts):
+    for text in texts:
+        await writer.enqueue("user", text, {"session_id": "s"})
+    await writer.flush(timeout=5)
+
+
+def test_bad_memory_is_dead_lettered_and_others_written(tmp_path):
+    store = FakeVectorStore(bad_texts={"too large"})
+    dead_letter_path = tmp_path / "failed.jsonl"
+    writer = LTMWriter(store, batch_size=8, max_wait_ms=50, max_backoff_s=0, max_attempts=2,
+                       dead_letter_path=str(dead_letter_path))
+    texts = [f"memory {i}" for i in range(6)] + ["too large"] + [f"memory {i}" for i in range(6, 12)]
+
+    asyncio.run(_write_all(writer, texts))
+
+    assert sorted(store.written.values()) == sorted(text for text in texts if text != "too large")
+    failed = [json.loads(line) for line in dead_letter_path.read_text().splitlines()]
+    assert [record["text"] for record in failed] == ["too large"]
+    assert "Metadata size" in failed[0]["error"]
+
+
+def test_unclassified_errors_are_isolated_too(tmp_path):
+    store = FakeVectorStore(bad_texts={"bad"}, error=RuntimeError("rejected"))
+    writer = LTMWriter(store, batch_size=4, max_wait_ms=50, max_backoff_s=0, max_attempts=3,
+                       dead_letter_path=str(tmp_path / "failed.jsonl"))
+
+    asyncio.run(_write_all(writer, ["a", "bad", "b", "c"]))
+
+    assert sorted(store.written.values()) == ["a", "b", "c"]
+
+
+def test_transient_errors_are_retried_without_dead_letter(tmp_path):
+    store = FakeVectorStore(transient_failures=4)
+    dead_letter_path = tmp_path / "failed.jsonl"
+    writer = LTMWriter(store, batch_size=4, max_wait_ms=50, max_backoff_s=0, max_attempts=2,
+                       dead_letter_path=str(dead_letter_path))
+
+    asyncio.run(_write_all(writer, ["a", "b", "c"]))
+
+    assert sorted(store.written.values()) == ["a", "b", "c"]
+    assert not dead_letter_path.exists()
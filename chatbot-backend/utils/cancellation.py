@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import weakref
+import contextvars
+
+## Token of the request currently being processed, read by code that is not passed the token explicitly
+current_cancel_token = contextvars.ContextVar("current_cancel_token", default=None)
+
+
+class CancellationToken:
+    """
+    Cancellation signal scoped to one request.
+
+    Exposes `is_set()` so it can be used wherever an `asyncio.Event` was checked before.
+    Tasks linked with `link_task` are cancelled together with the token.
+    """
+
+    def __init__(self, owner: str = None):
+        self.owner = owner
+        self.reason = None
+        self._event = asyncio.Event()
+        self._tasks = weakref.WeakSet()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def is_set(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """
+        Cancels the token and every linked task that is still running.
+        """
+        if self._event.is_set():
+            return
+        self.reason = reason
+        self._event.set()
+        for task in list(self._tasks):
+            if not task.done():
+                task.cancel()
+        logging.info(f"Request of {self.owner} cancelled: {reason}")
+
+    def link_task(self, task: asyncio.Task) -> asyncio.Task:
+        """
+        Cancels `task` when the token is cancelled (immediately if it already is).
+        """
+        if self.cancelled:
+            task.cancel()
+        else:
+            self._tasks.add(task)
+        return task
+
+    async def wait(self) -> None:
+        await self._event.wait()
+
+
+class CancellationRegistry:
+    """
+    Keeps the live tokens of every user so `/cancel` only stops that user's requests.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+
+    def create(self, owner: str) -> CancellationToken:
+        """
+        Creates and registers a token for a new request of `owner`.
+        """
+        token = CancellationToken(owner)
+        self._tokens.setdefault(owner, weakref.WeakSet()).add(token)
+        return token
+
+    def release(self, token: CancellationToken) -> None:
+        """
+        Unregisters a finished request.
+        """
+        tokens = self._tokens.get(token.owner)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens[token.owner]
+
+    def cancel(self, owner: str, reason: str = "cancelled by user") -> int:
+        """
+        Cancels every live request of `owner`.
+
+        Returns:
+            int: The number of cancelled requests.
+        """
+        tokens = list(self._tokens.pop(owner, ()))
+        for token in tokens:
+            token.cancel(reason)
+        return len(tokens)
+
+
+cancellations = CancellationRegistry()
+
+####################################################################################################
+
+async def iterate_until_cancelled(async_iterable, token: CancellationToken = None):
+    """
+    Yields from `async_iterable` until it is exhausted or `token` is cancelled.
+
+    The source is consumed by a producer task, so a cancellation also interrupts a pending
+    step (e.g. a model that has not produced its next token yet) and the upstream work stops.
+    """
+    if token is None:
+        async for item in async_iterable:
+            yield item
+        return
+
+    queue = asyncio.Queue(maxsize=64)
+
+    async def produce():
+        async for item in async_iterable:
+            await queue.put(item)
+
+    producer = token.link_task(asyncio.create_task(produce()))
+    cancel_wait = asyncio.ensure_future(token.wait())
+    try:
+        while not token.cancelled:
+            if not queue.empty():
+                item = queue.get_nowait()
+            elif producer.done():
+                break
+            else:
+                getter = asyncio.ensure_future(queue.get())
+                await asyncio.wait({getter, producer, cancel_wait}, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    # Cancelled, or the source finished: drain what is left on the next iteration
+                    getter.cancel()
+                    continue
+                item = getter.result()
+            yield item
+    finally:
+        cancel_wait.cancel()
+        if not producer.done():
+            producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+    if not producer.cancelled() and producer.exception() is not None:
+        raise producer.exception()
+
+
+async def cancel_on_disconnect(request, token: CancellationToken, interval: float = 0.25) -> None:
+    """
+    Cancels `token` as soon as the HTTP client of `request` disconnects.
+    Run it as a task and cancel the task once the request no longer needs watching.
+    """
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel("client disconnected")
+            return
+        await asyncio.sleep(interval)
@@ -0,0 +1,92 @@
+import os
+import asyncio
+import logging
+import threading
+import contextvars
+from functools import partial
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+## Default (kind, max_workers) per workload. Override with EXECUTOR_<NAME>_KIND / EXECUTOR_<NAME>_WORKERS,
+## e.g. EXECUTOR_AUDIO_CODEC_WORKERS=8. Process pools only accept picklable, module-level callables.
+POOL_DEFAULTS = {
+    "stt": ("thread", 2),
+    "emotion": ("thread", 2),
+    "embedding": ("thread", 2),
+    "auth": ("thread", 4),
+    "audio-codec": ("thread", 4),
+    "vector-store": ("thread", 4),
+    "checkpoint": ("thread", 2),
+}
+
+_executors = {}
+_lock = threading.Lock()
+
+####################################################################################################
+
+def _pool_settings(name: str):
+    kind, max_workers = POOL_DEFAULTS.get(name, ("thread", 2))
+    prefix = "EXECUTOR_" + name.upper().replace("-", "_")
+    kind = os.environ.get(f"{prefix}_KIND", kind).lower()
+    max_workers = int(os.environ.get(f"{prefix}_WORKERS", max_workers))
+    return kind, max_workers
+
+
+def get_executor(name: str) -> Executor:
+    """
+    Returns the named executor, creating it on first use.
+
+    Args:
+        name (str): The workload name (stt, emotion, embedding, auth, audio-codec, vector-store, checkpoint).
+
+    Returns:
+        Executor: A thread or process pool dedicated to the workload.
+    """
+    executor = _executors.get(name)
+    if executor is not None:
+        return executor
+
+    with _lock:
+        if name not in _executors:
+            kind, max_workers = _pool_settings(name)
+            if kind == "process":
+                _executors[name] = ProcessPoolExecutor(max_workers=max_workers)
+            elif kind == "thread":
+                _executors[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"pool-{name}")
+            else:
+                raise ValueError(f"Unknown executor kind '{kind}' for pool '{name}'")
+            logging.info(f"Created {kind} pool '{name}' with {max_workers} workers.")
+        return _executors[name]
+
+####################################################################################################
+
+async def run_in_pool(name: str, func, *args, **kwargs):
+    """
+    Runs a blocking callable in the named pool without blocking the event loop.
+
+    Args:
+        name (str): The workload name.
+        func (callable): The blocking function to run.
+        *args, **kwargs: Arguments passed to `func`.
+
+    Returns:
+        The return value of `func`.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor(name)
+    call = partial(func, *args, **kwargs)
+    if isinstance(executor, ThreadPoolExecutor):
+        # Carry request-scoped context variables (e.g. metric labels) into the worker thread
+        call = partial(contextvars.copy_context().run, call)
+    return await loop.run_in_executor(executor, call)
+
+####################################################################################################
+
+def shutdown_executors(wait: bool = True) -> None:
+    """
+    Shuts down every pool created so far.
+    """
+    with _lock:
+        for name, executor in _executors.items():
+            executor.shutdown(wait=wait, cancel_futures=True)
+            logging.info(f"Shut down pool '{name}'.")
+        _executors.clear()
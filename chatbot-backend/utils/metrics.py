@@ -0,0 +1,224 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+## Request-scoped default labels, bound once per request by the endpoint
+endpoint_label = contextvars.ContextVar("endpoint_label", default="internal")
+model_label = contextvars.ContextVar("model_label", default="none")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+TOKEN_BUCKETS = (128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192, 16384)
+
+
+def bind(endpoint: str = None, model: str = None) -> None:
+    """
+    Sets the endpoint and model labels used by every metric recorded in the current request.
+    """
+    if endpoint is not None:
+        endpoint_label.set(endpoint)
+    if model is not None:
+        model_label.set(model)
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _label_values(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) if name in labels else self._default_label(name)
+                     for name in self.labelnames)
+
+    @staticmethod
+    def _default_label(name: str) -> str:
+        if name == "endpoint":
+            return endpoint_label.get()
+        if name == "model":
+            return model_label.get()
+        return ""
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            lines.extend(self._render_series(label_values, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_series(self, label_values, value):
+        return [f"{self.name}{_format_labels(self.labelnames, label_values)} {value}"]
+
+
+class Gauge(_Metric):
+    """
+    Gauge that is either set explicitly or read from `callback` at scrape time.
+    The callback returns a number, or a dict of {label values tuple: number}.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self) -> list:
+        if self.callback is not None:
+            values = self.callback()
+            with self._lock:
+                self._values = values if isinstance(values, dict) else {(): values}
+        return super().render()
+
+    def _render_series(self, label_values, value):
+        return [f"{self.name}{_format_labels(self.labelnames, label_values)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [bucket counts..., +Inf count, sum]
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Context manager that observes the elapsed wall-clock time in seconds.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    async def timed(self, awaitable, **labels):
+        """
+        Awaits `awaitable` and observes how long it took.
+        """
+        with self.time(**labels):
+            return await awaitable
+
+    def _render_series(self, label_values, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, label_values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, label_values)
+        lines.append(f"{self.name}_sum{labels} {series[-1]}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render_metrics() -> str:
+    """
+    Renders every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+####################################################################################################
+## Per-turn stage latencies
+
+STAGE_SECONDS = Histogram(
+    "sage_stage_duration_seconds",
+    "Duration of a processing stage (stt_decode, stt_transcribe, emotion_detection, ltm_retrieval, "
+    "ltm_write, context_packing, tts_sentence, ...).",
+    labelnames=("stage", "endpoint", "model"),
+)
+
+TIME_TO_FIRST_TOKEN = Histogram(
+    "sage_time_to_first_token_seconds",
+    "Time from the start of a turn to the first generated token.",
+    labelnames=("endpoint", "model"),
+)
+
+TIME_TO_FIRST_AUDIO = Histogram(
+    "sage_time_to_first_audio_seconds",
+    "Time from the start of a voice request to the first audio chunk sent back.",
+    labelnames=("endpoint", "model", "pipeline"),
+)
+
+TOKENS_PER_SECOND = Histogram(
+    "sage_generation_tokens_per_second",
+    "Generation throughput after the first token.",
+    labelnames=("endpoint", "model"),
+    buckets=RATE_BUCKETS,
+)
+
+PROMPT_TOKENS = Histogram(
+    "sage_prompt_tokens",
+    "Number of prompt tokens sent to the model per turn, after context packing.",
+    labelnames=("endpoint", "model"),
+    buckets=TOKEN_BUCKETS,
+)
+
+####################################################################################################
+## Micro-batching
+
+BATCH_SIZE = Histogram(
+    "sage_batch_size",
+    "Number of items per micro-batch.",
+    labelnames=("batcher",),
+    buckets=BATCH_BUCKETS,
+)
+
+BATCH_WAIT_SECONDS = Histogram(
+    "sage_batch_wait_seconds",
+    "Time an item waits in the micro-batch queue before its batch starts.",
+    labelnames=("batcher",),
+)
@@ -0,0 +1,180 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future
+from utils.executors import run_in_pool
+from utils.metrics import BATCH_SIZE, BATCH_WAIT_SECONDS
+
+
+class MicroBatcher:
+    """
+    Groups concurrent single-item requests into batches for a batch function.
+
+    The first request of a batch waits at most `max_wait_ms` for others to join, up to `max_batch_size`
+    items. While a batch runs, new requests queue up and form the next batch, so batches grow with the load
+    and a lone request only pays the short wait.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 16, max_wait_ms: float = 5, pool: str = None, name: str = "batch"):
+        """
+        Args:
+            batch_fn (callable): Takes a list of items and returns the list of their results, in order.
+            max_batch_size (int): The maximum number of items per batch.
+            max_wait_ms (float): How long the first item of a batch waits for more items.
+            pool (str, optional): Executor pool running a blocking `batch_fn` (see utils.executors).
+            name (str): The batcher name used in the metrics.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pool = pool
+        self.name = name
+        self._loop = None
+        self._queue = None
+        self._worker = None
+
+    def _ensure_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._worker is not None and not self._worker.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        # Start the worker in an empty context so it does not inherit the labels of the first request
+        self._worker = contextvars.Context().run(loop.create_task, self._run())
+
+    async def submit(self, item):
+        """
+        Adds `item` to the next batch and returns its result.
+        """
+        self._ensure_worker()
+        future = self._loop.create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            # Requests abandoned by their caller are not computed
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                continue
+            items = [item for item, _, _ in batch]
+            started = time.perf_counter()
+            BATCH_SIZE.observe(len(items), batcher=self.name)
+            for _, _, queued in batch:
+                BATCH_WAIT_SECONDS.observe(started - queued, batcher=self.name)
+            try:
+                if self.pool is not None:
+                    results = await run_in_pool(self.pool, self.batch_fn, items)
+                else:
+                    results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: batch function returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                logging.error(f"Batch of {len(items)} items failed in {self.name}: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+class ThreadMicroBatcher:
+    """
+    Thread-safe counterpart of MicroBatcher for blocking callers, e.g. synchronous library code running
+    in executor threads. A daemon thread collects the requests and runs `batch_fn`.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 16, max_wait_ms: float = 5, name: str = "batch"):
+        """
+        Args:
+            batch_fn (callable): Takes a list of items and returns the list of their results, in order.
+            max_batch_size (int): The maximum number of items per batch.
+            max_wait_ms (float): How long the first item of a batch waits for more items.
+            name (str): The batcher name used in the metrics and the thread name.
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+
+    def submit(self, item) -> Future:
+        """
+        Adds `item` to the next batch and returns a future of its result.
+        """
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def run(self, items) -> list:
+        """
+        Submits every item and blocks until all their results are available.
+        """
+        futures = [self.submit(item) for item in items]
+        return [future.result() for future in futures]
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = [entry for entry in self._collect() if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items = [item for item, _, _ in batch]
+            started = time.perf_counter()
+            BATCH_SIZE.observe(len(items), batcher=self.name)
+            for _, _, queued in batch:
+                BATCH_WAIT_SECONDS.observe(started - queued, batcher=self.name)
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: batch function returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                logging.error(f"Batch of {len(items)} items failed in {self.name}: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,88 @@
+import time
+import asyncio
+import logging
+
+## Wall-clock time at which the process started importing the application
+PROCESS_START = time.time()
+
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class Readiness:
+    """
+    Tracks the warm-up state of the service components.
+
+    Components are registered with an async warm-up callable and warmed up in parallel.
+    The service is ready once every required component is ready.
+    """
+
+    def __init__(self):
+        self.components = {}
+        self.cold_start_seconds = None
+
+    def register(self, name: str, warm_up, required: bool = True):
+        """
+        Registers a component.
+
+        Args:
+            name (str): Component name reported by the health endpoints.
+            warm_up (callable): Coroutine function that initializes the component.
+            required (bool): Whether the component has to be ready for the service to be ready.
+        """
+        self.components[name] = {
+            "warm_up": warm_up,
+            "required": required,
+            "state": PENDING,
+            "seconds": None,
+            "error": None,
+        }
+
+    async def _warm_up_component(self, name: str):
+        component = self.components[name]
+        component["state"] = WARMING
+        start_time = time.perf_counter()
+        try:
+            await component["warm_up"]()
+            component["state"] = READY
+        except Exception as e:
+            component["state"] = FAILED
+            component["error"] = str(e)
+            logging.error(f"Warm-up of '{name}' failed: {e}")
+        finally:
+            component["seconds"] = round(time.perf_counter() - start_time, 3)
+            logging.info(f"Warm-up of '{name}' finished: {component['state']} in {component['seconds']}s")
+
+    async def warm_up_all(self):
+        """
+        Warms up every pending component concurrently and records the cold-start time.
+        """
+        names = [name for name, component in self.components.items() if component["state"] == PENDING]
+        await asyncio.gather(*(self._warm_up_component(name) for name in names))
+        if self.ready:
+            self.cold_start_seconds = round(time.time() - PROCESS_START, 3)
+            logging.info(f"Service ready, cold start took {self.cold_start_seconds}s")
+
+    @property
+    def ready(self) -> bool:
+        return all(component["state"] == READY
+                   for component in self.components.values() if component["required"])
+
+    def snapshot(self) -> dict:
+        """
+        Returns the state of every component together with the uptime and cold-start time.
+        """
+        return {
+            "ready": self.ready,
+            "uptime_seconds": round(time.time() - PROCESS_START, 3),
+            "cold_start_seconds": self.cold_start_seconds,
+            "components": {
+                name: {key: component[key] for key in ("state", "required", "seconds", "error")}
+                for name, component in self.components.items()
+            },
+        }
+
+
+readiness = Readiness()
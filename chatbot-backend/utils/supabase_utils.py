@@ -3,22 +3,38 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import json
 from supabase import create_client
 
 ## configure logging
 logging.basicConfig(level=logging.INFO)
 
-## Connect to Supabase
+## Connect to Supabase (the client is created on first use)
 url = os.environ.get("SUPABASE_URL")
 key = os.environ.get("SUPABASE_KEY")
 
-supabase = create_client(url, key)
+_supabase = None
+
+## Last fetched prompts, used when Supabase cannot be reached
+PROMPT_CACHE_PATH = os.environ.get("PROMPT_CACHE_PATH", os.path.join("data", "prompt_cache.json"))
+
+
+def get_supabase():
+    """
+    Lazily create and return the Supabase client.
+    """
+    global _supabase
+    if _supabase is None:
+        _supabase = create_client(url, key)
+    return _supabase
 
 
 def fetch_prompt_data(system_id=5, emotion_group_id=5):
     """
     Fetches the system and emotion prompts for the given system_id and emotion_id from the database.
     
+    The result is cached on disk so the service can start when Supabase is unreachable.
+    
     Args:
         system_id (int): The system_id for which to fetch the system prompt.
         emotion_group_id (int): The emotion_id for which to fetch the emotion prompts.
@@ -27,14 +43,42 @@ def fetch_prompt_data(system_id=5, emotion_group_id=5):
         str: The system prompt text.
         dict: A dictionary containing emotion prompts for each emotion.
     """
+    cache_key = f"{system_id}:{emotion_group_id}"
+    try:
+        supabase = get_supabase()
+        system_prompt_data = supabase.table('system_prompts').select("prompt_text").eq("id", system_id).execute()
+        system_prompt = system_prompt_data.data[0].get('prompt_text')
+        emotion_data = supabase.table('emotion_prompts').select("emotion", "prompt_text").eq("group_id", emotion_group_id).execute()
+        emotion_prompts = {dict['emotion']: dict['prompt_text'] for dict in emotion_data.data}
+    except Exception as e:
+        cached = _load_prompt_cache().get(cache_key)
+        if cached is None:
+            raise
+        logging.warning(f"Supabase unavailable ({e}), using cached prompts for {cache_key}.")
+        return cached["system_prompt"], cached["emotion_prompts"]
     
-    system_prompt_data = supabase.table('system_prompts').select("prompt_text").eq("id", system_id).execute()
-    system_prompt = system_prompt_data.data[0].get('prompt_text')
-    emotion_data = supabase.table('emotion_prompts').select("emotion", "prompt_text").eq("group_id", emotion_group_id).execute()
-    emotion_prompts = {dict['emotion']: dict['prompt_text'] for dict in emotion_data.data}
-    
+    _store_prompt_cache(cache_key, system_prompt, emotion_prompts)
     return system_prompt, emotion_prompts
 
+
+def _load_prompt_cache() -> dict:
+    try:
+        with open(PROMPT_CACHE_PATH, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _store_prompt_cache(cache_key: str, system_prompt: str, emotion_prompts: dict) -> None:
+    try:
+        cache = _load_prompt_cache()
+        cache[cache_key] = {"system_prompt": system_prompt, "emotion_prompts": emotion_prompts}
+        os.makedirs(os.path.dirname(PROMPT_CACHE_PATH) or ".", exist_ok=True)
+        with open(PROMPT_CACHE_PATH, "w") as file:
+            json.dump(cache, file)
+    except OSError as e:
+        logging.warning(f"Could not write prompt cache: {e}")
+
 ############################################################################################################
 
 def fetch_parameters(version_id: int) -> dict:
@@ -48,7 +92,7 @@ def fetch_parameters(version_id: int) -> dict:
         dict: A dictionary containing all parameters for the given version_id.
     """
     ## Fetch version data
-    version_data = supabase.table('new_versions').select('*').eq('id', version_id).execute()
+    version_data = get_supabase().table('new_versions').select('*').eq('id', version_id).execute()
     
     if not version_data.data:
         raise ValueError(f"Version with id {version_id} not found in the database.")
@@ -59,13 +103,13 @@ def fetch_parameters(version_id: int) -> dict:
     ## Fetch system prompt
     system_prompt_id = parameters.get('system_prompt_id')
     if system_prompt_id:
-        system_prompt_data = supabase.table('system_prompts').select("prompt_text").eq("id", system_prompt_id).execute()
+        system_prompt_data = get_supabase().table('system_prompts').select("prompt_text").eq("id", system_prompt_id).execute()
         parameters["system_prompt"] = system_prompt_data.data[0]["prompt_text"]
         
     ## Fetch emotion prompts
     emotion_prompt_group_id = parameters.get('emotion_prompt_id')
     if emotion_prompt_group_id:
-        emotion_prompts_data = supabase.table('emotion_prompts').select("emotion", "prompt_text").eq("group_id", emotion_prompt_group_id).execute()
+        emotion_prompts_data = get_supabase().table('emotion_prompts').select("emotion", "prompt_text").eq("group_id", emotion_prompt_group_id).execute()
         parameters["emotion_prompts"] = {
             item['emotion']: item['prompt_text'] for item in emotion_prompts_data.data
             } if emotion_prompts_data.data else None
@@ -81,7 +125,7 @@ def fetch_distinct_conv_ids():
     Returns:
         list: A sorted list of distinct conversation IDs.
     """
-    conv_ids_DB = supabase.rpc('distinct_values', {
+    conv_ids_DB = get_supabase().rpc('distinct_values', {
         'column_name': 'conv_id',
         'table_name': 'new_conversation_logs'
     }).execute()
@@ -106,7 +150,7 @@ def fetch_conversations(conv_id: int):
     Returns:
         list: A list of dictionaries containing the user inputs for the given conversation ID.
     """
-    conversation = supabase.table('new_conversation_logs').select('id','user_input').eq("conv_id", conv_id).execute()
+    conversation = get_supabase().table('new_conversation_logs').select('id','user_input').eq("conv_id", conv_id).execute()
     
     if not conversation.data:
         logging.warning(f"No user inputs found for conversation ID {conv_id}.")
@@ -140,7 +184,7 @@ def store_evaluation_results(response_records: list):
     logging.info("Storing evaluation results in the database...")
     for record in response_records:
         try:
-            result = supabase.table('new_evaluation').insert(record).execute()
+            result = get_supabase().table('new_evaluation').insert(record).execute()
             
             if not result.data:
                 logging.error(f"Failed to store evaluation record for log ID {record['log_id']}.")
@@ -261,6 +261,9 @@ const VoiceChat = ({ onSelectOption, sendAudioToBackend, setChatHistory }) => {
     try {
       const response = await fetch("http://127.0.0.1:8000/cancel", {
         method: "POST",
+        headers: {
+          Authorization: `Bearer ${localStorage.getItem("access_token")}`,
+        },
       });
       if (response.ok) {
         console.log("Cancellation confirmed on the server.");